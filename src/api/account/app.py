@@ -2,7 +2,7 @@ import os
 import re
 import json
 import stripe
-from models import UserModel, ATTRS_LOOKUP, ALERTS_LOOKUP
+from models import UserModel, ATTRS_LOOKUP, ALERTS_LOOKUP, get_alert_key_actions
 from utils import options, verify_user
 
 stripe.api_key = os.environ['STRIPE_SECRET_KEY']
@@ -44,6 +44,20 @@ def get_account(event):
     }
 
 
+def merge_alerts(alerts, updated_alerts):
+    for key, val in updated_alerts.items():
+        if key in ALERTS_LOOKUP:
+            # type(getattr(Alerts, 'sms')) == BooleanAttribute
+            expected_attr = ALERTS_LOOKUP[key]['attr']
+            expected_type = ATTRS_LOOKUP[expected_attr]
+            if type(val) == expected_type:
+                # a new webhook gets a clean failure count
+                if key == 'webhook' and alerts.get(key) != val:
+                    alerts['webhook_failures'] = 0
+                alerts[key] = val
+    return alerts
+
+
 def post_account(event):
     verified = verify_user(event)
 
@@ -65,16 +79,9 @@ def post_account(event):
 
         if 'alerts' in req_body:
             alerts = json.loads(user.to_json())['alerts']
-            updated_alerts = req_body['alerts']
-            for key, val in updated_alerts.items():
-                if key in ALERTS_LOOKUP:
-                    # type(getattr(Alerts, 'sms')) == BooleanAttribute
-                    expected_attr = ALERTS_LOOKUP[key]['attr']
-                    expected_type = ATTRS_LOOKUP[expected_attr]
-                    if type(val) == expected_type:
-                        alerts[key] = val
-            user.alerts = alerts
+            user.alerts = merge_alerts(alerts, req_body['alerts'])
             actions.append(UserModel.alerts.set(user.alerts))
+            actions += get_alert_key_actions(user.alerts)
 
         if 'in_beta' in req_body:
             in_beta = int(req_body['in_beta'])
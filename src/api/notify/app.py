@@ -2,34 +2,93 @@ import os
 import json
 import boto3
 import base64
+import hashlib
 import logging
-import requests
 from time import sleep
 from jinja2 import Template
+from functools import lru_cache
+from botocore.config import Config
+from threading import BoundedSemaphore, Lock
 from cryptography.fernet import Fernet
-from multiprocessing import Process, Pipe
+from concurrent.futures import \
+    ThreadPoolExecutor, Future, TimeoutError, wait, FIRST_COMPLETED
 from botocore.exceptions import ClientError
 from datetime import datetime, timedelta, timezone
 from pynamodb.attributes import UTCDateTimeAttribute
 from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
-from models import UserModel
+from models import \
+    UserModel, WriteBuffer, plan_alert_queries, get_alert_key_actions, ALERT_INDEXES
+from webhooks import WebhookDispatcher, WebhookError
+from recipients import RecipientProducer
+from journal import RunJournal
+from backfill import is_backfilled
+from s3cache import s3_cache
+from latest_signals import publish_latest
+from signal_history import publish_history
 from utils import \
     transform_signal, \
     error, enough_time_has_passed, \
     RES_HEADERS, get_email, TEST
 
+# max users being notified at once, sends are I/O bound so this can be
+# much higher than the 1-2 vcpus lambda gives us
+CONCURRENCY = int(os.environ.get('NOTIFY_CONCURRENCY', 128))
+# send emails in chunks with SES SendBulkEmail instead of one call per user
+BULK_EMAIL = str(os.environ.get('NOTIFY_BULK_EMAIL', True)).lower() == 'true'
+# SES takes at most 50 destinations per bulk call
+BULK_SIZE = 50
+# seconds a partial chunk waits for more recipients before it goes out anyway
+BULK_LINGER = 0.5
+# seconds a recipient waits for its chunk to go out before it counts as failed
+BULK_TIMEOUT = 30
+# max concurrent sends per channel, keeps one slow channel from using up
+# every worker and keeps email under the SES send rate
+# bulk emails wait for their chunk, so they need enough room to fill one
+# slots are taken before a user is handed to a worker, see get_channels
+CHANNEL_LIMITS = {
+    'Email': BULK_SIZE * 2 if BULK_EMAIL else 32, 'Webhook': 96, 'SMS': 8}
+channels = {channel: BoundedSemaphore(limit)
+            for channel, limit in CHANNEL_LIMITS.items()}
+REGION = 'us-east-1'
+CHARSET = 'UTF-8'
+# clients are reused across users and warm invocations
+clients = {}
+clients_lock = Lock()
+# webhooks that fail this many runs in a row get disabled
+MAX_WEBHOOK_FAILURES = 5
+webhooks = WebhookDispatcher()
+# last_sent updates are written in chunks, flushed at the end of each run
+writes = WriteBuffer()
+# sparse alert indexes deployed so far, AlertIndexes in template.yaml
+NUM_ALERT_INDEXES = int(os.environ.get('ALERT_INDEXES', 0))
+# a run stops taking new users with this much time left, so in flight
+# sends and the last checkpoint finish before lambda times out
+RESERVE_MS = 120 * 1000
+# max invocations chained for one signal
+MAX_CHAIN = 10
+# bulk email sender for the latest signal
+batchers = {}
+batchers_lock = Lock()
+
+
+@lru_cache(maxsize=8)
+def derive_key(password, salt):
+    # scrypt takes ~16MB and tens of ms on purpose,
+    # so it only runs once per container for each password and salt
+    kdf = Scrypt(
+        salt=salt,
+        length=32,
+        n=2**14,
+        r=8,
+        p=1,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(password))
+
 
 class Cryptographer:
-    def __init__(self, password, salt):
-        kdf = Scrypt(
-            salt=salt,
-            length=32,
-            n=2**14,
-            r=8,
-            p=1,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password))
-        self.f = Fernet(key)
+    def __init__(self, password=None, salt=None, key=None):
+        # key is a precomputed fernet key, e.g. derive_key(password, salt)
+        self.f = Fernet(key or derive_key(password, salt))
 
     def encrypt(self, plaintext):
         return self.f.encrypt(plaintext)
@@ -38,54 +97,215 @@ class Cryptographer:
         return self.f.decrypt(ciphertext)
 
 
+@lru_cache(maxsize=8)
+def get_cryptographer(key, password, salt):
+    return Cryptographer(password, salt, key)
+
+
+def get_client(name):
+    # boto3 clients are thread safe, but creating them is not
+    with clients_lock:
+        if name not in clients:
+            config = Config(max_pool_connections=CONCURRENCY)
+            clients[name] = boto3.client(name, region_name=REGION, config=config)
+        return clients[name]
+
+
+@lru_cache(maxsize=None)
+def get_template():
+    with open(os.path.join(os.path.dirname(__file__), 'template.html.jinja'), 'r') as file:
+        return Template(file.read())
+
+
+@lru_cache(maxsize=8)
+def render_email(key):
+    # only the recipient changes between users, so the email is rendered
+    # once per signal (keyed by its json) instead of once per user
+    signal = json.loads(key)
+    STAGE = os.environ['STAGE']
+    signal['Prefix'] = 'dev.' if STAGE == 'dev' else ''
+    # this is necessary because template expects boolean value
+    signal['Signal'] = signal['Signal'] == 'BUY'
+    subject = f"FORCEPU.SH: {signal['Asset']} (₿) Signal Alert"
+    body_text = ("Visit FORCEPU.SH to view the new signal.")
+    return {
+        'Body': {
+            'Html': {
+                'Charset': CHARSET,
+                'Data': get_template().render(signal),
+            },
+            'Text': {
+                'Charset': CHARSET,
+                'Data': body_text,
+            },
+        },
+        'Subject': {
+            'Charset': CHARSET,
+            'Data': subject,
+        },
+    }
+
+
+class EmailBatcher:
+    # Groups recipients into SES bulk calls. send() blocks until the chunk
+    # with the recipient went out and returns the recipient's own result,
+    # so callers can still track success per user.
+    def __init__(self, client, sender, template, size=BULK_SIZE, linger=BULK_LINGER,
+                 timeout=BULK_TIMEOUT):
+        self.client = client
+        self.sender = sender
+        self.template = template
+        self.size = size
+        self.linger = linger
+        self.timeout = timeout
+        self.lock = Lock()
+        self.chunk = []
+        self.calls = 0
+
+    def take(self, future=None):
+        # empties the current chunk, only if it holds future when given
+        with self.lock:
+            if future and not any(queued is future for _, queued in self.chunk):
+                return []
+            chunk, self.chunk = self.chunk, []
+            return chunk
+
+    def flush(self, chunk):
+        if not chunk:
+            return
+        self.calls += 1
+        try:
+            res = self.client.send_bulk_email(
+                FromEmailAddress=self.sender,
+                DefaultContent={
+                    'Template': {'TemplateName': self.template, 'TemplateData': '{}'}},
+                BulkEmailEntries=[
+                    {'Destination': {'ToAddresses': [recipient]}} for recipient, _ in chunk],
+            )
+        except Exception as e:
+            for _, future in chunk:
+                future.set_exception(e)
+            return
+        # results come back in the same order as the entries
+        results = res['BulkEmailEntryResults']
+        for idx, (recipient, future) in enumerate(chunk):
+            if idx < len(results):
+                future.set_result(results[idx])
+            else:
+                future.set_exception(Exception(f'No bulk email result for {recipient}.'))
+
+    def send(self, recipient):
+        future = Future()
+        with self.lock:
+            self.chunk.append((recipient, future))
+            full = len(self.chunk) >= self.size
+        if full:
+            self.flush(self.take())
+        try:
+            return future.result(timeout=self.linger)
+        except TimeoutError:
+            # nobody filled the chunk in time, send what's there
+            self.flush(self.take(future))
+            return future.result(timeout=self.timeout)
+
+
+def put_template(client, name, content):
+    template = {
+        'Subject': content['Subject']['Data'],
+        'Text': content['Body']['Text']['Data'],
+        'Html': content['Body']['Html']['Data'],
+    }
+    try:
+        client.update_email_template(TemplateName=name, TemplateContent=template)
+    except client.exceptions.NotFoundException:
+        client.create_email_template(TemplateName=name, TemplateContent=template)
+
+
+def get_template_name(key):
+    # named by its content so runs for different signals never share one
+    digest = hashlib.sha256(key.encode('UTF-8')).hexdigest()[:16]
+    return f"signal-alert-{os.environ['STAGE']}-{digest}"
+
+
+def get_batcher(signal):
+    # the rendered email is stored as an SES template once per signal
+    key = json.dumps(signal, sort_keys=True)
+    with batchers_lock:
+        if key not in batchers:
+            client = get_client('sesv2')
+            name = get_template_name(key)
+            put_template(client, name, render_email(key))
+            sender = get_email(os.environ['SIGNAL_EMAIL'], os.environ['STAGE'])
+            batchers.clear()
+            batchers[key] = EmailBatcher(client, sender, name)
+        return batchers[key]
+
+
+def delete_template(signal):
+    # SES keeps at most 10k templates, so a run's template goes once it's over
+    if not BULK_EMAIL:
+        return
+    key = json.dumps(signal, sort_keys=True)
+    with batchers_lock:
+        batchers.pop(key, None)
+    client = get_client('sesv2')
+    try:
+        client.delete_email_template(TemplateName=get_template_name(key))
+    except client.exceptions.NotFoundException:
+        pass
+
+
+def release(semaphores):
+    for semaphore in semaphores:
+        semaphore.release()
+
+
 class Processor:
-    def __init__(self, fx, data):
+    # Runs fx(item, data) for every item on a thread pool.
+    # At most `concurrency` items are in flight, so items stream straight
+    # from the query iterator and a slow webhook only holds up one thread.
+    # limits(item) returns the semaphores an item holds while it runs, they
+    # are acquired here before the item is submitted, so a worker never
+    # sits blocked waiting for one.
+    def __init__(self, fx, data, concurrency=CONCURRENCY, limits=None):
         self.fx = fx
         self.data = data
+        self.concurrency = concurrency
+        self.limits = limits
         self.total = 0
+        self.results = []
 
-    def run_process(self, conn):
-        # this condition prevents exit if val equals zero
-        while ((val := conn.recv()) or val is not None):
-            res = self.fx(val, self.data)
-            conn.send(res)
-
-    def await_process(self, process):
-        if process['awaiting']:
-            result = process['conn'].recv()
-            self.results.append(result)
-            process['awaiting'] = False
-
-    def end_process(self, process):
-        self.await_process(process)
-        process['conn'].send(None)
-        process['process'].join()
-
-    def process_item(self, process, item):
-        self.total += 1
-        self.await_process(process)
-        process['conn'].send(item)
-        process['awaiting'] = True
-
-    def create_process(self):
-        # create a pipe for communication
-        parent_conn, child_conn = Pipe(duplex=True)
-        # create the process, pass instance and connection
-        process = Process(target=self.run_process, args=(child_conn,))
-        enhanced = {'process': process, 'conn': parent_conn, 'awaiting': False}
-        process.start()
-        return enhanced
+    def collect(self, futures):
+        for future in futures:
+            try:
+                self.results.append(future.result())
+            except Exception as e:
+                logging.exception(e)
 
     def run(self, items):
         self.results = []
-        cpus = os.cpu_count()
-        processes = [self.create_process() for _ in range(cpus)]
-        [self.process_item(processes[idx % cpus], item)
-         for idx, item in enumerate(items)]
-        [self.end_process(process) for process in processes]
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for item in items:
+                if len(pending) >= self.concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self.collect(done)
+                held = self.limits(item) if self.limits else []
+                for semaphore in held:
+                    semaphore.acquire()
+                future = executor.submit(self.fx, item, self.data)
+                future.add_done_callback(lambda _, held=held: release(held))
+                pending.add(future)
+                self.total += 1
+            self.collect(wait(pending).done)
         return self.results
 
 
+def get_channels(user):
+    # the channel slots a user's alerts take, always in the same order
+    return [channels[channel] for channel in CHANNEL_LIMITS if user.alerts[channel.lower()]]
+
+
 def notify_user(user, signal):
     alerts = [
         {'fx': notify_email, 'type': 'Email'},
@@ -111,26 +331,89 @@ def notify_user(user, signal):
         alerts = user.alerts
         now = datetime.now(timezone.utc)
         alerts['last_sent'] = UTCDateTimeAttribute().serialize(now)
-        user.update(actions=[UserModel.alerts.set(alerts)])
+        # a disabled webhook also drops out of the webhook indexes
+        writes.add(user, [UserModel.alerts.set(alerts)] + get_alert_key_actions(alerts))
         if success:
             return user.email
 
 
-def skip_users(users, to_skip):
-    for user in users:
-        if user.email not in to_skip:
-            yield user
+def get_perf(preview):
+    # only the tail of the series is needed, and kept in the cache
+    hyperdrive = [data for data in preview['BTC']
+                  ['data'][-2:] if data['Name'] == 'hyperdrive'][0]
+    return hyperdrive['Bal'] - 1
+
+
+def get_alert_indexes():
+    # Sparse indexes only hold users whose keys are set, so they are used
+    # once backfill.py has set them for everyone with alerts on. Until then,
+    # and for indexes that aren't deployed yet, the audience indexes are queried.
+    indexes = ALERT_INDEXES[:NUM_ALERT_INDEXES]
+    if indexes and not is_backfilled(get_client('s3'), os.environ['S3_BUCKET']):
+        print('Alert index keys are not backfilled yet, see notify/backfill.py.')
+        return []
+    return indexes
+
+
+def get_recipients(journal):
+    # every index in the plan is read in parallel, and sends start
+    # as soon as the first page comes back, each user once
+    # the journal resumes each query after the users done in earlier runs
+    return RecipientProducer([
+        journal.source(
+            index.Meta.index_name,
+            lambda cursor, index=index, condition=condition: index.query(
+                1, filter_condition=condition, last_evaluated_key=cursor))
+        for index, condition in plan_alert_queries(indexes=get_alert_indexes())
+    ])
+
+
+def get_deadline(context):
+    if not context:
+        return lambda: False
+    return lambda: context.get_remaining_time_in_millis() < RESERVE_MS
+
+
+def flush_writes():
+    # these users were notified, but could be notified again within 12 hours
+    failed_writes = writes.flush()
+    if failed_writes:
+        print(f'Could not save last_sent for {len(failed_writes)} users.')
+
 
+def continue_run(event, context):
+    # picks the run back up in a fresh invocation from the last checkpoint
+    chain = event.get('chain', 0) + 1
+    get_client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps({**event, 'chain': chain}))
+    print(f'Continuing notifications in invocation {chain}.')
 
-def post_notify(event, _):
+
+def publish_signals():
+    # the emitter writes signals.csv before calling /notify, so this keeps
+    # the precomputed signals that /signals serves in step with the csv
+    for publish in [publish_latest, publish_history]:
+        try:
+            publish(get_client('s3'), os.environ['S3_BUCKET'])
+        except Exception as e:
+            # /signals falls back to the tail of the csv,
+            # history catches up with the next signal
+            print(f'Could not publish signals with {publish.__name__}: {e!r}')
+
+
+def post_notify(event, context):
     salt = os.environ['SALT'].encode('UTF-8')
     password = os.environ['CRYPT_PASS'].encode('UTF-8')
+    # CRYPT_KEY skips scrypt entirely, set it to derive_key(CRYPT_PASS, SALT)
+    key = os.environ.get('CRYPT_KEY', '').encode('UTF-8')
     emit_secret = os.environ['EMIT_SECRET']
 
     req_headers = event['headers']
     header = 'emit_secret'
     encrypted = req_headers[header] if header in req_headers else ''
-    cryptographer = Cryptographer(password, salt)
+    cryptographer = get_cryptographer(key, password, salt)
     decrypted = cryptographer.decrypt(encrypted).decode('UTF-8')
     if not decrypted == emit_secret:
         sleep(0 if TEST else 10)
@@ -138,49 +421,61 @@ def post_notify(event, _):
         return error(401, 'Provide a valid emit secret.')
     req_body = json.loads(event['body'])
     signal = transform_signal(req_body)
-    cond = (
-        UserModel.alerts['email'] == True  # noqa
-    ) | (
-        UserModel.alerts['sms'] == True  # noqa
-    ) | (
-        (UserModel.alerts['webhook'].exists()) &
-        (UserModel.alerts['webhook'] != '')
-    )
-    users_in_beta = UserModel.in_beta_index.query(1, filter_condition=cond)
-    s3 = boto3.client('s3')
-    obj = s3.get_object(
-        Bucket=os.environ['S3_BUCKET'], Key='data/api/preview.json')
-    preview = json.loads(obj['Body'].read())
-    hyperdrive = [data for data in preview['BTC']
-                  ['data'][-2:] if data['Name'] == 'hyperdrive'][0]
-    signal['Perf'] = hyperdrive['Bal'] - 1
-    processor = Processor(notify_user, signal)
-    notified = set(processor.run(users_in_beta))
-    users_subscribed = UserModel.subscribed_index.query(
-        1, filter_condition=cond)
-    # skip beta users who were already notified
-    users_to_notify = skip_users(users_subscribed, notified)
-    notified = notified.union(set(processor.run(users_to_notify)))
-    num_notified = len(notified)
-    total_users = processor.total
+    # the dispatcher outlives the run in a warm container
+    webhooks.reset()
+    publish_signals()
+    signal['Perf'] = s3_cache.get_json(
+        os.environ['S3_BUCKET'], 'data/api/preview.json', get_perf)
+    journal = RunJournal(os.environ['S3_BUCKET'], signal['Date'], get_client('s3'))
+    # retries for a signal that already went out don't notify anyone twice,
+    # and get the same answer as the run that finished
+    if journal.finished:
+        print(f"Notifications for {signal['Date']} already ran.")
+        return get_run_result(journal)
+    recipients = get_recipients(journal)
+    processor = Processor(journal.wrap(notify_user), signal, limits=get_channels)
+    try:
+        notified = set(processor.run(
+            journal.checkpoints(recipients, get_deadline(context), flush_writes)))
+    finally:
+        # a crash or timeout resumes from here on the next try
+        journal.state['total'] += processor.total
+        journal.state['notified'] += len([email for email in processor.results if email])
+        journal.save(flush_writes)
+    recipients.report(len([email for email in notified if email]))
+    if journal.stopped:
+        if event.get('chain', 0) + 1 >= MAX_CHAIN:
+            # a retry resumes the run and puts the template back
+            delete_template(signal)
+            return error(500, 'Notifications did not finish.')
+        continue_run(event, context)
+        return {
+            "statusCode": 202,
+            "body": json.dumps({'message': 'Notifications in progress.'}),
+            "headers": RES_HEADERS
+        }
+    delete_template(signal)
+    return get_run_result(journal)
+
+
+def get_run_result(journal):
+    # success is measured over every invocation of the run, the totals are
+    # kept in the journal so a retry after the run finished gets this too
+    num_notified = journal.state['notified']
+    total_users = journal.state['total']
     success_ratio = num_notified / total_users if total_users else 1
     if success_ratio < 0.95:
         # threshold is dependent on successful email AND webhook notifications
         # it's possible that users misconfigure webhook / don't send 2xx response
         # change user alerts schema so user.alerts.webhook.url and user.alerts.webhook.queue
-        # disable webhook after 5-10 misconfigured requests
+        # webhooks get disabled after MAX_WEBHOOK_FAILURES failed runs
         # but also make test route and btn, so users can try out
         # in POST /account, test if url is being set to "", if so, then also reset queue
         return error(500, 'Notifications failed to send.')
 
     # check that memory and timeout are being respected - print os.cpu_count()
-    # query in beta and/or sub index - time is 10s for 100k users (1s/10k users)
-    # can decrease query time by using 4-6 indices instead of 2
-    # 1. in_beta partition, notify_email range
-    # 2. in_beta partition, notify_webhook range
-    # 3. subscribed partition, notify_email range
-    # 4. subscribed partition, notify_webhook range
-    # etc for notify_sms
+    # users come from sparse per channel indexes, see plan_alert_queries
+    # add notify_sms indexes once sms alerts exist
 
     status_code = 200
     response = {'message': 'Notifications delivered.'}
@@ -193,21 +488,16 @@ def post_notify(event, _):
 
 
 def notify_email(user, signal):
-    STAGE = os.environ['STAGE']
-    sender = get_email(os.environ['SIGNAL_EMAIL'], STAGE)
     recipient = 'success@simulator.amazonses.com' if TEST else user.email
-    region = 'us-east-1'
-    charset = 'UTF-8'
-    client = boto3.client('sesv2', region_name=region)
-    subject = f"FORCEPU.SH: {signal['Asset']} (₿) Signal Alert"
-    body_text = ("Visit FORCEPU.SH to view the new signal.")
-    with open(os.path.join(os.path.dirname(__file__), 'template.html.jinja'), 'r') as file:
-        content = file.read()
-    template = Template(content)
-    signal['Prefix'] = 'dev.' if STAGE == 'dev' else ''
-    # this is necessary because template expects boolean value
-    signal['Signal'] = signal['Signal'] == 'BUY'
-    html = template.render(signal)
+    if BULK_EMAIL:
+        result = get_batcher(signal).send(recipient)
+        if result['Status'] != 'SUCCESS':
+            raise Exception(
+                f"Bulk email failed for {user.email}: {result['Status']} {result.get('Error', '')}")
+        return
+    sender = get_email(os.environ['SIGNAL_EMAIL'], os.environ['STAGE'])
+    client = get_client('sesv2')
+    content = render_email(json.dumps(signal, sort_keys=True))
     try:
         client.send_email(
             Destination={
@@ -215,24 +505,7 @@ def notify_email(user, signal):
                     recipient,
                 ],
             },
-            Content={
-                'Simple': {
-                    'Body': {
-                        'Html': {
-                            'Charset': charset,
-                            'Data': html,
-                        },
-                        'Text': {
-                            'Charset': charset,
-                            'Data': body_text,
-                        },
-                    },
-                    'Subject': {
-                        'Charset': charset,
-                        'Data': subject,
-                    },
-                }
-            },
+            Content={'Simple': content},
             FromEmailAddress=sender,
         )
     # verify signals email [dev] and [prod] on SES and use SES! - free for first 64k emails per month
@@ -258,13 +531,21 @@ def notify_webhook(user, signal):
     # RETURN LIST to account for future assets
     # will only be one-item list for now (just BTC)
     data = [signal]
-    response = requests.post(url, json=data, headers=headers)
-    if not response.ok:
-        # send error log for webhook res
+    alerts = user.alerts
+    failures = alerts['webhook_failures'] if 'webhook_failures' in alerts else 0
+    try:
+        webhooks.post(url, data, headers)
+    except WebhookError as e:
+        # saved with last_sent by notify_user
+        failures += 1
+        if failures >= MAX_WEBHOOK_FAILURES:
+            print(f'Disabling webhook for {user.email} after {failures} failed runs.')
+            alerts['webhook'] = ''
+            failures = 0
+        alerts['webhook_failures'] = failures
         raise Exception(
-            f'Webhook did not return 2xx response. User: {user.email}')
-    # else:
-    # send log for webhook res success
+            f'Webhook did not return 2xx response. User: {user.email}') from e
+    alerts['webhook_failures'] = 0
 
 
 def notify_sms(user, signal):
@@ -0,0 +1,43 @@
+# One-off: sets the sparse alert index keys for users who turned alerts on
+# before the keys existed, then writes a marker. notify only queries the
+# sparse indexes once the marker is there. Runs after every deploy and is a
+# no-op once the marker exists:
+#   TABLE_NAME=users-dev S3_BUCKET=... python src/api/notify/backfill.py
+import os
+import sys
+import json
+import boto3
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'shared', 'python'))  # noqa
+from models import backfill_alert_keys  # noqa
+
+BACKFILL_KEY = 'data/notify/alert_keys.json'
+
+
+def is_backfilled(client, bucket):
+    try:
+        client.head_object(Bucket=bucket, Key=BACKFILL_KEY)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+    return False
+
+
+def run_backfill(client, bucket):
+    # returns the number of users updated, or None if it already ran
+    if is_backfilled(client, bucket):
+        return
+    updated = backfill_alert_keys()
+    client.put_object(
+        Bucket=bucket, Key=BACKFILL_KEY,
+        Body=json.dumps({'updated': updated, 'date': datetime.now(timezone.utc).isoformat()}))
+    return updated
+
+
+if __name__ == '__main__':
+    updated = run_backfill(boto3.client('s3'), os.environ['S3_BUCKET'])
+    print('Alert index keys were already backfilled.' if updated is None
+          else f'Backfilled alert index keys for {updated} users.')
@@ -0,0 +1,129 @@
+import json
+import boto3
+from time import time
+from threading import Lock
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+
+JOURNAL_PREFIX = 'data/notify/runs'
+# seconds between checkpoints while a run is going
+CHECKPOINT_INTERVAL = 30
+
+
+class RunJournal:
+    # Progress of the notification run for one signal, stored in s3 as
+    # {JOURNAL_PREFIX}/{date}.json, so a retry or a chained invocation
+    # resumes where the last one stopped instead of re-reading every user.
+    # Each source (index query) keeps the cursor after the last user that
+    # was notified with every user before it notified too. Users done out
+    # of order past the cursor are kept in 'ahead' and skipped on resume.
+    # Kept in s3 rather than the users table since 'ahead' and the cursors
+    # are rewritten as one doc, and it has no 400KB item limit.
+    def __init__(self, bucket, date, client=None):
+        self.bucket = bucket
+        self.key = f'{JOURNAL_PREFIX}/{date}.json'
+        self.client = client or boto3.client('s3')
+        self.lock = Lock()
+        # source name: OrderedDict of email: [cursor after the user, done]
+        self.pending = {}
+        # sources read to the end in this invocation
+        self.read = set()
+        self.done = set()
+        self.saved = time()
+        self.stopped = False
+        self.state = self.load()
+        for source in self.state['sources'].values():
+            self.done.update(source['ahead'])
+        self.state['invocations'] += 1
+
+    def load(self):
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self.key)
+            return json.loads(obj['Body'].read())
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+        return {'sources': {}, 'finished': False, 'invocations': 0, 'total': 0, 'notified': 0}
+
+    @property
+    def finished(self):
+        return self.state['finished']
+
+    def source(self, name, query):
+        # query(cursor) returns a pynamodb result iterator starting after cursor
+        state = self.state['sources'].setdefault(
+            name, {'cursor': None, 'done': False, 'ahead': []})
+        self.pending.setdefault(name, OrderedDict())
+
+        def read():
+            if state['done']:
+                self.read.add(name)
+                return
+            results = query(state['cursor'])
+            for user in results:
+                # mid-page this is rebuilt from the user's own keys
+                cursor = results.last_evaluated_key
+                if self.track(name, user.email, cursor):
+                    yield user
+            with self.lock:
+                self.read.add(name)
+        return read
+
+    def track(self, name, email, cursor):
+        # returns whether the user still has to be notified
+        with self.lock:
+            self.pending[name][email] = [cursor, email in self.done]
+            if email in self.done:
+                self.advance(name)
+                return False
+            return True
+
+    def complete(self, email):
+        with self.lock:
+            self.done.add(email)
+            for name, pending in self.pending.items():
+                if email in pending:
+                    pending[email][1] = True
+                    self.advance(name)
+
+    def advance(self, name):
+        # moves the cursor past the users at the front that are done
+        pending = self.pending[name]
+        while pending and next(iter(pending.values()))[1]:
+            _, (cursor, _) = pending.popitem(last=False)
+            self.state['sources'][name]['cursor'] = cursor
+
+    def wrap(self, fx):
+        # marks each user done once fx is through with it, even if it failed
+        def tracked(user, data):
+            try:
+                return fx(user, data)
+            finally:
+                self.complete(user.email)
+        return tracked
+
+    def checkpoints(self, items, deadline=lambda: False, on_save=None):
+        # saves every CHECKPOINT_INTERVAL seconds and stops early
+        # once deadline() says there's no time left for more users
+        for item in items:
+            yield item
+            if time() - self.saved >= CHECKPOINT_INTERVAL:
+                self.save(on_save)
+            if deadline():
+                self.stopped = True
+                return
+
+    def save(self, on_save=None):
+        # on_save runs first, e.g. to flush last_sent writes
+        if on_save:
+            on_save()
+        with self.lock:
+            for name, pending in self.pending.items():
+                source = self.state['sources'][name]
+                source['ahead'] = [email for email, (_, done) in pending.items() if done]
+                source['done'] = source['done'] or (name in self.read and not pending)
+            self.state['finished'] = not self.stopped and all(
+                source['done'] for source in self.state['sources'].values())
+            body = json.dumps(self.state)
+        self.client.put_object(Bucket=self.bucket, Key=self.key, Body=body)
+        self.saved = time()
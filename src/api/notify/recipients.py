@@ -0,0 +1,92 @@
+from time import time
+from threading import Thread, Event
+from queue import Queue, Empty, Full
+
+# users buffered between the readers and the delivery workers
+QUEUE_SIZE = 1024
+# seconds between checks for a stopped consumer
+PUT_TIMEOUT = 0.1
+DONE = object()
+
+
+class RecipientProducer:
+    # Reads every source on its own thread and hands users to the delivery
+    # workers through a bounded queue, so the first sends start after the
+    # first page instead of after every query. Each user is yielded once.
+    # sources are functions that return an iterable of users,
+    # e.g. a pynamodb query per index in the plan.
+    def __init__(self, sources, maxsize=QUEUE_SIZE):
+        self.sources = sources
+        self.queue = Queue(maxsize=maxsize)
+        self.stopped = Event()
+        self.errors = []
+        self.read = 0
+        self.unique = 0
+        self.start = None
+        self.end = None
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce(self, source):
+        try:
+            for user in source():
+                if not self.put(user):
+                    return
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.put(DONE)
+
+    def __iter__(self):
+        self.start = time()
+        threads = [Thread(target=self.produce, args=(source,), daemon=True)
+                   for source in self.sources]
+        for thread in threads:
+            thread.start()
+        seen = set()
+        remaining = len(threads)
+        try:
+            while remaining:
+                try:
+                    user = self.queue.get(timeout=PUT_TIMEOUT)
+                except Empty:
+                    continue
+                if user is DONE:
+                    remaining -= 1
+                    continue
+                self.read += 1
+                if user.email not in seen:
+                    seen.add(user.email)
+                    self.unique += 1
+                    yield user
+        finally:
+            # also stops the readers if the consumer quits early
+            self.stopped.set()
+            self.end = time()
+        if self.errors:
+            # a partial recipient list shouldn't look like a full run
+            raise self.errors[0]
+
+    def report(self, delivered, end=None):
+        # read vs delivered throughput in users per second
+        end = end or time()
+        read_time = max((self.end or end) - self.start, 1e-9)
+        total_time = max(end - self.start, 1e-9)
+        stats = {
+            'read': self.read,
+            'unique': self.unique,
+            'read_per_sec': self.read / read_time,
+            'delivered': delivered,
+            'delivered_per_sec': delivered / total_time,
+        }
+        print(
+            f"Read {stats['read']} users ({stats['unique']} unique) at {stats['read_per_sec']:.0f}/s, "
+            f"delivered {delivered} at {stats['delivered_per_sec']:.0f}/s.")
+        return stats
@@ -0,0 +1,90 @@
+import random
+import requests
+from time import sleep
+from threading import Lock
+from collections import Counter
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+# seconds to open a connection and to wait for the response
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 5
+# retries after the first attempt, for timeouts, connection errors, 429s and 5xx
+MAX_RETRIES = 2
+BACKOFF = 0.5
+# connections kept open per host
+POOL_SIZE = 32
+# a url that fails this many times in a run isn't tried again in the same run
+BREAKER_THRESHOLD = 3
+
+
+class WebhookError(Exception):
+    pass
+
+
+def is_retryable(status):
+    return status == 429 or status >= 500
+
+
+class WebhookDispatcher:
+    # Posts webhooks over one pooled session per host, so repeat deliveries
+    # skip the tcp and tls handshakes. Every request has strict timeouts,
+    # and a url that keeps failing is short circuited for the rest of the run.
+    def __init__(self, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), retries=MAX_RETRIES,
+                 backoff=BACKOFF, threshold=BREAKER_THRESHOLD):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.threshold = threshold
+        self.sessions = {}
+        self.failures = Counter()
+        self.lock = Lock()
+
+    def get_session(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def reset(self):
+        # every run gives broken urls a fresh start
+        with self.lock:
+            self.failures.clear()
+
+    def is_broken(self, url):
+        return self.failures[url] >= self.threshold
+
+    def fail(self, url, msg):
+        with self.lock:
+            self.failures[url] += 1
+        raise WebhookError(msg)
+
+    def wait(self, attempt):
+        # full jitter, so retries from many workers don't line up
+        sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def post(self, url, data, headers):
+        if self.is_broken(url):
+            raise WebhookError(f'Webhook failed {self.failures[url]} times, skipping: {url}')
+        session = self.get_session(url)
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = session.post(url, json=data, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                if last:
+                    self.fail(url, f'Webhook request failed: {e!r}')
+                self.wait(attempt)
+                continue
+            if response.ok:
+                with self.lock:
+                    self.failures.pop(url, None)
+                return response
+            if last or not is_retryable(response.status_code):
+                self.fail(url, f'Webhook returned {response.status_code}: {url}')
+            self.wait(attempt)
@@ -1,13 +1,12 @@
 import os
-import boto3
-s3 = boto3.client('s3')
+from s3cache import s3_cache
 
 
 def get_preview(*_):
-    obj = s3.get_object(
-        Bucket=os.environ['S3_BUCKET'], Key='data/api/preview.json')
+    # unchanged previews are served from the container without a download
+    obj = s3_cache.get(os.environ['S3_BUCKET'], 'data/api/preview.json')
     return {
         "statusCode": 200,
-        "body": obj['Body'].read(),
+        "body": obj['body'],
         "headers": {"Access-Control-Allow-Origin": "*"}
     }
@@ -0,0 +1,62 @@
+import json
+from utils import transform_signal
+
+SIGNALS_KEY = 'models/latest/signals.csv'
+# the last LATEST_SIGNALS signals, rebuilt whenever a new signal is emitted
+LATEST_KEY = 'models/latest/signals_latest.json'
+LATEST_SIGNALS = 7
+# first guess for the bytes holding the last rows and the header,
+# rows are ~30 bytes so this is usually a single request each
+TAIL_BYTES = 1024
+HEADER_BYTES = 256
+
+
+def read_range(client, bucket, key, byte_range, etag=None):
+    # returns (bytes, object size, etag), later ranges must match the first etag
+    # so rows and header come from the same version of the object
+    kwargs = {'IfMatch': etag} if etag else {}
+    obj = client.get_object(Bucket=bucket, Key=key, Range=f'bytes={byte_range}', **kwargs)
+    size = int(obj['ContentRange'].split('/')[-1])
+    return obj['Body'].read(), size, obj['ETag']
+
+
+def read_header(client, bucket, key, etag, size=HEADER_BYTES):
+    while True:
+        body, total, _ = read_range(client, bucket, key, f'0-{size - 1}', etag)
+        if b'\n' in body or len(body) >= total:
+            return body.decode('UTF-8').splitlines()[0]
+        size *= 4
+
+
+def read_tail(client, bucket, key=SIGNALS_KEY, num_rows=LATEST_SIGNALS, size=TAIL_BYTES):
+    # Reads the header and the last num_rows rows of a csv with ranged GETs
+    # from the end, so the cost doesn't grow with the file.
+    # Returns (header, rows, etag).
+    etag = None
+    while True:
+        body, total, etag = read_range(client, bucket, key, f'-{size}', etag)
+        lines = [line for line in body.decode('UTF-8').splitlines() if line]
+        if len(body) >= total:
+            return lines[0], lines[1:][-num_rows:], etag
+        # the first line is usually cut off
+        if len(lines) > num_rows:
+            return read_header(client, bucket, key, etag), lines[-num_rows:], etag
+        size *= 4
+
+
+def parse_signals(header, rows):
+    keys = header.split(',')
+    return [transform_signal(dict(zip(keys, row.split(',')))) for row in rows]
+
+
+def build_latest(client, bucket, num_rows=LATEST_SIGNALS):
+    header, rows, etag = read_tail(client, bucket, num_rows=num_rows)
+    # source_etag is the signals.csv version this was built from
+    return {'source_etag': etag, 'data': parse_signals(header, rows)}
+
+
+def publish_latest(client, bucket, num_rows=LATEST_SIGNALS):
+    latest = build_latest(client, bucket, num_rows)
+    client.put_object(
+        Bucket=bucket, Key=LATEST_KEY, Body=json.dumps(latest), ContentType='application/json')
+    return latest
@@ -1,6 +1,11 @@
 import os
 import secrets
+from time import time
+from threading import Lock
+from collections import OrderedDict
 from pynamodb.models import Model
+from pynamodb.connection import Connection
+from pynamodb.transactions import TransactWrite
 from pynamodb.indexes import GlobalSecondaryIndex, AllProjection
 from pynamodb.attributes import (
     UnicodeAttribute, MapAttribute, BooleanAttribute, ListAttribute, UTCDateTimeAttribute, NumberAttribute)
@@ -24,6 +29,93 @@ def get_default_access_queue():
     return [PAST_DATE] * 5
 
 
+# users kept per container by api key
+API_KEY_CACHE_SIZE = 1024
+# seconds before a cached user is looked up again, this bounds how long
+# changes made by other functions (subscriptions, rotated keys) take to show
+API_KEY_TTL = 60
+# unknown keys, kept apart so a flood of them can't push out real users
+INVALID_KEY_CACHE_SIZE = 4096
+INVALID_KEY_TTL = 30
+
+
+class APIKeyCache:
+    # LRU with TTL from api key to user (email, in_beta / subscribed and
+    # access_queue), so warm requests with the same key skip the GSI query.
+    # Keys that match no user are cached too, so repeats of a bad key
+    # don't reach dynamo. The cache is per container, so changes made by
+    # other functions only show once the entry expires, and invalidate()
+    # only helps within the container that made the change.
+    def __init__(
+            self, size=API_KEY_CACHE_SIZE, ttl=API_KEY_TTL,
+            invalid_size=INVALID_KEY_CACHE_SIZE, invalid_ttl=INVALID_KEY_TTL,
+            query=query_by_api_key, clock=time):
+        self.size = size
+        self.ttl = ttl
+        self.invalid_size = invalid_size
+        self.invalid_ttl = invalid_ttl
+        self.query = query
+        self.clock = clock
+        self.lock = Lock()
+        # api key: (expires, user)
+        self.users = OrderedDict()
+        # api key: expires
+        self.invalid = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, api_key):
+        # returns (found, user) from the cache
+        now = self.clock()
+        with self.lock:
+            if api_key in self.users:
+                expires, user = self.users[api_key]
+                if now < expires:
+                    self.users.move_to_end(api_key)
+                    return True, user
+                del self.users[api_key]
+            if api_key in self.invalid:
+                if now < self.invalid[api_key]:
+                    self.invalid.move_to_end(api_key)
+                    return True, None
+                del self.invalid[api_key]
+        return False, None
+
+    def put(self, api_key, user):
+        entries, size = (self.users, self.size) if user else (self.invalid, self.invalid_size)
+        expires = self.clock() + (self.ttl if user else self.invalid_ttl)
+        with self.lock:
+            entries[api_key] = (expires, user) if user else expires
+            entries.move_to_end(api_key)
+            while len(entries) > size:
+                entries.popitem(last=False)
+
+    def get(self, api_key):
+        # returns the user with the api key, or None
+        if not api_key:
+            return None
+        found, user = self.lookup(api_key)
+        if found:
+            self.hits += 1
+            return user
+        self.misses += 1
+        users = self.query(api_key)
+        user = users[0] if users else None
+        self.put(api_key, user)
+        return user
+
+    def invalidate(self, api_key):
+        # drops a key from this container's cache only
+        with self.lock:
+            self.users.pop(api_key, None)
+            self.invalid.pop(api_key, None)
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+            self.invalid.clear()
+
+
 ATTRS_LOOKUP = {UnicodeAttribute: str, BooleanAttribute: bool}
 ALERTS_LOOKUP = {
     'email': {'attr': BooleanAttribute, 'default': False},
@@ -37,6 +129,8 @@ class Alerts(MapAttribute):
         vars()[key] = val['attr'](default=val['default'])
     last_sent = UTCDateTimeAttribute(
         default=UTCDateTimeAttribute().serialize(PAST_DATE))
+    # failed webhook deliveries in a row
+    webhook_failures = NumberAttribute(default=0)
 
 
 class Permissions(MapAttribute):
@@ -114,6 +208,55 @@ class SubscribedIndex(GlobalSecondaryIndex):
     subscribed = NumberAttribute(hash_key=True)
 
 
+class InBetaEmailIndex(GlobalSecondaryIndex):
+    """
+    Sparse index of beta users with email alerts on
+    """
+    class Meta:
+        index_name = 'in_beta_email_index'
+        projection = AllProjection()
+
+    in_beta = NumberAttribute(hash_key=True)
+    # only set while the channel is on, so other users aren't in the index
+    notify_email = NumberAttribute(range_key=True)
+
+
+class InBetaWebhookIndex(GlobalSecondaryIndex):
+    """
+    Sparse index of beta users with a webhook
+    """
+    class Meta:
+        index_name = 'in_beta_webhook_index'
+        projection = AllProjection()
+
+    in_beta = NumberAttribute(hash_key=True)
+    notify_webhook = NumberAttribute(range_key=True)
+
+
+class SubscribedEmailIndex(GlobalSecondaryIndex):
+    """
+    Sparse index of subscribers with email alerts on
+    """
+    class Meta:
+        index_name = 'subscribed_email_index'
+        projection = AllProjection()
+
+    subscribed = NumberAttribute(hash_key=True)
+    notify_email = NumberAttribute(range_key=True)
+
+
+class SubscribedWebhookIndex(GlobalSecondaryIndex):
+    """
+    Sparse index of subscribers with a webhook
+    """
+    class Meta:
+        index_name = 'subscribed_webhook_index'
+        projection = AllProjection()
+
+    subscribed = NumberAttribute(hash_key=True)
+    notify_webhook = NumberAttribute(range_key=True)
+
+
 class UserModel(Model):
     """
     A DynamoDB User
@@ -134,7 +277,149 @@ class UserModel(Model):
         default=get_default_access_queue
     )
     customer_id = UnicodeAttribute(default="_")
+    # sparse index keys, set to 1 while the alert channel is on
+    notify_email = NumberAttribute(null=True)
+    notify_webhook = NumberAttribute(null=True)
     api_key_index = APIKeyIndex()
     customer_id_index = CustomerIdIndex()
     in_beta_index = InBetaIndex()
     subscribed_index = SubscribedIndex()
+    in_beta_email_index = InBetaEmailIndex()
+    in_beta_webhook_index = InBetaWebhookIndex()
+    subscribed_email_index = SubscribedEmailIndex()
+    subscribed_webhook_index = SubscribedWebhookIndex()
+
+
+# api key lookups shared by every request in the container
+api_keys = APIKeyCache()
+
+# users updated per transaction
+WRITE_CHUNK_SIZE = 25
+
+
+def transact_update(updates):
+    # updates: [(user, actions)], all or nothing
+    connection = Connection(host=getattr(UserModel.Meta, 'host', None))
+    with TransactWrite(connection=connection) as transaction:
+        for user, actions in updates:
+            transaction.update(user, actions=actions)
+
+
+class WriteBuffer:
+    # Write-behind buffer for user updates, e.g. alerts.last_sent after a
+    # notification. Updates go out in transactions of up to `size` users
+    # instead of one request per user, and flush() writes the rest.
+    # Unlike BatchWriteItem, transactions can update single attributes,
+    # so concurrent changes to the rest of the user aren't overwritten.
+    # A failed transaction is retried one user at a time, so a bad item
+    # only loses its own update. flush() returns the emails that failed.
+    def __init__(self, size=WRITE_CHUNK_SIZE, write=transact_update):
+        self.size = size
+        self.write = write
+        self.lock = Lock()
+        self.pending = []
+        self.failed = []
+        self.written = 0
+
+    def take(self):
+        with self.lock:
+            chunk, self.pending = self.pending, []
+            return chunk
+
+    def add(self, user, actions):
+        with self.lock:
+            self.pending.append((user, actions))
+            full = len(self.pending) >= self.size
+        if full:
+            self.write_chunk(self.take())
+
+    def write_chunk(self, chunk):
+        if not chunk:
+            return
+        try:
+            self.write(chunk)
+            written, failed = len(chunk), []
+        except Exception as e:
+            print(f'Transaction of {len(chunk)} updates failed, writing one by one: {e!r}')
+            written, failed = 0, []
+            for user, actions in chunk:
+                try:
+                    user.update(actions=actions)
+                    written += 1
+                except Exception as e:
+                    print(f'Update failed for {user.email}: {e!r}')
+                    failed.append(user.email)
+        with self.lock:
+            self.written += written
+            self.failed += failed
+
+    def flush(self):
+        self.write_chunk(self.take())
+        with self.lock:
+            failed, self.failed = self.failed, []
+        return failed
+
+
+# users that get alerts, in the order they are notified
+AUDIENCES = ['in_beta', 'subscribed']
+# channels with a sparse index per audience, sms has none yet
+INDEXED_CHANNELS = ['email', 'webhook']
+# the sparse indexes in the order they are deployed, one per stack update
+ALERT_INDEXES = [
+    'in_beta_email_index', 'in_beta_webhook_index',
+    'subscribed_email_index', 'subscribed_webhook_index']
+
+
+def is_enabled(alerts, channel):
+    # works for dicts and pynamodb maps
+    return channel in alerts and bool(alerts[channel])
+
+
+def get_alert_key_actions(alerts):
+    # keeps the sparse index keys in line with alerts, use on every alerts update
+    actions = []
+    for channel in INDEXED_CHANNELS:
+        attr = getattr(UserModel, f'notify_{channel}')
+        actions.append(attr.set(1) if is_enabled(alerts, channel) else attr.remove())
+    return actions
+
+
+def get_alert_condition(channels):
+    conditions = {
+        'email': UserModel.alerts['email'] == True,  # noqa
+        'sms': UserModel.alerts['sms'] == True,  # noqa
+        'webhook': (UserModel.alerts['webhook'].exists()) & (UserModel.alerts['webhook'] != ''),
+    }
+    condition = None
+    for channel in channels:
+        condition = conditions[channel] if condition is None else condition | conditions[channel]
+    return condition
+
+
+def plan_alert_queries(channels=INDEXED_CHANNELS, audiences=AUDIENCES, indexes=ALERT_INDEXES):
+    # Picks the cheapest read for each channel and audience: the sparse index
+    # when it's in indexes, since it only holds users with that channel on.
+    # The rest share one filtered query on the audience index, which reads
+    # every user in the audience. Returns [(index, filter condition)].
+    # sms has no sender yet, so by default it isn't read at all.
+    plan = []
+    for audience in audiences:
+        filtered = []
+        for channel in channels:
+            if f'{audience}_{channel}_index' in indexes:
+                plan.append((getattr(UserModel, f'{audience}_{channel}_index'), None))
+            else:
+                filtered.append(channel)
+        if filtered:
+            plan.append((getattr(UserModel, f'{audience}_index'), get_alert_condition(filtered)))
+    return plan
+
+
+def backfill_alert_keys():
+    # one-off, sets the sparse index keys for users who turned alerts on
+    # before the keys existed, returns the number of users updated
+    updated = 0
+    for user in UserModel.scan(get_alert_condition(ALERTS_LOOKUP.keys())):
+        user.update(actions=get_alert_key_actions(user.alerts))
+        updated += 1
+    return updated
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+from pynamodb.exceptions import UpdateError
+from models import UserModel
+from utils import enough_time_has_passed
+
+# requests allowed per sliding window for each tier
+QUOTAS = {
+    'subscribed': {'requests': 5, 'window': timedelta(days=1)},
+    'in_beta': {'requests': 5, 'window': timedelta(days=1)},
+}
+# conditional updates tried before a busy user is turned away
+MAX_ATTEMPTS = 3
+
+
+def get_tier(user):
+    if user.subscribed:
+        return 'subscribed'
+    if user.in_beta:
+        return 'in_beta'
+
+
+def check_queue(queue, quota, now):
+    # returns (new queue, requests left) or None once the quota is reached
+    requests = quota['requests']
+    recent = [access for access in queue[-requests:]
+              if not enough_time_has_passed(access, now, quota['window'])]
+    if len(recent) >= requests:
+        return
+    queue = queue[max(len(queue) - requests + 1, 0):] + [now]
+    return queue, requests - len(recent) - 1
+
+
+class RateLimiter:
+    # Sliding window log over user.access_queue, the times of the last
+    # requests. The check runs on the queue we already have (e.g. from the
+    # api key cache) and the write is conditional on the stored queue still
+    # being that queue, so two requests can't both take the last slot and
+    # a warm request costs one write and no read. If another request got
+    # there first, the user is re-read and checked again. Access times only
+    # move forward, so a full queue is never written, even if it's stale.
+    def __init__(self, quotas=QUOTAS, attempts=MAX_ATTEMPTS):
+        self.quotas = quotas
+        self.attempts = attempts
+
+    def get_quota(self, user):
+        return self.quotas.get(get_tier(user))
+
+    def acquire(self, user, now=None):
+        # returns the requests left, or None once the quota is reached
+        quota = self.get_quota(user)
+        if not quota:
+            return
+        now = now or datetime.now(timezone.utc)
+        for _ in range(self.attempts):
+            queue = list(user.access_queue or [])
+            result = check_queue(queue, quota, now)
+            if not result:
+                return
+            new_queue, remaining = result
+            condition = UserModel.access_queue.does_not_exist() | (UserModel.access_queue == queue)
+            try:
+                user.update(actions=[UserModel.access_queue.set(new_queue)], condition=condition)
+                return remaining
+            except UpdateError as e:
+                if e.cause_response_code != 'ConditionalCheckFailedException':
+                    raise
+                user.refresh(consistent_read=True)
+        print(f'Gave up on the access queue for {user.email} after {self.attempts} attempts.')
+
+
+limiter = RateLimiter()
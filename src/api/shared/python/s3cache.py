@@ -0,0 +1,77 @@
+import json
+import boto3
+from threading import Lock
+from botocore.exceptions import ClientError
+
+# error codes s3 returns for If-None-Match on an unchanged object
+NOT_MODIFIED = set(['304', 'NotModified'])
+
+
+class S3Cache:
+    # Keeps s3 objects per warm container, keyed by bucket and key.
+    # Repeat reads send the cached ETag as If-None-Match, so an unchanged
+    # object costs a 304 with no body. Parsed results are memoized per ETag,
+    # so they are only parsed again when the object changes.
+    def __init__(self, client=None):
+        self.client = client
+        self.lock = Lock()
+        # (bucket, key): {'etag', 'body'}
+        self.objects = {}
+        # (bucket, key): {(etag, extract): parsed}
+        self.parsed = {}
+        self.requests = 0
+        self.hits = 0
+
+    def get_client(self):
+        with self.lock:
+            if not self.client:
+                self.client = boto3.client('s3')
+            return self.client
+
+    def get(self, bucket, key, keep_body=True):
+        # returns {'etag', 'body'} with the latest body as bytes. With
+        # keep_body=False only the etag is kept between invocations, and an
+        # unchanged object comes back with a None body.
+        cached = self.objects.get((bucket, key))
+        if cached and keep_body and cached['body'] is None:
+            cached = None
+        kwargs = {'IfNoneMatch': cached['etag']} if cached else {}
+        self.requests += 1
+        try:
+            obj = self.get_client().get_object(Bucket=bucket, Key=key, **kwargs)
+        except ClientError as e:
+            if cached and e.response['Error']['Code'] in NOT_MODIFIED:
+                self.hits += 1
+                return cached
+            raise
+        entry = {'etag': obj['ETag'], 'body': obj['Body'].read()}
+        with self.lock:
+            self.objects[(bucket, key)] = entry if keep_body else {'etag': entry['etag'], 'body': None}
+        return entry
+
+    def get_json(self, bucket, key, extract=None):
+        # extract(data) can keep just the part the caller needs,
+        # only that part and the etag stay in memory between invocations
+        entry = self.get(bucket, key, keep_body=False)
+        with self.lock:
+            memo = self.parsed.setdefault((bucket, key), {})
+            if (entry['etag'], extract) in memo:
+                return memo[(entry['etag'], extract)]
+        if entry['body'] is None:
+            # unchanged, but not parsed with this extract yet
+            with self.lock:
+                self.objects.pop((bucket, key), None)
+            entry = self.get(bucket, key, keep_body=False)
+        data = json.loads(entry['body'])
+        data = extract(data) if extract else data
+        with self.lock:
+            memo = self.parsed.setdefault((bucket, key), {})
+            # results for older versions of the object are dropped
+            for stale in [stale for stale in memo if stale[0] != entry['etag']]:
+                del memo[stale]
+            memo[(entry['etag'], extract)] = data
+        return data
+
+
+# shared by every function in the container
+s3_cache = S3Cache()
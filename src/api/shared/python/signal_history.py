@@ -0,0 +1,100 @@
+import json
+from datetime import datetime
+from botocore.exceptions import ClientError
+from utils import DATE_FMT
+from latest_signals import read_tail, parse_signals, SIGNALS_KEY
+
+# signals.csv split by month: {HISTORY_PREFIX}/2022-06.json holds that
+# month's signals, and index.json lists the months that exist
+HISTORY_PREFIX = 'models/latest/signals'
+INDEX_KEY = f'{HISTORY_PREFIX}/index.json'
+# signals per page of history
+PAGE_SIZE = 100
+# rows re-read on every emit, enough to cover the current and last month
+RECENT_ROWS = 62
+
+
+def get_month(date):
+    return date[:7]
+
+
+def month_key(month):
+    return f'{HISTORY_PREFIX}/{month}.json'
+
+
+def group_by_month(signals):
+    months = {}
+    for signal in signals:
+        months.setdefault(get_month(signal['Date']), []).append(signal)
+    return months
+
+
+def read_json(client, bucket, key):
+    try:
+        return json.loads(client.get_object(Bucket=bucket, Key=key)['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+
+
+def write_json(client, bucket, key, data):
+    client.put_object(Bucket=bucket, Key=key, Body=json.dumps(data), ContentType='application/json')
+
+
+def write_months(client, bucket, signals, etag, index=None):
+    # merges the signals into their month partitions, by date
+    index = index or {'months': []}
+    for month, month_signals in group_by_month(signals).items():
+        existing = []
+        if month in index['months']:
+            existing = read_json(client, bucket, month_key(month)) or []
+        merged = {signal['Date']: signal for signal in existing + month_signals}
+        write_json(client, bucket, month_key(month), [merged[date] for date in sorted(merged)])
+    index = {
+        'months': sorted(set(index['months']) | set(group_by_month(signals))),
+        'source_etag': etag,
+    }
+    write_json(client, bucket, INDEX_KEY, index)
+    return index
+
+
+def backfill_history(client, bucket):
+    # splits the whole csv once, later emits only touch the recent months
+    obj = client.get_object(Bucket=bucket, Key=SIGNALS_KEY)
+    lines = [line for line in obj['Body'].read().decode('UTF-8').splitlines() if line]
+    return write_months(client, bucket, parse_signals(lines[0], lines[1:]), obj['ETag'])
+
+
+def publish_history(client, bucket):
+    index = read_json(client, bucket, INDEX_KEY)
+    if not index:
+        return backfill_history(client, bucket)
+    header, rows, etag = read_tail(client, bucket, num_rows=RECENT_ROWS)
+    if index['source_etag'] == etag:
+        return index
+    return write_months(client, bucket, parse_signals(header, rows), etag, index)
+
+
+def parse_date(date):
+    # returns the date as YYYY-MM-DD, or None if it isn't one
+    try:
+        return datetime.strptime(date, DATE_FMT).strftime(DATE_FMT)
+    except (TypeError, ValueError):
+        return
+
+
+def query_history(read_month, months, start, end, cursor=None, page_size=PAGE_SIZE):
+    # Returns a page of signals with start <= Date <= end, oldest first, and
+    # the cursor for the next page (None on the last one). Only the month
+    # partitions in the range are read, read_month(month) loads one.
+    begin = max(start, cursor) if cursor else start
+    data = []
+    for month in months:
+        if not get_month(begin) <= month <= get_month(end):
+            continue
+        for signal in read_month(month):
+            if begin <= signal['Date'] <= end:
+                if len(data) == page_size:
+                    return {'data': data, 'cursor': signal['Date']}
+                data.append(signal)
+    return {'data': data, 'cursor': None}
@@ -1,19 +1,83 @@
 import os
 import json
 import boto3
-from datetime import datetime, timedelta, timezone
-from models import query_by_api_key, UserModel
-from utils import options, error, enough_time_has_passed, RES_HEADERS, transform_signal
+from time import time
+from threading import Lock
+from botocore.exceptions import ClientError
+from models import api_keys
+from ratelimit import limiter
+from s3cache import S3Cache
+from latest_signals import build_latest, LATEST_KEY, LATEST_SIGNALS, SIGNALS_KEY
+from signal_history import query_history, parse_date, month_key, INDEX_KEY
+from utils import options, error, RES_HEADERS
 
 s3 = boto3.client('s3')
-
-max_accesses = 5
-duration_days = 1
+# seconds a warm container serves its signals before checking s3 again,
+# signals change at most once a day
+SIGNALS_MAX_AGE = float(os.environ.get('SIGNALS_MAX_AGE', 60))
+
+
+class SignalsCache:
+    # The latest signals, kept per warm container. At most once every
+    # max_age seconds, signals.csv is checked with a HEAD and the precomputed
+    # signals with a conditional GET, both without a body when nothing
+    # changed. If the precomputed signals are missing or were built from an
+    # older csv, the tail of the csv is read instead. The data is serialized
+    # once per version, so a hit only formats the quota message.
+    def __init__(self, client=s3, max_age=SIGNALS_MAX_AGE, clock=time):
+        self.client = client
+        self.objects = S3Cache(client)
+        self.max_age = max_age
+        self.clock = clock
+        self.lock = Lock()
+        # {'etag': signals.csv etag, 'data': json of the signals}
+        self.entry = None
+        self.checked = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, bucket):
+        etag = self.client.head_object(Bucket=bucket, Key=SIGNALS_KEY)['ETag']
+        if self.entry and self.entry['etag'] == etag:
+            return self.entry
+        try:
+            latest = self.objects.get_json(bucket, LATEST_KEY)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            latest = None
+        if not latest or latest['source_etag'] != etag:
+            print(f'{LATEST_KEY} is behind {SIGNALS_KEY}, reading the tail of the csv.')
+            latest = build_latest(self.client, bucket)
+        data = latest['data'][-LATEST_SIGNALS:]
+        return {'etag': latest['source_etag'], 'data': json.dumps(data)}
+
+    def get(self, bucket):
+        now = self.clock()
+        with self.lock:
+            if self.entry and now - self.checked < self.max_age:
+                self.hits += 1
+                return self.entry
+            self.misses += 1
+            try:
+                self.entry = self.load(bucket)
+            except Exception as e:
+                if not self.entry:
+                    raise
+                # s3 hiccups shouldn't fail requests that can be served
+                print(f'Serving cached signals, revalidation failed: {e!r}')
+            self.checked = now
+            return self.entry
+
+
+signals_cache = SignalsCache()
 
 
 def handle_signals(event, _):
     if event['httpMethod'].upper() == 'OPTIONS':
         response = options()
+    elif event.get('resource') == '/signals/history':
+        response = get_history(event)
     else:
         response = get_signals(event)
 
@@ -21,90 +85,51 @@ def handle_signals(event, _):
 
 
 def update_access_queue(user):
-    # Notes: Instead of using usage plan,
-    # store list of last 5 access times
-    access_queue = user.access_queue
-
-    reset_duration = timedelta(days=duration_days)
-    now = datetime.now(timezone.utc)
-    quota_reached = False
-
-    # Update access queue
-    if len(user.access_queue) >= max_accesses:
-        start = access_queue[-max_accesses]
-        if enough_time_has_passed(start, now, reset_duration):
-            access_queue = access_queue[-max_accesses + 1:] + [now]
-        else:
-            access_queue = access_queue[-max_accesses:]
-            quota_reached = True
-    else:
-        access_queue += [now]
+    # check and update happen in one conditional write, see RateLimiter
+    # returns the requests left, or None once the quota is reached
+    return limiter.acquire(user)
 
-    # Update user model in db with new access_queue
-    user.update(actions=[UserModel.access_queue.set(access_queue)])
-    if quota_reached:
-        return
 
-    # Find out how many requests are left
-    remaining = 0
-    for access in access_queue:
-        if enough_time_has_passed(access, now, reset_duration):
-            remaining += 1
-        else:
-            break
-    # This is to cover the case that len(access_queue) < max_accesses
-    remaining += max_accesses - len(access_queue)
-    return remaining
+def describe_quota(quota):
+    return f"{quota['requests']} requests / {quota['window'].days} day(s)"
 
 
-def get_signals(event):
+def check_access(event):
+    # returns (error response, None) or (None, the quota message)
+    # every request counts once against the quota
     # first get user by api key
     req_headers = event['headers']
     if 'x-api-key' not in req_headers:
-        return error(401, 'Provide a valid API key.')
+        return error(401, 'Provide a valid API key.'), None
     api_key = req_headers['x-api-key']
-    query_results = query_by_api_key(api_key)
-    if not query_results:
-        return error(401, 'Provide a valid API key.')
-    user = query_results[0]
+    # warm containers resolve repeat keys without querying the index
+    user = api_keys.get(api_key)
+    if not user:
+        return error(401, 'Provide a valid API key.'), None
 
     if not (user.in_beta or user.subscribed):
-        return error(402, 'This endpoint is for subscribers only.')
+        return error(402, 'This endpoint is for subscribers only.'), None
 
     remaining = update_access_queue(user)
-    if not remaining:
-        return error(403,
-                     f'You have reached your quota of {max_accesses} requests / {duration_days} day(s).'
-                     )
-
-    obj = s3.get_object(
-        Bucket=os.environ['S3_BUCKET'], Key='models/latest/signals.csv')
-
-    days_in_a_week = 7
-    lines = [line.decode('utf-8') for line in list(obj['Body'].iter_lines())]
-    header = lines[0]
-    rows = lines[-days_in_a_week:]
-    keys = header.split(',')
-
-    response = {'message': None, 'data': []}
-    for row in rows:
-        cols = row.split(',')
-        item = {}
-        for idx, col in enumerate(cols):
-            key = keys[idx]
-            item[key] = col
-        signal = transform_signal(item)
-        response['data'].append(signal)
-    # Time -> Date
-    # Sig -> Signal
+    quota = limiter.get_quota(user)
+    if remaining is None:
+        return error(403, f'You have reached your quota of {describe_quota(quota)}.'), None
+    return None, f"You have {remaining} requests left / {quota['window'].days} day(s)."
+
+
+def get_signals(event):
+    res, message = check_access(event)
+    if res:
+        return res
 
     # schema is list from oldest to newest
     # 1 week - 7 items
     # each item {Date: 2022-06-23, Day: Mon, Tue, (3 letter slice) Signal: BUY or SELL}
-    # obj['Body'].read()
+    # precomputed on emit and cached, so this doesn't grow with the signals history
+    signals = signals_cache.get(os.environ['S3_BUCKET'])
     status_code = 200
-    response['message'] = f'You have {remaining} requests left / {duration_days} day(s).'
-    body = json.dumps(response)
+    # same as json.dumps({'message': message, 'data': data})
+    body = f'{{"message": {json.dumps(message)}, "data": {signals["data"]}}}'
     return {
         "statusCode": status_code,
         "body": body,
@@ -112,6 +137,51 @@ def get_signals(event):
     }
 
 
+def get_history_params(event):
+    # returns (error response, None) or (None, {start, end, cursor} that were given)
+    params = event.get('queryStringParameters') or {}
+    parsed = {name: parse_date(params[name]) for name in ['start', 'end', 'cursor'] if name in params}
+    if not all(parsed.values()):
+        return error(400, 'Dates must be in YYYY-MM-DD format.'), None
+    if parsed.get('start', '') > parsed.get('end', '9999'):
+        return error(400, 'start must not be after end.'), None
+    return None, parsed
+
+
+def get_history(event):
+    # GET /signals/history?start=YYYY-MM-DD&end=YYYY-MM-DD&cursor=YYYY-MM-DD
+    # pages of up to PAGE_SIZE signals, oldest first, pass the cursor from
+    # one page to get the next, each page counts once against the quota
+    res, params = get_history_params(event)
+    if res:
+        return res
+    res, message = check_access(event)
+    if res:
+        return res
+    bucket = os.environ['S3_BUCKET']
+    # partitions are revalidated with conditional GETs, past months never change
+    objects = signals_cache.objects
+    try:
+        months = objects.get_json(bucket, INDEX_KEY)['months']
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+        # published with the next signal
+        return error(503, 'Signal history is not available yet.')
+    # by default the whole history, these are only compared as strings
+    start = params.get('start', f'{months[0]}-01' if months else '')
+    end = params.get('end', f'{months[-1]}-31' if months else '')
+    page = query_history(
+        lambda month: objects.get_json(bucket, month_key(month)),
+        months, start, end, params.get('cursor'))
+    body = json.dumps({'message': message, 'data': page['data'], 'cursor': page['cursor']})
+    return {
+        "statusCode": 200,
+        "body": body,
+        "headers": RES_HEADERS
+    }
+
+
 # client.create_usage_plan_key(
 #     usagePlanId='12345',
 #     keyId='[API_KEY_ID]',
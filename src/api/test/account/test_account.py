@@ -85,3 +85,11 @@ def test_post_account():
     assert user.alerts.email
     assert user.alerts.sms
     assert user.alerts.webhook
+
+
+def test_merge_alerts():
+    alerts = {'email': False, 'webhook': 'a.com', 'webhook_failures': 3}
+    alerts = merge_alerts(alerts, {'email': 'yes', 'webhook': 'a.com', 'other': True})
+    assert alerts == {'email': False, 'webhook': 'a.com', 'webhook_failures': 3}
+    alerts = merge_alerts(alerts, {'email': True, 'webhook': 'b.com'})
+    assert alerts == {'email': True, 'webhook': 'b.com', 'webhook_failures': 0}
@@ -0,0 +1,46 @@
+# Compares the emit secret check with and without the cached scrypt key.
+# Usage: python src/api/test/notify/bench_crypto.py
+import sys
+from time import perf_counter
+sys.path.append('src/api')  # noqa
+sys.path.append('src/api/shared/python')  # noqa
+from notify.app import Cryptographer, derive_key, get_cryptographer  # noqa
+
+PASSWORD = 'password'.encode('UTF-8')
+SALT = 'salt'.encode('UTF-8')
+SECRET = 'secret'
+NUM_RUNS = 20
+
+
+def check_uncached(token):
+    # what every request used to do
+    derive_key.cache_clear()
+    get_cryptographer.cache_clear()
+    return Cryptographer(PASSWORD, SALT).decrypt(token).decode('UTF-8') == SECRET
+
+
+def check_cached(token):
+    return get_cryptographer(b'', PASSWORD, SALT).decrypt(token).decode('UTF-8') == SECRET
+
+
+def check_precomputed(token, key=derive_key(PASSWORD, SALT)):
+    return get_cryptographer(key, b'', b'').decrypt(token).decode('UTF-8') == SECRET
+
+
+def per_request(fx, token):
+    timings = []
+    for _ in range(NUM_RUNS):
+        start = perf_counter()
+        assert fx(token)
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == '__main__':
+    token = Cryptographer(PASSWORD, SALT).encrypt(SECRET.encode('UTF-8'))
+    uncached = per_request(check_uncached, token)
+    cached = per_request(check_cached, token)
+    precomputed = per_request(check_precomputed, token)
+    print(f'scrypt per request: {uncached * 1000:.3f} ms')
+    print(f'cached key:         {cached * 1000:.3f} ms ({uncached / cached:.0f}x)')
+    print(f'precomputed key:    {precomputed * 1000:.3f} ms ({uncached / precomputed:.0f}x)')
@@ -0,0 +1,57 @@
+# Local http server standing in for user webhook endpoints.
+import json
+from time import sleep
+from threading import Thread, Lock
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class HookServer:
+    # routes map a path to the (status, delay) of each request in turn,
+    # the last response repeats
+    def __init__(self, routes):
+        self.routes = routes
+        self.hits = Counter()
+        self.ports = []
+        self.bodies = []
+        self.lock = Lock()
+
+    def respond(self, path):
+        with self.lock:
+            responses = self.routes.get(path, [(404, 0)])
+            response = responses[min(self.hits[path], len(responses) - 1)]
+            self.hits[path] += 1
+        return response
+
+    def __enter__(self):
+        hooks = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, so pooled connections can be told apart
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                with hooks.lock:
+                    hooks.ports.append(self.client_address[1])
+                    hooks.bodies.append((self.headers['X-API-Key'], json.loads(body)))
+                status, delay = hooks.respond(self.path)
+                sleep(delay)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *_):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server.server_port}{path}'
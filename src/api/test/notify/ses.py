@@ -0,0 +1,68 @@
+# Offline stand-in for the sesv2 client calls used by notify/.
+# Records every call, and rejects the addresses it is told to.
+from threading import Lock
+from collections import Counter
+from types import SimpleNamespace
+
+
+class NotFoundException(Exception):
+    pass
+
+
+class SESStub:
+    def __init__(self, reject=(), fail=False):
+        self.reject = set(reject)
+        # raise on every send, like a throttled or misconfigured account
+        self.fail = fail
+        self.calls = Counter()
+        self.sent = []
+        self.templates = {}
+        self.lock = Lock()
+        self.exceptions = SimpleNamespace(NotFoundException=NotFoundException)
+
+    def record(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        if self.fail:
+            raise Exception(f'{name} failed')
+
+    def result(self, recipient):
+        if recipient in self.reject:
+            return {'Status': 'MESSAGE_REJECTED', 'Error': 'Address blacklisted.'}
+        with self.lock:
+            self.sent.append(recipient)
+        return {'Status': 'SUCCESS', 'MessageId': f'message-{len(self.sent)}'}
+
+    def send_email(self, Destination, Content, FromEmailAddress, **_):
+        self.record('send_email')
+        result = self.result(Destination['ToAddresses'][0])
+        if result['Status'] != 'SUCCESS':
+            raise Exception(result['Error'])
+        return {'MessageId': result['MessageId']}
+
+    def send_bulk_email(self, FromEmailAddress, DefaultContent, BulkEmailEntries, **_):
+        self.record('send_bulk_email')
+        assert len(BulkEmailEntries) <= 50
+        if DefaultContent['Template']['TemplateName'] not in self.templates:
+            raise NotFoundException('Template does not exist.')
+        return {'BulkEmailEntryResults': [
+            self.result(entry['Destination']['ToAddresses'][0]) for entry in BulkEmailEntries]}
+
+    def create_email_template(self, TemplateName, TemplateContent):
+        self.record('create_email_template')
+        self.templates[TemplateName] = TemplateContent
+        return {}
+
+    def update_email_template(self, TemplateName, TemplateContent):
+        self.record('update_email_template')
+        if TemplateName not in self.templates:
+            raise NotFoundException('Template does not exist.')
+        self.templates[TemplateName] = TemplateContent
+        return {}
+
+    def delete_email_template(self, TemplateName):
+        self.record('delete_email_template')
+        if TemplateName not in self.templates:
+            raise NotFoundException('Template does not exist.')
+        del self.templates[TemplateName]
+        return {}
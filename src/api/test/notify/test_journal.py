@@ -0,0 +1,105 @@
+import sys
+import json
+from io import BytesIO
+from types import SimpleNamespace
+from botocore.exceptions import ClientError
+sys.path.append('src/api')  # noqa
+from notify import journal as journal_module  # noqa
+from notify.journal import *  # noqa
+from notify.recipients import RecipientProducer  # noqa
+
+
+class S3Stub:
+    def __init__(self):
+        self.objects = {}
+        self.puts = 0
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': ''}}, 'GetObject')
+        return {'Body': BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body):
+        self.puts += 1
+        self.objects[Key] = Body.encode('UTF-8')
+
+
+class Results:
+    # pynamodb style result iterator over emails, resumable after a cursor
+    def __init__(self, emails, cursor=None):
+        start = emails.index(cursor['email']['S']) + 1 if cursor else 0
+        self.emails = emails[start:]
+        self.last_evaluated_key = cursor
+
+    def __iter__(self):
+        for email in self.emails:
+            self.last_evaluated_key = {'email': {'S': email}}
+            yield SimpleNamespace(email=email)
+
+
+def query(emails, reads):
+    def fx(cursor):
+        results = Results(emails, cursor)
+        reads.append(len(results.emails))
+        return results
+    return fx
+
+
+def test_run():
+    s3 = S3Stub()
+    journal = RunJournal('bucket', '2020-01-01', s3)
+    assert not journal.finished
+    reads = []
+    sources = [journal.source('a', query(['u1', 'u2', 'u3'], reads)),
+               journal.source('b', query(['u2', 'u4'], reads))]
+    notify = journal.wrap(lambda user, _: user.email)
+    notified = [notify(user, None) for user in journal.checkpoints(RecipientProducer(sources))]
+    assert sorted(notified) == ['u1', 'u2', 'u3', 'u4']
+    journal.save()
+    assert journal.finished
+    # a retry for the same signal is a no-op
+    assert RunJournal('bucket', '2020-01-01', s3).finished
+    assert not RunJournal('bucket', '2020-01-02', s3).finished
+
+
+def test_resume():
+    s3 = S3Stub()
+    emails = [f'user{idx}' for idx in range(10)]
+    journal = RunJournal('bucket', '2020-01-01', s3)
+    reads = []
+    source = journal.source('a', query(emails, reads))
+    users = list(source())
+    # user0-2 are done, user4 finished out of order, then the invocation stops
+    for user in users[:3] + users[4:5]:
+        journal.complete(user.email)
+    journal.stopped = True
+    journal.save()
+    state = json.loads(s3.objects['data/notify/runs/2020-01-01.json'])
+    assert state['sources']['a']['cursor'] == {'email': {'S': 'user2'}}
+    assert state['sources']['a']['ahead'] == ['user4']
+    assert not state['finished']
+
+    journal = RunJournal('bucket', '2020-01-01', s3)
+    assert journal.state['invocations'] == 2
+    notify = journal.wrap(lambda user, _: user.email)
+    resumed = [notify(user, None) for user in journal.source('a', query(emails, reads))()]
+    # only users after the cursor are read, and user4 isn't notified twice
+    assert reads == [10, 7]
+    assert resumed == ['user3'] + emails[5:]
+    journal.save()
+    assert journal.finished
+    assert journal.state['sources']['a']['cursor'] == {'email': {'S': 'user9'}}
+
+
+def test_checkpoints(monkeypatch):
+    s3 = S3Stub()
+    monkeypatch.setattr(journal_module, 'CHECKPOINT_INTERVAL', 0)
+    journal = RunJournal('bucket', '2020-01-01', s3)
+    flushes = []
+    items = journal.checkpoints(
+        range(10), deadline=lambda: len(flushes) >= 3, on_save=lambda: flushes.append(1))
+    assert list(items) == [0, 1, 2]
+    assert s3.puts == 3
+    assert journal.stopped
+    journal.save()
+    assert not journal.finished
@@ -1,9 +1,18 @@
 import sys
 import json
+import pytest
 from math import pow
+from time import sleep, time
+from threading import Lock, BoundedSemaphore
+from types import SimpleNamespace
+from botocore.stub import Stubber, ANY
 sys.path.append('src/api')  # noqa
+from notify import app  # noqa
+from notify import backfill  # noqa
 from notify.app import *  # noqa
-from shared.python.models import UserModel  # noqa
+from ses import SESStub  # noqa
+from hooks import HookServer  # noqa
+from shared.python.models import UserModel, Alerts  # noqa
 from shared.python.utils import transform_signal  # noqa
 
 
@@ -20,6 +29,21 @@ class TestCryptographer:
         plaintext = keeper.decrypt(ciphertext).decode('UTF-8')
         assert plaintext == 'secret'
 
+    def test_precomputed_key(self):
+        key = derive_key('password'.encode('UTF-8'), 'salt'.encode('UTF-8'))
+        cryptographer = Cryptographer(key=key)
+        ciphertext = keeper.encrypt('secret'.encode('UTF-8'))
+        assert cryptographer.decrypt(ciphertext).decode('UTF-8') == 'secret'
+
+    def test_get_cryptographer(self):
+        password, salt = 'password'.encode('UTF-8'), 'salt'.encode('UTF-8')
+        cryptographer = get_cryptographer(b'', password, salt)
+        # scrypt only runs for the first request in a container
+        assert get_cryptographer(b'', password, salt) is cryptographer
+        assert derive_key.cache_info().currsize >= 1
+        ciphertext = keeper.encrypt('secret'.encode('UTF-8'))
+        assert cryptographer.decrypt(ciphertext).decode('UTF-8') == 'secret'
+
 
 class TestProcessor:
     def test_run(self):
@@ -27,6 +51,63 @@ class TestProcessor:
         results = set([int(result)
                       for result in processor.run(list(range(0, 5)))])
         assert results == set([0, 1, 4, 9, 16])
+        assert processor.total == 5
+
+    def test_run_streams(self):
+        state = {'in_flight': 0, 'max_in_flight': 0, 'consumed': 0}
+        lock = Lock()
+
+        def items():
+            for idx in range(20):
+                state['consumed'] += 1
+                yield idx
+
+        def fx(item, _):
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['in_flight'], state['max_in_flight'])
+            # the first item is a slow webhook, the rest keep going around it
+            sleep(0.5 if item == 0 else 0.01)
+            with lock:
+                state['in_flight'] -= 1
+            return item
+        processor = Processor(fx, None, concurrency=4)
+        start = time()
+        results = processor.run(items())
+        assert time() - start < 1
+        assert sorted(results) == list(range(20))
+        assert state['max_in_flight'] <= 4
+        assert state['consumed'] == processor.total == 20
+
+    def test_run_limits(self):
+        # slow items share one slot, taken before they reach a worker
+        slot = BoundedSemaphore(1)
+        state = {'slow': 0, 'max_slow': 0, 'fast': []}
+        lock = Lock()
+
+        def fx(item, _):
+            if item < 3:
+                with lock:
+                    state['slow'] += 1
+                    state['max_slow'] = max(state['slow'], state['max_slow'])
+                sleep(0.1)
+                with lock:
+                    state['slow'] -= 1
+            return item
+        processor = Processor(fx, None, concurrency=4, limits=lambda item: [slot] if item < 3 else [])
+        assert sorted(processor.run(range(6))) == list(range(6))
+        assert state['max_slow'] == 1
+        # every slot was given back
+        assert slot.acquire(blocking=False)
+
+    def test_run_errors(self):
+        def fx(item, _):
+            if item == 2:
+                raise ValueError(item)
+            return item
+        processor = Processor(fx, None)
+        assert sorted(processor.run(range(4))) == [0, 1, 3]
+        assert processor.total == 4
 
 
 def test_post_notify():
@@ -48,13 +129,205 @@ def test_post_notify():
     alerts['last_sent'] = UTCDateTimeAttribute(
     ).deserialize(alerts['last_sent'])
     user.update(actions=[UserModel.alerts.set(
-        alerts), UserModel.in_beta.set(1)])
+        alerts), UserModel.in_beta.set(1)] + get_alert_key_actions(alerts))
+    # starts from a fresh run, the function itself can't delete journals
+    journal = RunJournal(os.environ['S3_BUCKET'], body['Time'])
+    journal.client.delete_object(Bucket=journal.bucket, Key=journal.key)
+    res = post_notify(event, None)
+    assert res['statusCode'] == 200
+    journal = RunJournal(os.environ['S3_BUCKET'], body['Time'])
+    assert journal.finished
+    assert journal.state['invocations'] == 2
+    # a retry finds the finished run and doesn't notify anyone again
     res = post_notify(event, None)
     assert res['statusCode'] == 200
 
 
+def test_continue_run(monkeypatch):
+    invocations = []
+
+    class Lambda:
+        def invoke(self, **kwargs):
+            invocations.append(kwargs)
+    monkeypatch.setattr(app, 'get_client', lambda _: Lambda())
+    context = SimpleNamespace(invoked_function_arn='arn:notify')
+    continue_run({'body': '{}', 'chain': 1}, context)
+    assert invocations[0]['FunctionName'] == 'arn:notify'
+    assert json.loads(invocations[0]['Payload']) == {'body': '{}', 'chain': 2}
+
+
+def test_get_run_result():
+    journal = SimpleNamespace(state={'total': 100, 'notified': 90})
+    assert get_run_result(journal)['statusCode'] == 500
+    journal.state['notified'] = 95
+    assert get_run_result(journal)['statusCode'] == 200
+    # nobody had alerts on
+    journal.state.update(total=0, notified=0)
+    assert get_run_result(journal)['statusCode'] == 200
+
+
+def test_post_notify_finished(monkeypatch):
+    class Journal:
+        finished = True
+
+        def __init__(self, *args):
+            self.state = {'total': 10, 'notified': 1}
+    monkeypatch.setattr(app, 'RunJournal', Journal)
+    monkeypatch.setattr(app, 'publish_signals', lambda: None)
+    monkeypatch.setattr(app.s3_cache, 'get_json', lambda *args: 0.5)
+    monkeypatch.setattr(app, 'get_client', lambda _: None)
+    event = {
+        'headers': {'emit_secret': keeper.encrypt('secret'.encode('UTF-8'))},
+        'body': json.dumps({'Time': '2020-01-01', 'Sig': True})
+    }
+    # the retry of a run that failed fails too
+    assert post_notify(event, None)['statusCode'] == 500
+
+
+class MarkerS3:
+    def __init__(self):
+        self.objects = {}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': '404', 'Message': ''}}, 'HeadObject')
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+
+def test_run_backfill(monkeypatch):
+    s3 = MarkerS3()
+    backfills = []
+    monkeypatch.setattr(backfill, 'backfill_alert_keys', lambda: backfills.append(1) or 3)
+    assert backfill.run_backfill(s3, 'bucket') == 3
+    assert json.loads(s3.objects[backfill.BACKFILL_KEY])['updated'] == 3
+    # later deploys find the marker and skip the scan
+    assert backfill.run_backfill(s3, 'bucket') is None
+    assert backfills == [1]
+
+
+def test_get_alert_indexes(monkeypatch):
+    s3 = MarkerS3()
+    monkeypatch.setattr(app, 'get_client', lambda _: s3)
+    monkeypatch.setattr(app, 'NUM_ALERT_INDEXES', 0)
+    assert get_alert_indexes() == []
+    monkeypatch.setattr(app, 'NUM_ALERT_INDEXES', 2)
+    # sparse indexes are only used once the keys are backfilled
+    assert get_alert_indexes() == []
+    s3.put_object('bucket', backfill.BACKFILL_KEY, '{}')
+    assert get_alert_indexes() == ['in_beta_email_index', 'in_beta_webhook_index']
+
+
 def test_notify_email():
     signal = transform_signal({'Time': '2020-01-01', 'Sig': True})
     signal['Perf'] = 0.5
     user = UserModel.get('test_user@example.com')
     notify_email(user, signal)
+
+
+def test_notify_email_reuses_client(monkeypatch):
+    monkeypatch.setattr(app, 'BULK_EMAIL', False)
+    signal = transform_signal({'Time': '2020-01-01', 'Sig': True})
+    signal['Perf'] = 0.5
+    user = SimpleNamespace(email='reuse@example.com')
+    client = get_client('sesv2')
+    assert get_client('sesv2') is client
+    render_email.cache_clear()
+    with Stubber(client) as stubber:
+        for _ in range(3):
+            stubber.add_response(
+                'send_email', {'MessageId': 'id'},
+                {'Destination': ANY, 'Content': ANY, 'FromEmailAddress': ANY})
+        for _ in range(3):
+            notify_email(user, signal)
+        stubber.assert_no_pending_responses()
+    # rendered once for every user, and the signal is left as is
+    assert render_email.cache_info().misses == 1
+    assert signal['Signal'] == 'BUY'
+    html = render_email(json.dumps(signal, sort_keys=True))['Body']['Html']['Data']
+    assert 'Buy Signal' in html
+
+
+def test_email_batcher():
+    ses = SESStub(reject=['user7@example.com'])
+    ses.create_email_template('alert', {})
+    batcher = EmailBatcher(ses, 'signals@forcepu.sh', 'alert', linger=0.1)
+    recipients = [f'user{idx}@example.com' for idx in range(120)]
+    processor = Processor(lambda recipient, _: (recipient, batcher.send(recipient)), None)
+    results = dict(processor.run(recipients))
+    # two full chunks and whatever was left after the linger
+    assert ses.calls['send_bulk_email'] == batcher.calls == 3
+    assert results['user7@example.com']['Status'] == 'MESSAGE_REJECTED'
+    assert sum(result['Status'] == 'SUCCESS' for result in results.values()) == 119
+    assert sorted(ses.sent) == sorted(set(recipients) - {'user7@example.com'})
+
+
+def test_email_batcher_failure():
+    batcher = EmailBatcher(SESStub(fail=True), 'signals@forcepu.sh', 'alert', size=2)
+    processor = Processor(lambda recipient, _: batcher.send(recipient), None)
+    # every recipient of the failed chunk fails
+    assert processor.run(['a', 'b']) == []
+
+
+def test_email_batcher_missing_results():
+    class ShortSES(SESStub):
+        # drops the last result
+        def send_bulk_email(self, **kwargs):
+            res = super().send_bulk_email(**kwargs)
+            return {'BulkEmailEntryResults': res['BulkEmailEntryResults'][:-1]}
+    ses = ShortSES()
+    ses.create_email_template('alert', {})
+    batcher = EmailBatcher(ses, 'signals@forcepu.sh', 'alert', size=3, timeout=1)
+    processor = Processor(lambda recipient, _: (recipient, batcher.send(recipient)), None)
+    start = time()
+    results = dict(processor.run(['a', 'b', 'c']))
+    # the recipient without a result fails instead of waiting forever
+    assert len(results) == 2
+    assert time() - start < 1
+
+
+def test_notify_email_bulk(monkeypatch):
+    ses = SESStub()
+    monkeypatch.setattr(app, 'BULK_EMAIL', True)
+    monkeypatch.setitem(app.clients, 'sesv2', ses)
+    app.batchers.clear()
+    signal = transform_signal({'Time': '2020-01-01', 'Sig': True})
+    signal['Perf'] = 0.5
+    users = [SimpleNamespace(email=f'user{idx}@example.com') for idx in range(60)]
+    processor = Processor(lambda user, signal: notify_email(user, signal) or user.email, signal)
+    assert len(processor.run(users)) == 60
+    assert ses.calls['send_bulk_email'] == 2
+    assert not ses.calls['send_email']
+    # the email is stored as a template once per signal, named for that signal
+    assert ses.calls['create_email_template'] == 1
+    name, template = list(ses.templates.items())[0]
+    assert name.startswith('signal-alert-dev-')
+    assert 'Buy Signal' in template['Html']
+    other = transform_signal({'Time': '2020-01-02', 'Sig': False})
+    other['Perf'] = 0.5
+    assert get_batcher(other).template != name
+    # templates don't pile up in the account once runs are over
+    delete_template(signal)
+    delete_template(other)
+    delete_template(other)
+    assert not ses.templates
+    assert not app.batchers
+
+
+def test_notify_webhook_disables(monkeypatch):
+    monkeypatch.setattr(app, 'webhooks', WebhookDispatcher(timeout=(0.5, 0.5), retries=0))
+    with HookServer({'/ok': [(200, 0)], '/down': [(500, 0)]}) as hooks:
+        user = UserModel('hook@example.com', api_key='key', alerts=Alerts(
+            webhook=hooks.url('/ok'), webhook_failures=3))
+        notify_webhook(user, {'Signal': 'BUY'})
+        assert user.alerts['webhook_failures'] == 0
+        user.alerts['webhook'] = hooks.url('/down')
+        for failures in range(1, MAX_WEBHOOK_FAILURES):
+            with pytest.raises(Exception):
+                notify_webhook(user, {'Signal': 'BUY'})
+            assert user.alerts['webhook_failures'] == failures
+        with pytest.raises(Exception):
+            notify_webhook(user, {'Signal': 'BUY'})
+    assert user.alerts['webhook'] == ''
+    assert user.alerts['webhook_failures'] == 0
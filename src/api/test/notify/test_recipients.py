@@ -0,0 +1,58 @@
+import sys
+import pytest
+from time import sleep, time
+from types import SimpleNamespace
+sys.path.append('src/api')  # noqa
+from notify.recipients import *  # noqa
+
+
+def pages(emails, delay=0, size=2):
+    # a paginated query, each page takes delay seconds
+    def query():
+        for idx, email in enumerate(emails):
+            if idx % size == 0:
+                sleep(delay)
+            yield SimpleNamespace(email=email)
+    return query
+
+
+def test_produce():
+    producer = RecipientProducer([
+        pages(['a', 'b', 'c']), pages(['b', 'd']), pages([])])
+    emails = [user.email for user in producer]
+    assert sorted(emails) == ['a', 'b', 'c', 'd']
+    assert producer.read == 5
+    assert producer.unique == 4
+    stats = producer.report(4)
+    assert stats['delivered'] == 4 and stats['read_per_sec'] > 0
+
+
+def test_produce_streams():
+    emails = [f'user{idx}' for idx in range(10)]
+    producer = RecipientProducer([pages(emails[:5], 0.1), pages(emails[5:], 0.1)], maxsize=2)
+    start = time()
+    users = iter(producer)
+    next(users)
+    # the first user comes with the first page, not after every query
+    assert time() - start < 0.2
+    rest = list(users)
+    assert len(rest) == 9
+    # both queries are read at once
+    assert time() - start < 0.5
+
+
+def test_produce_stop():
+    producer = RecipientProducer([pages([f'user{idx}' for idx in range(100)])], maxsize=1)
+    users = iter(producer)
+    next(users)
+    users.close()
+    assert producer.stopped.is_set()
+
+
+def test_produce_error():
+    def broken():
+        yield SimpleNamespace(email='a')
+        raise ValueError('query failed')
+    producer = RecipientProducer([broken, pages(['b'])])
+    with pytest.raises(ValueError):
+        list(producer)
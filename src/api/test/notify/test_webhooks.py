@@ -0,0 +1,53 @@
+import sys
+import pytest
+sys.path.append('src/api')  # noqa
+from notify.webhooks import *  # noqa
+from hooks import HookServer  # noqa
+
+
+def create_dispatcher(**kwargs):
+    return WebhookDispatcher(**({'timeout': (0.5, 0.2), 'backoff': 0.01} | kwargs))
+
+
+def test_post():
+    with HookServer({'/ok': [(200, 0)]}) as hooks:
+        dispatcher = create_dispatcher()
+        for _ in range(3):
+            dispatcher.post(hooks.url('/ok'), [{'Signal': 'BUY'}], {'X-API-Key': 'key'})
+    assert hooks.bodies[0] == ('key', [{'Signal': 'BUY'}])
+    # one pooled connection for every delivery
+    assert len(set(hooks.ports)) == 1
+
+
+def test_post_retries():
+    with HookServer({'/flaky': [(500, 0), (429, 0), (200, 0)], '/bad': [(400, 0)]}) as hooks:
+        dispatcher = create_dispatcher()
+        assert dispatcher.post(hooks.url('/flaky'), [], {}).ok
+        # client errors aren't retried
+        with pytest.raises(WebhookError):
+            dispatcher.post(hooks.url('/bad'), [], {})
+    assert hooks.hits == {'/flaky': 3, '/bad': 1}
+    assert not dispatcher.failures[hooks.url('/flaky')]
+
+
+def test_post_timeout():
+    with HookServer({'/slow': [(200, 1)]}) as hooks:
+        dispatcher = create_dispatcher(retries=1)
+        with pytest.raises(WebhookError):
+            dispatcher.post(hooks.url('/slow'), [], {})
+    assert hooks.hits['/slow'] == 2
+
+
+def test_post_breaker():
+    with HookServer({'/down': [(503, 0)]}) as hooks:
+        dispatcher = create_dispatcher(retries=0, threshold=2)
+        url = hooks.url('/down')
+        for _ in range(4):
+            with pytest.raises(WebhookError):
+                dispatcher.post(url, [], {})
+    # skipped once the url failed twice
+    assert hooks.hits['/down'] == 2
+    assert dispatcher.is_broken(url)
+    # the next run tries it again
+    dispatcher.reset()
+    assert not dispatcher.is_broken(url)
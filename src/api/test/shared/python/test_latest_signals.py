@@ -0,0 +1,91 @@
+import sys
+import json
+from io import BytesIO
+from datetime import date, timedelta
+from botocore.exceptions import ClientError
+sys.path.append('src/api')  # noqa
+from shared.python.latest_signals import *  # noqa
+
+
+class S3Stub:
+    # in memory s3 with ranged GETs
+    def __init__(self):
+        self.objects = {}
+        self.read = 0
+
+    def put_object(self, Bucket, Key, Body, **_):
+        body = Body.encode('UTF-8') if type(Body) == str else Body
+        self.objects[Key] = (f'"{hash(body)}"', body)
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': ''}}, 'GetObject')
+        etag, body = self.objects[Key]
+        if IfMatch and IfMatch != etag:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': ''}}, 'GetObject')
+        if not Range:
+            self.read += len(body)
+            return {'ETag': etag, 'Body': BytesIO(body)}
+        start, end = Range[len('bytes='):].split('-')
+        if not start:
+            start, end = max(len(body) - int(end), 0), len(body) - 1
+        start, end = int(start), min(int(end), len(body) - 1)
+        part = body[start:end + 1]
+        self.read += len(part)
+        return {
+            'ETag': etag, 'Body': BytesIO(part),
+            'ContentRange': f'bytes {start}-{end}/{len(body)}'}
+
+
+def signals_csv(days):
+    start = date(2020, 1, 1)
+    rows = [f'{start + timedelta(days=idx)},{idx % 2 == 0},0.5' for idx in range(days)]
+    return '\n'.join(['Time,Sig,Prob'] + rows) + '\n'
+
+
+def test_read_tail():
+    s3 = S3Stub()
+    s3.put_object('bucket', SIGNALS_KEY, signals_csv(1000))
+    header, rows, etag = read_tail(s3, 'bucket', num_rows=7, size=64)
+    assert header == 'Time,Sig,Prob'
+    assert rows[0].startswith('2022-09-20') and rows[-1].startswith('2022-09-26')
+    assert len(rows) == 7
+    assert etag == s3.objects[SIGNALS_KEY][0]
+    # only the end of the file and the header are read
+    assert s3.read < 1024
+
+
+def test_read_tail_small():
+    s3 = S3Stub()
+    s3.put_object('bucket', SIGNALS_KEY, signals_csv(3))
+    header, rows, _ = read_tail(s3, 'bucket')
+    assert header == 'Time,Sig,Prob'
+    assert len(rows) == 3
+
+
+def test_read_cost():
+    # the cost is the same for any history length
+    reads = []
+    for days in [100, 10000]:
+        s3 = S3Stub()
+        s3.put_object('bucket', SIGNALS_KEY, signals_csv(days))
+        read_tail(s3, 'bucket')
+        reads.append(s3.read)
+    assert reads[0] == reads[1]
+
+
+def test_parse_signals():
+    signals = parse_signals('Time,Sig,Prob', ['2020-01-01,True,0.5', '2020-01-02,False,0.5'])
+    assert [signal['Signal'] for signal in signals] == ['BUY', 'SELL']
+    assert signals[0]['Date'] == '2020-01-01'
+    assert signals[0]['Day'] == 'Wed'
+
+
+def test_publish_latest():
+    s3 = S3Stub()
+    s3.put_object('bucket', SIGNALS_KEY, signals_csv(30))
+    latest = publish_latest(s3, 'bucket')
+    assert len(latest['data']) == LATEST_SIGNALS
+    assert latest['data'][-1]['Date'] == '2020-01-30'
+    assert json.loads(s3.objects[LATEST_KEY][1]) == latest
+    assert latest['source_etag'] == s3.objects[SIGNALS_KEY][0]
@@ -1,5 +1,6 @@
 import sys
 from datetime import datetime
+from types import SimpleNamespace
 sys.path.append('src/api')  # noqa
 from shared.python.models import *  # noqa
 from shared.python.utils import PAST_DATE  # noqa
@@ -87,6 +88,128 @@ class TestSubscribedIndex():
     assert 'subscribed' in dir(subscribed_index)
 
 
+class TestAlertIndexes():
+    for index, hash_key, range_key in [
+        (InBetaEmailIndex, 'in_beta', 'notify_email'),
+        (InBetaWebhookIndex, 'in_beta', 'notify_webhook'),
+        (SubscribedEmailIndex, 'subscribed', 'notify_email'),
+        (SubscribedWebhookIndex, 'subscribed', 'notify_webhook'),
+    ]:
+        assert hash_key in dir(index())
+        assert range_key in dir(index())
+
+
+def test_get_alert_key_actions():
+    actions = get_alert_key_actions({'email': True, 'webhook': ''})
+    assert [type(action).__name__ for action in actions] == ['SetAction', 'RemoveAction']
+    actions = get_alert_key_actions(Alerts(webhook='url'))
+    assert [type(action).__name__ for action in actions] == ['RemoveAction', 'SetAction']
+
+
+def test_plan_alert_queries():
+    plan = plan_alert_queries()
+    indexes = [index.Meta.index_name for index, _ in plan]
+    # only the sparse indexes are read once they are all deployed
+    assert indexes == ALERT_INDEXES
+    assert all(condition is None for _, condition in plan)
+    plan = plan_alert_queries(['email'], ['subscribed'])
+    assert [(index.Meta.index_name, condition) for index, condition in plan] == [
+        ('subscribed_email_index', None)]
+    # indexes that aren't deployed yet fall back to the audience index
+    plan = plan_alert_queries(indexes=ALERT_INDEXES[:1])
+    assert [index.Meta.index_name for index, _ in plan] == [
+        'in_beta_email_index', 'in_beta_index', 'subscribed_index']
+    assert [condition is None for _, condition in plan] == [True, False, False]
+    plan = plan_alert_queries(indexes=[])
+    assert [index.Meta.index_name for index, _ in plan] == ['in_beta_index', 'subscribed_index']
+
+
+def test_write_buffer():
+    written = []
+    updated = []
+
+    def write(chunk):
+        if any(user.email == 'bad' for user, _ in chunk):
+            raise Exception('transaction cancelled')
+        written.append([user.email for user, _ in chunk])
+
+    def create_user(email):
+        def update(actions):
+            if email == 'bad':
+                raise Exception('update failed')
+            updated.append(email)
+        return SimpleNamespace(email=email, update=update)
+    buffer = WriteBuffer(size=2, write=write)
+    for email in ['a', 'b', 'c', 'bad', 'd']:
+        buffer.add(create_user(email), [])
+    # full chunks are written as they fill up
+    assert written == [['a', 'b']]
+    # the failed chunk falls back to single updates, the rest waits for flush
+    assert updated == ['c']
+    assert buffer.flush() == ['bad']
+    assert written == [['a', 'b'], ['d']]
+    assert buffer.written == 4
+    assert buffer.flush() == []
+
+
+def test_api_key_cache():
+    now = [0]
+    queries = []
+    users = {'key': SimpleNamespace(email='a')}
+
+    def query(api_key):
+        queries.append(api_key)
+        return [users[api_key]] if api_key in users else []
+    cache = APIKeyCache(size=2, ttl=60, invalid_size=2, invalid_ttl=30,
+                        query=query, clock=lambda: now[0])
+    assert cache.get('key').email == 'a'
+    # warm requests skip the query
+    assert cache.get('key').email == 'a'
+    assert queries == ['key']
+    assert cache.get('') is None
+    # bad keys are remembered, for less time
+    assert cache.get('bad') is None
+    assert cache.get('bad') is None
+    assert queries == ['key', 'bad']
+    now[0] = 31
+    assert cache.get('bad') is None
+    assert queries == ['key', 'bad', 'bad']
+    # a flood of bad keys doesn't push out real users
+    for idx in range(5):
+        cache.get(f'bad{idx}')
+    assert len(cache.invalid) == 2
+    assert cache.get('key').email == 'a'
+    assert queries.count('key') == 1
+    now[0] = 61
+    cache.get('key')
+    assert queries.count('key') == 2
+    cache.invalidate('key')
+    cache.get('key')
+    assert queries.count('key') == 3
+    assert cache.hits == 3 and cache.misses == 10
+
+
+def test_api_key_cache_lru():
+    cache = APIKeyCache(size=2, query=lambda api_key: [SimpleNamespace(email=api_key)])
+    for api_key in ['a', 'b', 'a', 'c']:
+        cache.get(api_key)
+    # b was used least recently
+    assert list(cache.users) == ['a', 'c']
+
+
+def test_transact_update():
+    user = UserModel.get('test_user@example.com')
+    in_beta = user.in_beta
+    buffer = WriteBuffer()
+    buffer.add(user, [UserModel.in_beta.set(1 - in_beta)])
+    try:
+        assert buffer.flush() == []
+        assert UserModel.get('test_user@example.com').in_beta == 1 - in_beta
+    finally:
+        # other tests share the seeded user
+        user.update(actions=[UserModel.in_beta.set(in_beta)])
+
+
 class TestUserModel():
     user = UserModel('test_user@example.com')
     assert type(user.email) == str
@@ -109,3 +232,5 @@ class TestUserModel():
     assert type(user.customer_id_index) == CustomerIdIndex
     assert type(user.in_beta_index) == InBetaIndex
     assert type(user.subscribed_index) == SubscribedIndex
+    assert user.notify_email is None
+    assert user.notify_webhook is None
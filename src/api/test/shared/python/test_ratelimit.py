@@ -0,0 +1,48 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+sys.path.append('src/api')  # noqa
+from shared.python.ratelimit import *  # noqa
+from shared.python.models import UserModel  # noqa
+from shared.python.utils import PAST_DATE  # noqa
+
+now = datetime(2023, 1, 2, tzinfo=timezone.utc)
+quota = {'requests': 3, 'window': timedelta(days=1)}
+
+
+def test_get_tier():
+    assert get_tier(SimpleNamespace(subscribed=1, in_beta=1)) == 'subscribed'
+    assert get_tier(SimpleNamespace(subscribed=0, in_beta=1)) == 'in_beta'
+    assert get_tier(SimpleNamespace(subscribed=0, in_beta=0)) is None
+
+
+def test_check_queue():
+    hour = timedelta(hours=1)
+    queue, remaining = check_queue([PAST_DATE] * 3, quota, now)
+    assert queue == [PAST_DATE, PAST_DATE, now]
+    assert remaining == 2
+    # shorter queues, e.g. after moving to a bigger tier, have free slots
+    assert check_queue([], quota, now) == ([now], 2)
+    queue, remaining = check_queue([PAST_DATE, now - 2 * hour, now - hour], quota, now)
+    assert queue == [now - 2 * hour, now - hour, now]
+    assert remaining == 0
+    assert check_queue(queue, quota, now) is None
+    # the oldest access leaves the window
+    assert check_queue(queue, quota, now + timedelta(hours=22, minutes=30))[1] == 0
+    # a quota of one keeps only the last access
+    assert check_queue([PAST_DATE], {'requests': 1, 'window': hour}, now) == ([now], 0)
+
+
+def test_acquire():
+    user = UserModel.get('test_user@example.com')
+    user.update(actions=[UserModel.in_beta.set(1), UserModel.subscribed.set(0),
+                         UserModel.access_queue.set([PAST_DATE] * 3)])
+    limiter = RateLimiter({'in_beta': quota})
+    assert limiter.acquire(user, now) == 2
+    # a stale copy fails the condition, gets re-read and still counts
+    stale = UserModel.get('test_user@example.com')
+    assert limiter.acquire(user, now) == 1
+    assert limiter.acquire(stale, now) == 0
+    assert limiter.acquire(user, now) is None
+    assert UserModel.get('test_user@example.com').access_queue == [now] * 3
+    assert RateLimiter({}).acquire(user, now) is None
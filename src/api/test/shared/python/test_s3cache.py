@@ -0,0 +1,72 @@
+import sys
+import json
+from io import BytesIO
+sys.path.append('src/api')  # noqa
+from shared.python.s3cache import *  # noqa
+from botocore.exceptions import ClientError  # noqa
+
+
+class S3Stub:
+    # in memory s3 that honors If-None-Match like the real one
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+
+    def put(self, key, data):
+        etag = f'"{len(self.calls)}-{hash(json.dumps(data))}"'
+        self.objects[key] = (etag, json.dumps(data).encode('UTF-8'))
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.calls.append(IfNoneMatch)
+        etag, body = self.objects[Key]
+        if IfNoneMatch == etag:
+            raise ClientError(
+                {'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        return {'ETag': etag, 'Body': BytesIO(body)}
+
+
+def test_get():
+    s3 = S3Stub()
+    s3.put('preview.json', {'a': 1})
+    cache = S3Cache(s3)
+
+    first = cache.get('bucket', 'preview.json')
+    assert json.loads(first['body']) == {'a': 1}
+    assert s3.calls == [None]
+
+    # unchanged objects are revalidated, not downloaded
+    assert cache.get('bucket', 'preview.json') is first
+    assert s3.calls == [None, first['etag']]
+    assert cache.hits == 1
+    assert cache.requests == 2
+
+    s3.put('preview.json', {'a': 2})
+    assert json.loads(cache.get('bucket', 'preview.json')['body']) == {'a': 2}
+    assert cache.hits == 1
+
+
+def test_get_json():
+    s3 = S3Stub()
+    s3.put('preview.json', {'a': [1, 2, 3]})
+    cache = S3Cache(s3)
+    parsed = []
+
+    def extract(data):
+        parsed.append(data)
+        return data['a'][-1]
+
+    assert cache.get_json('bucket', 'preview.json', extract) == 3
+    assert cache.get_json('bucket', 'preview.json', extract) == 3
+    assert len(parsed) == 1
+    # only the etag is kept, not the downloaded body
+    assert cache.objects[('bucket', 'preview.json')]['body'] is None
+    # without an extractor the whole document is returned
+    assert cache.get_json('bucket', 'preview.json') == {'a': [1, 2, 3]}
+    assert cache.objects[('bucket', 'preview.json')]['body'] is None
+
+    s3.put('preview.json', {'a': [4]})
+    assert cache.get_json('bucket', 'preview.json', extract) == 4
+    assert len(parsed) == 2
+    # results for the old ETag are dropped
+    memo = cache.parsed[('bucket', 'preview.json')]
+    assert list(memo) == [(cache.objects[('bucket', 'preview.json')]['etag'], extract)]
@@ -0,0 +1,47 @@
+import sys
+sys.path.append('src/api')  # noqa
+from shared.python.signal_history import *  # noqa
+
+MONTHS = {
+    '2020-01': [{'Date': f'2020-01-{day:02}'} for day in range(1, 32)],
+    '2020-02': [{'Date': f'2020-02-{day:02}'} for day in range(1, 30)],
+    '2020-03': [{'Date': f'2020-03-{day:02}'} for day in range(1, 32)],
+}
+
+
+def test_parse_date():
+    assert parse_date('2020-01-01') == '2020-01-01'
+    assert parse_date('2020-1-1') == '2020-01-01'
+    assert parse_date('2020-02-30') is None
+    assert parse_date('yesterday') is None
+    assert parse_date(None) is None
+
+
+def test_group_by_month():
+    signals = MONTHS['2020-01'][-1:] + MONTHS['2020-02'][:2]
+    assert group_by_month(signals) == {'2020-01': signals[:1], '2020-02': signals[1:]}
+
+
+def test_query_history():
+    read = []
+
+    def read_month(month):
+        read.append(month)
+        return MONTHS[month]
+    months = list(MONTHS)
+    page = query_history(read_month, months, '2020-02-10', '2020-02-20')
+    assert [signal['Date'] for signal in page['data']] == [f'2020-02-{day}' for day in range(10, 21)]
+    assert page['cursor'] is None
+    # only the partitions in the range are read
+    assert read == ['2020-02']
+
+    read.clear()
+    page = query_history(read_month, months, '2020-01-15', '2020-03-31', page_size=20)
+    assert page['data'][0]['Date'] == '2020-01-15' and page['data'][-1]['Date'] == '2020-02-03'
+    assert page['cursor'] == '2020-02-04'
+    dates = [signal['Date'] for signal in page['data']]
+    while page['cursor']:
+        page = query_history(read_month, months, '2020-01-15', '2020-03-31', page['cursor'], 20)
+        dates += [signal['Date'] for signal in page['data']]
+    assert dates == [signal['Date'] for month in months for signal in MONTHS[month]][14:]
+    assert read[0] == '2020-01' and read[-1] == '2020-03'
@@ -0,0 +1,57 @@
+# Measures get_signals latency on a warm cache hit vs a miss,
+# against an in memory s3 with LATENCY seconds per call.
+# DynamoDB is left out, the user and quota are stubbed.
+# Usage: python src/api/test/signals/bench_signals.py
+import os
+import sys
+from time import perf_counter
+from types import SimpleNamespace
+sys.path.append('src/api')  # noqa
+sys.path.append('src/api/shared/python')  # noqa
+os.environ.setdefault('TABLE_NAME', 'users-local')  # noqa
+from signals import app  # noqa
+from latest_signals import publish_latest  # noqa
+from s3 import S3Stub  # noqa
+
+LATENCY = 0.01
+NUM_DAYS = 2000
+NUM_RUNS = 200
+EVENT = {'httpMethod': 'GET', 'headers': {'x-api-key': 'key'}}
+
+
+def percentile(timings, pct):
+    timings = sorted(timings)
+    return timings[min(int(len(timings) * pct / 100), len(timings) - 1)]
+
+
+def run(get_cache):
+    timings = []
+    for _ in range(NUM_RUNS):
+        app.signals_cache = get_cache()
+        start = perf_counter()
+        res = app.get_signals(EVENT)
+        timings.append(perf_counter() - start)
+        assert res['statusCode'] == 200
+    return percentile(timings, 50), percentile(timings, 99)
+
+
+if __name__ == '__main__':
+    s3 = S3Stub(latency=LATENCY)
+    rows = [f'2020-01-01,{day % 2 == 0}' for day in range(NUM_DAYS)]
+    s3.put_object('bucket', 'models/latest/signals.csv', '\n'.join(['Time,Sig'] + rows) + '\n')
+    publish_latest(s3, 'bucket')
+    os.environ['S3_BUCKET'] = 'bucket'
+    user = SimpleNamespace(email='bench', in_beta=1, subscribed=0)
+    app.api_keys.get = lambda _: user
+    app.update_access_queue = lambda _: 4
+
+    warm = app.SignalsCache(s3, max_age=3600)
+    revalidated = app.SignalsCache(s3, max_age=0)
+    results = {
+        'hit': run(lambda: warm),
+        'revalidate': run(lambda: revalidated),
+        'miss': run(lambda: app.SignalsCache(s3)),
+    }
+    print(f's3 latency: {LATENCY * 1000:.0f} ms per call')
+    for name, (p50, p99) in results.items():
+        print(f'{name:<11} p50 {p50 * 1000:8.3f} ms  p99 {p99 * 1000:8.3f} ms')
@@ -0,0 +1,51 @@
+# Offline stand-in for the s3 client calls used by signals/.
+# Supports ranged and conditional GETs, and can add latency per call.
+from io import BytesIO
+from time import sleep
+from hashlib import md5
+from collections import Counter
+from botocore.exceptions import ClientError
+
+
+def client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': ''}}, operation)
+
+
+class S3Stub:
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.objects = {}
+        self.calls = Counter()
+
+    def call(self, name):
+        self.calls[name] += 1
+        sleep(self.latency)
+
+    def put_object(self, Bucket, Key, Body, **_):
+        body = Body.encode('UTF-8') if type(Body) == str else Body
+        self.objects[Key] = (f'"{md5(body).hexdigest()}"', body)
+
+    def head_object(self, Bucket, Key):
+        self.call('head_object')
+        if Key not in self.objects:
+            raise client_error('404', 'HeadObject')
+        return {'ETag': self.objects[Key][0]}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, IfNoneMatch=None):
+        self.call('get_object')
+        if Key not in self.objects:
+            raise client_error('NoSuchKey', 'GetObject')
+        etag, body = self.objects[Key]
+        if IfMatch and IfMatch != etag:
+            raise client_error('PreconditionFailed', 'GetObject')
+        if IfNoneMatch == etag:
+            raise client_error('304', 'GetObject')
+        if not Range:
+            return {'ETag': etag, 'Body': BytesIO(body)}
+        start, end = Range[len('bytes='):].split('-')
+        if not start:
+            start, end = max(len(body) - int(end), 0), len(body) - 1
+        start, end = int(start), min(int(end), len(body) - 1)
+        return {
+            'ETag': etag, 'Body': BytesIO(body[start:end + 1]),
+            'ContentRange': f'bytes {start}-{end}/{len(body)}'}
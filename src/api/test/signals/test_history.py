@@ -0,0 +1,75 @@
+import sys
+import json
+sys.path.append('src/api')  # noqa
+from signals import app  # noqa
+from signals.app import *  # noqa
+from shared.python.signal_history import *  # noqa
+from s3 import S3Stub  # noqa
+
+
+def signals_csv(start, end, sig=True):
+    rows = [f'2020-{month:02}-{day:02},{sig}' for month in range(start, end + 1) for day in range(1, 29)]
+    return '\n'.join(['Time,Sig'] + rows) + '\n'
+
+
+def test_publish_history():
+    s3 = S3Stub()
+    s3.put_object('bucket', SIGNALS_KEY, signals_csv(1, 6))
+    # the first publish splits the whole csv
+    index = publish_history(s3, 'bucket')
+    assert index['months'] == [f'2020-{month:02}' for month in range(1, 7)]
+    assert len(json.loads(s3.objects[month_key('2020-03')][1])) == 28
+    # unchanged csv, nothing is written
+    assert publish_history(s3, 'bucket') == index
+    # later signals only rewrite the recent months
+    s3.put_object('bucket', SIGNALS_KEY, signals_csv(1, 7, False))
+    january = s3.objects[month_key('2020-01')]
+    index = publish_history(s3, 'bucket')
+    assert index['months'][-1] == '2020-07'
+    assert s3.objects[month_key('2020-01')] == january
+    june = json.loads(s3.objects[month_key('2020-06')][1])
+    assert len(june) == 28 and june[-1]['Signal'] == 'SELL'
+
+
+def test_get_history(monkeypatch):
+    s3 = S3Stub()
+    s3.put_object('bucket', SIGNALS_KEY, signals_csv(1, 6))
+    monkeypatch.setattr(app, 'signals_cache', SignalsCache(s3))
+    monkeypatch.setenv('S3_BUCKET', 'bucket')
+    accesses = []
+
+    def check_access(_):
+        accesses.append(1)
+        return None, 'message'
+    monkeypatch.setattr(app, 'check_access', check_access)
+    event = {
+        'httpMethod': 'GET', 'resource': '/signals/history', 'headers': {},
+        'queryStringParameters': None}
+    assert handle_signals(event, None)['statusCode'] == 503
+    publish_history(s3, 'bucket')
+    accesses.clear()
+
+    dates = []
+    while True:
+        res = handle_signals(event, None)
+        assert res['statusCode'] == 200
+        body = json.loads(res['body'])
+        dates += [signal['Date'] for signal in body['data']]
+        if not body['cursor']:
+            break
+        event['queryStringParameters'] = {'cursor': body['cursor']}
+    assert len(dates) == 6 * 28 and dates == sorted(dates)
+    # the quota counts pages, not signals
+    assert len(accesses) == 2
+
+    event['queryStringParameters'] = {'start': '2020-02-27', 'end': '2020-03-02'}
+    body = json.loads(handle_signals(event, None)['body'])
+    assert [signal['Date'] for signal in body['data']] == [
+        '2020-02-27', '2020-02-28', '2020-03-01', '2020-03-02']
+    assert body['cursor'] is None
+
+    for params in [{'start': 'bad'}, {'start': '2020-03-01', 'end': '2020-02-01'}, {'cursor': ''}]:
+        event['queryStringParameters'] = params
+        assert handle_signals(event, None)['statusCode'] == 400
+    # bad requests don't use up the quota
+    assert len(accesses) == 3
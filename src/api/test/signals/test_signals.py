@@ -5,6 +5,13 @@ sys.path.append('src/api')  # noqa
 from signals.app import *  # noqa
 from shared.python.models import UserModel  # noqa
 from shared.python.utils import DATE_FMT  # noqa
+from shared.python.latest_signals import publish_latest  # noqa
+from s3 import S3Stub  # noqa
+
+
+def signals_csv(days, sig=True):
+    rows = [f'2020-01-{day:02},{sig}' for day in range(1, days + 1)]
+    return '\n'.join(['Time,Sig'] + rows) + '\n'
 
 
 def test_handle_signals():
@@ -37,10 +44,15 @@ def test_get_signals():
     event['headers']['x-api-key'] = 'test_api_key'
     user = UserModel.get('test_user@example.com')
     user.update(actions=[UserModel.in_beta.set(0)])
+    # changes made elsewhere reach a warm container after API_KEY_TTL
+    api_keys.invalidate('test_api_key')
     res = get_signals(event)
     assert res['statusCode'] == 402
     user.update(actions=[UserModel.in_beta.set(1)])
     res = get_signals(event)
+    assert res['statusCode'] == 402
+    api_keys.invalidate('test_api_key')
+    res = get_signals(event)
     assert res['statusCode'] == 200
     data = json.loads(res['body'])['data']
     for datum in data:
@@ -49,9 +61,46 @@ def test_get_signals():
         assert datum['Day'] in set(
             ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat'])
         assert datum['Asset'] == 'BTC'
-    for _ in range(max_accesses):
+    for _ in range(limiter.get_quota(user)['requests']):
         remaining = update_access_queue(user)
 
     assert not remaining
+    api_keys.invalidate('test_api_key')
     res = get_signals(event)
     assert res['statusCode'] == 403
+
+
+def test_signals_cache():
+    s3 = S3Stub()
+    s3.put_object('bucket', 'models/latest/signals.csv', signals_csv(10))
+    publish_latest(s3, 'bucket')
+    now = [0]
+    cache = SignalsCache(s3, max_age=60, clock=lambda: now[0])
+    entry = cache.get('bucket')
+    data = json.loads(entry['data'])
+    assert [datum['Date'] for datum in data] == [f'2020-01-{day:02}' for day in range(4, 11)]
+    # hits don't touch s3 until max_age is up
+    calls = sum(s3.calls.values())
+    assert cache.get('bucket') is entry
+    assert sum(s3.calls.values()) == calls
+    now[0] = 61
+    # an unchanged csv is a single HEAD
+    assert cache.get('bucket') is entry
+    assert sum(s3.calls.values()) == calls + 1
+    assert cache.hits == 1 and cache.misses == 2
+
+    # a csv the precomputed signals haven't caught up with is read from the tail
+    s3.put_object('bucket', 'models/latest/signals.csv', signals_csv(11, False))
+    now[0] = 122
+    data = json.loads(cache.get('bucket')['data'])
+    assert data[-1]['Date'] == '2020-01-11' and data[-1]['Signal'] == 'SELL'
+
+    # s3 errors keep serving what's cached
+    s3.objects.clear()
+    now[0] = 183
+    assert json.loads(cache.get('bucket')['data']) == data
+    try:
+        SignalsCache(s3).get('bucket')
+        assert False
+    except ClientError:
+        pass
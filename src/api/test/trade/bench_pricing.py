@@ -0,0 +1,59 @@
+# Compares the scalar chance_of_profit path to the batched pricing engine.
+# Usage: python src/api/test/trade/bench_pricing.py
+import sys
+import numpy as np
+from time import perf_counter
+sys.path.append('src/api')  # noqa
+sys.path.append('src/api/shared/python')  # noqa
+from trade.pricing import price_chain  # noqa
+from trade.app import chance_of_profit  # noqa
+
+NUM_CONTRACTS = 5000
+NUM_RUNS = 5
+
+
+def synthetic_chain(num=NUM_CONTRACTS, seed=0):
+    rng = np.random.default_rng(seed)
+    stock_price = 100.0
+    return {
+        'stock_price': np.full(num, stock_price),
+        'strike_price': rng.uniform(0.8, 1.5, num) * stock_price,
+        'implied_vol': rng.uniform(0.1, 1.5, num),
+        'time': rng.integers(1, 60, num) / 365,
+    }
+
+
+def run_scalar(chain):
+    return [
+        chance_of_profit(
+            stock_price=stock_price, strike_price=strike_price,
+            implied_vol=implied_vol, rho=0, div_yield=0, time=time)
+        for stock_price, strike_price, implied_vol, time in zip(
+            chain['stock_price'].tolist(), chain['strike_price'].tolist(),
+            chain['implied_vol'].tolist(), chain['time'].tolist())
+    ]
+
+
+def run_batched(chain):
+    return price_chain(**chain)['chance_of_profit_short']
+
+
+def best_of(fx, chain):
+    timings = []
+    for _ in range(NUM_RUNS):
+        start = perf_counter()
+        result = fx(chain)
+        timings.append(perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == '__main__':
+    chain = synthetic_chain()
+    scalar_time, scalar = best_of(run_scalar, chain)
+    batched_time, batched = best_of(run_batched, chain)
+    error = np.max(np.abs(np.array(scalar) - batched))
+    print(f'contracts: {NUM_CONTRACTS}')
+    print(f'scalar:  {scalar_time * 1000:.2f} ms')
+    print(f'batched: {batched_time * 1000:.2f} ms (includes greeks)')
+    print(f'speedup: {scalar_time / batched_time:.1f}x')
+    print(f'max abs error: {error:.2e}')
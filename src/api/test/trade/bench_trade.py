@@ -0,0 +1,85 @@
+# Benchmarks repricing strategies for the Trade state machine against the
+# offline SimBroker. Wall time is virtual (time spent waiting on fills),
+# compute time is real.
+# Usage: python src/api/test/trade/bench_trade.py [num_symbols] [num_seeds]
+import io
+import sys
+from time import perf_counter
+from statistics import mean
+from collections import Counter
+from contextlib import redirect_stdout
+sys.path.append('src/api')  # noqa
+sys.path.append('src/api/shared/python')  # noqa
+from trade.app import Sell, Buy, get_mid_price  # noqa
+from broker import SimBroker, synthetic_book, short_book  # noqa
+
+
+class TwoTickSell(Sell):
+    # steps two ticks per round
+    def get_price(self, contract, offset):
+        return super().get_price(contract, offset * 2)
+
+
+class SpreadSell(Sell):
+    # steps a tenth of the bid/ask spread per round
+    def get_price(self, contract, offset):
+        spread = contract.ask - contract.bid
+        return super().get_price(contract, offset * max(round(spread / 10 / contract.below_tick), 1))
+
+
+class TwoTickBuy(Buy):
+    def get_price(self, contract, offset):
+        return super().get_price(contract, offset * 2)
+
+
+STRATEGIES = {
+    'sell (1 tick)': (Sell, False),
+    'sell (2 ticks)': (TwoTickSell, False),
+    'sell (1/10 spread)': (SpreadSell, False),
+    'buy (1 tick)': (Buy, True),
+    'buy (2 ticks)': (TwoTickBuy, True),
+}
+
+
+def run(strategy, book):
+    sim = SimBroker(book)
+    symbols = list(book['holdings'].keys())
+    start = perf_counter()
+    with sim.patch(), redirect_stdout(io.StringIO()):
+        results = strategy().execute(symbols)
+    compute = perf_counter() - start
+    placed = Counter(order['chain_symbol'] for order in sim.placed.values())
+    filled = [order for order in sim.placed.values() if order['state'] == 'filled']
+    # how far from the mid each fill landed, as a fraction of the mid
+    slippage = [
+        abs(float(order['price']) - get_mid_price(sim.book['options'][order['option_id']]['market'])) /
+        get_mid_price(sim.book['options'][order['option_id']]['market'])
+        for order in filled
+    ]
+    return {
+        'filled': len(filled) / len(symbols),
+        'rounds': mean(placed.values()),
+        'wall': sim.now,
+        'compute': compute,
+        'calls': sum(sim.calls.values()) / len(symbols),
+        'slippage': mean(slippage) if slippage else float('nan'),
+        'exhausted': sum(1 for result in results.values() if 'error' in result),
+    }
+
+
+def main(num_symbols=10, num_seeds=5):
+    symbols = [f'SYM{idx}' for idx in range(num_symbols)]
+    books = [synthetic_book(symbols, seed=seed) for seed in range(num_seeds)]
+    print(f'{num_symbols} symbols, {num_seeds} seeds')
+    print(f"{'strategy':<20}{'filled':>8}{'rounds':>8}{'wall (s)':>10}"
+          f"{'cpu (s)':>9}{'calls/sym':>11}{'slippage':>10}{'exhausted':>11}")
+    for name, (strategy, short) in STRATEGIES.items():
+        runs = [run(strategy, short_book(book) if short else book) for book in books]
+        stats = {key: mean(run[key] for run in runs) for key in runs[0]}
+        print(f"{name:<20}{stats['filled']:>8.0%}{stats['rounds']:>8.1f}{stats['wall']:>10.1f}"
+              f"{stats['compute']:>9.2f}{stats['calls']:>11.1f}{stats['slippage']:>10.1%}"
+              f"{stats['exhausted']:>11.1f}")
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,368 @@
+# Offline stand-in for the subset of robin_stocks.robinhood used by trade/.
+# Replays a recorded or synthetic order book with a virtual clock, so the
+# Trade state machine can be exercised and benchmarked without a brokerage.
+import os
+import sys
+import json
+import numpy as np
+from uuid import uuid4
+from threading import RLock
+from collections import Counter
+from types import SimpleNamespace
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+sys.path.append('src/api')  # noqa
+from trade.pricing import calc_d1, calc_d2, norm_cdf, price_chain  # noqa
+
+TRADE_DIR = os.path.realpath(
+    os.path.join(os.path.dirname(__file__), '..', '..', 'trade'))
+# modules whose sleep / time get swapped for the virtual clock
+CLOCK_MODULES = set(['monitor', 'quotes'])
+API_URL = 'https://api.robinhood.com'
+MIN_TICKS = {'above_tick': '0.05', 'below_tick': '0.01', 'cutoff_price': '3.00'}
+OPEN_STATES = set(['queued', 'confirmed'])
+
+
+def fmt(n):
+    return f'{n:.4f}'
+
+
+def option_instruments_url(id=None):
+    return f'{API_URL}/options/instruments/{id}/' if id else f'{API_URL}/options/instruments/'
+
+
+def marketdata_options_url():
+    return f'{API_URL}/marketdata/options/'
+
+
+def get_fridays(today, num):
+    days_until_friday = (4 - today.weekday()) % 7
+    friday = today + timedelta(days=days_until_friday)
+    return [(friday + timedelta(weeks=idx)).strftime('%Y-%m-%d') for idx in range(num)]
+
+
+def create_option(symbol, expiration, strike, market, fill_price, buy_fill_price):
+    id = str(uuid4())
+    url = option_instruments_url(id)
+    instrument = {
+        'id': id, 'url': url, 'chain_symbol': symbol, 'type': 'call',
+        'expiration_date': expiration, 'strike_price': fmt(strike),
+        'state': 'active', 'tradability': 'tradable', 'min_ticks': MIN_TICKS
+    }
+    market = {'instrument': url, 'instrument_id': id} | market
+    return {'instrument': instrument, 'market': market,
+            'fill_price': fill_price, 'buy_fill_price': buy_fill_price}
+
+
+def synthetic_book(symbols, seed=0, today=None, num_expirations=4, contracts=2):
+    # Builds a book of calls priced with Black-Scholes.
+    # Every contract gets a hidden fill price somewhere between the mid and
+    # the bid (for sells) or the ask (for buys) that the broker fills at.
+    rng = np.random.default_rng(seed)
+    today = today or datetime.now()
+    book = {'holdings': {}, 'options': {}, 'positions': []}
+    for symbol in symbols:
+        spot = round(float(rng.uniform(20, 400)), 2)
+        iv = float(rng.uniform(0.2, 0.8))
+        book['holdings'][symbol] = {
+            'price': fmt(spot), 'quantity': fmt(100 * contracts + 17),
+            'id': str(uuid4())
+        }
+        step = 1 if spot < 100 else 5
+        strikes = np.arange(np.ceil(spot * 0.9 / step), np.floor(spot * 1.5 / step)) * step
+        for expiration in get_fridays(today, num_expirations):
+            end = datetime.strptime(expiration, '%Y-%m-%d') + timedelta(days=1)
+            time = max((end - today).total_seconds(), 3600) / timedelta(days=365).total_seconds()
+            ivs = iv * rng.uniform(0.9, 1.1, len(strikes))
+            d1 = calc_d1(spot, strikes, ivs, 0, 0, time)
+            d2 = calc_d2(d1, ivs, time)
+            theos = spot * norm_cdf(d1) - strikes * norm_cdf(d2)
+            chain = price_chain(spot, strikes, ivs, time)
+            for idx, strike in enumerate(strikes):
+                theo = max(float(theos[idx]), 0.01)
+                half_spread = max(theo * float(rng.uniform(0.05, 0.25)), 0.01)
+                bid = max(round(theo - half_spread, 2), 0)
+                ask = round(theo + half_spread, 2)
+                mid = (bid + ask) / 2
+                market = {
+                    'bid_price': fmt(bid), 'ask_price': fmt(ask),
+                    'adjusted_mark_price': fmt(mid), 'mark_price': fmt(mid),
+                    'implied_volatility': fmt(ivs[idx])
+                } | {key: fmt(chain[key][idx]) for key in [
+                    'chance_of_profit_short', 'chance_of_profit_long',
+                    'delta', 'gamma', 'theta', 'vega', 'rho']}
+                option = create_option(
+                    symbol, expiration, float(strike), market,
+                    fill_price=mid - float(rng.uniform(0, 1)) * (mid - bid),
+                    buy_fill_price=mid + float(rng.uniform(0, 1)) * (ask - mid))
+                book['options'][option['instrument']['id']] = option
+    return book
+
+
+def short_book(book, expiration_idx=0, otm=1.1):
+    # adds one short call per symbol, for exercising Buy / rolls
+    book = json.loads(json.dumps(book))
+    for symbol, holding in book['holdings'].items():
+        options = [option for option in book['options'].values()
+                   if option['instrument']['chain_symbol'] == symbol]
+        expiration = sorted(set(option['instrument']['expiration_date']
+                                for option in options))[expiration_idx]
+        target = float(holding['price']) * otm
+        option = min(
+            [option for option in options
+             if option['instrument']['expiration_date'] == expiration],
+            key=lambda option: abs(float(option['instrument']['strike_price']) - target))
+        contracts = int(float(holding['quantity']) / 100)
+        book['positions'].append(
+            {'option_id': option['instrument']['id'], 'quantity': contracts})
+    return book
+
+
+def record_book(api, symbols, expirations):
+    # Records a replayable book from the live api (robin_stocks.robinhood).
+    # expirations maps each symbol to the expiration dates to capture.
+    # Fill prices default to the mid, edit them to model harder fills.
+    book = {'holdings': {}, 'options': {}, 'positions': []}
+    holdings = api.build_holdings()
+    for symbol in symbols:
+        book['holdings'][symbol] = {
+            key: holdings[symbol][key] for key in ['price', 'quantity', 'id']}
+        for expiration in expirations[symbol]:
+            for instrument in api.options.find_tradable_options(
+                    symbol, expiration, None, 'call'):
+                market = api.options.get_option_market_data_by_id(instrument['id'])[0]
+                mid = (float(market['bid_price']) + float(market['ask_price'])) / 2
+                book['options'][instrument['id']] = {
+                    'instrument': instrument, 'market': market,
+                    'fill_price': mid, 'buy_fill_price': mid}
+    return book
+
+
+def dump_book(book, path):
+    with open(path, 'w') as file:
+        json.dump(book, file)
+
+
+def load_book(path):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+class SimBroker:
+    def __init__(self, book, fill_delay=1):
+        # fill_delay: virtual seconds an order rests before it can fill
+        self.book = json.loads(json.dumps(book))
+        self.fill_delay = fill_delay
+        self.now = 0
+        self.calls = Counter()
+        self.placed = {}
+        self.lock = RLock()
+        # namespaces that mirror robin_stocks.robinhood
+        self.options = SimpleNamespace(**{name: self.api(getattr(self, name)) for name in [
+            'get_chains', 'find_tradable_options', 'get_option_market_data_by_id',
+            'get_option_instrument_data_by_id', 'get_open_option_positions',
+            'get_aggregate_open_positions']})
+        self.orders = SimpleNamespace(**{name: self.api(getattr(self, name)) for name in [
+            'order_sell_option_limit', 'order_buy_option_limit',
+            'cancel_option_order', 'get_option_order_info']})
+        self.account = SimpleNamespace(
+            get_open_stock_positions=self.api(self.get_open_stock_positions))
+        self.helper = SimpleNamespace(
+            request_get=self.api(self.request_get),
+            update_session=lambda *_: None, set_login_state=lambda *_: None)
+        self.urls = SimpleNamespace(
+            option_instruments_url=option_instruments_url,
+            marketdata_options_url=marketdata_options_url)
+        self.build_holdings = self.api(self.get_holdings)
+
+    def api(self, fx):
+        def call(*args, **kwargs):
+            with self.lock:
+                self.calls[fx.__name__] += 1
+            return fx(*args, **kwargs)
+        call.__name__ = fx.__name__
+        return call
+
+    # virtual clock
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += max(seconds, 0)
+
+    @contextmanager
+    def patch(self):
+        # points every loaded trade module at this broker and the virtual clock
+        patched = []
+        for module in list(sys.modules.values()):
+            path = os.path.realpath(getattr(module, '__file__', None) or '')
+            if os.path.dirname(path) != TRADE_DIR:
+                continue
+            attrs = {'rh': self}
+            if module.__name__.split('.')[-1] in CLOCK_MODULES:
+                attrs |= {'time': self.time, 'sleep': self.sleep}
+            for attr, value in attrs.items():
+                if hasattr(module, attr):
+                    patched.append((module, attr, getattr(module, attr)))
+                    setattr(module, attr, value)
+        try:
+            yield self
+        finally:
+            for module, attr, value in reversed(patched):
+                setattr(module, attr, value)
+
+    # book lookups
+
+    def instruments(self):
+        return [option['instrument'] for option in self.book['options'].values()]
+
+    def find_option(self, symbol, expiration, strike, option_type):
+        for instrument in self.instruments():
+            if (
+                instrument['chain_symbol'] == symbol and
+                instrument['expiration_date'] == expiration and
+                float(instrument['strike_price']) == float(strike) and
+                instrument['type'] == option_type
+            ):
+                return self.book['options'][instrument['id']]
+
+    def short_contracts(self, symbol):
+        return sum(
+            position['quantity'] for position in self.book['positions']
+            if self.book['options'][position['option_id']]['instrument']['chain_symbol'] == symbol)
+
+    # robin_stocks.robinhood subset
+
+    def get_holdings(self):
+        return {symbol: dict(holding) for symbol, holding in self.book['holdings'].items()}
+
+    def get_open_stock_positions(self):
+        return [{
+            'instrument_id': holding['id'],
+            'shares_held_for_options_collateral': fmt(100 * self.short_contracts(symbol))
+        } for symbol, holding in self.book['holdings'].items()]
+
+    def get_chains(self, symbol, info=None):
+        expirations = sorted(set(
+            instrument['expiration_date'] for instrument in self.instruments()
+            if instrument['chain_symbol'] == symbol))
+        return {'symbol': symbol, 'expiration_dates': expirations}
+
+    def find_tradable_options(self, symbol, expirationDate=None, strikePrice=None, optionType=None, info=None):
+        return [dict(instrument) for instrument in self.instruments() if (
+            instrument['chain_symbol'] == symbol and
+            (not expirationDate or instrument['expiration_date'] == expirationDate) and
+            (not strikePrice or float(instrument['strike_price']) == float(strikePrice)) and
+            (not optionType or instrument['type'] == optionType)
+        )]
+
+    def get_option_market_data_by_id(self, id, info=None):
+        option = self.book['options'].get(id)
+        return [dict(option['market'])] if option else None
+
+    def get_option_instrument_data_by_id(self, id, info=None):
+        option = self.book['options'].get(id)
+        return dict(option['instrument']) if option else None
+
+    def request_get(self, url, dataType='regular', payload=None, jsonify_data=True):
+        payload = payload or {}
+        if url == marketdata_options_url():
+            ids = [url.rstrip('/').split('/')[-1] for url in payload['instruments'].split(',')]
+            return [dict(self.book['options'][id]['market']) for id in ids if id in self.book['options']]
+        if url == option_instruments_url() and 'ids' in payload:
+            return [dict(self.book['options'][id]['instrument'])
+                    for id in payload['ids'].split(',') if id in self.book['options']]
+        raise ValueError(
+            f'SimBroker.request_get only serves option market data and instruments by ids, got {url} {payload}')
+
+    def get_open_option_positions(self, account_number=None, info=None):
+        return [{
+            'type': 'short', 'option_id': position['option_id'],
+            'quantity': fmt(position['quantity']),
+            'chain_symbol': self.book['options'][position['option_id']]['instrument']['chain_symbol']
+        } for position in self.book['positions']]
+
+    def get_aggregate_open_positions(self, info=None, account_number=None):
+        positions = []
+        for position in self.book['positions']:
+            instrument = self.book['options'][position['option_id']]['instrument']
+            positions.append({
+                'symbol': instrument['chain_symbol'], 'quantity': fmt(position['quantity']),
+                'strategy': 'short_call', 'strategy_code': f"{instrument['id']}_S1",
+                'legs': [{
+                    'option': instrument['url'], 'expiration_date': instrument['expiration_date'],
+                    'strike_price': instrument['strike_price']
+                }]
+            })
+        return positions
+
+    def place_order(self, side, effect, price, symbol, quantity, expiration, strike, option_type):
+        option = self.find_option(symbol, expiration, strike, option_type)
+        if not option:
+            return {'detail': 'Instrument not found.'}
+        id = str(uuid4())
+        with self.lock:
+            self.placed[id] = {
+                'id': id, 'state': 'queued', 'side': side, 'position_effect': effect,
+                'price': fmt(price), 'quantity': fmt(quantity), 'chain_symbol': symbol,
+                'option_id': option['instrument']['id'], 'created': self.now
+            }
+        return self.public_order(id)
+
+    def order_sell_option_limit(self, positionEffect, creditOrDebit, price, symbol,
+                                quantity, expirationDate, strike, optionType='both', **_):
+        return self.place_order('sell', positionEffect, price, symbol,
+                                quantity, expirationDate, strike, optionType)
+
+    def order_buy_option_limit(self, positionEffect, creditOrDebit, price, symbol,
+                               quantity, expirationDate, strike, optionType='both', **_):
+        return self.place_order('buy', positionEffect, price, symbol,
+                                quantity, expirationDate, strike, optionType)
+
+    def settle(self, order):
+        # fills a resting order once its limit crosses the hidden fill price
+        if order['state'] not in OPEN_STATES:
+            return
+        order['state'] = 'confirmed'
+        if self.now - order['created'] < self.fill_delay:
+            return
+        option = self.book['options'][order['option_id']]
+        price = float(order['price'])
+        filled = (
+            price <= option['fill_price'] + 1e-9 if order['side'] == 'sell'
+            else price >= option['buy_fill_price'] - 1e-9
+        )
+        if not filled:
+            return
+        order['state'] = 'filled'
+        order['filled'] = self.now
+        quantity = int(float(order['quantity']))
+        if order['side'] == 'sell':
+            self.book['positions'].append(
+                {'option_id': order['option_id'], 'quantity': quantity})
+        else:
+            self.book['positions'] = [
+                position for position in self.book['positions']
+                if position['option_id'] != order['option_id']]
+
+    def public_order(self, id):
+        order = self.placed[id]
+        return {key: order[key] for key in [
+            'id', 'state', 'price', 'quantity', 'chain_symbol']} | {
+                'legs': [{'option': option_instruments_url(order['option_id']),
+                          'side': order['side'], 'position_effect': order['position_effect']}]}
+
+    def cancel_option_order(self, id):
+        with self.lock:
+            order = self.placed[id]
+            self.settle(order)
+            if order['state'] in OPEN_STATES:
+                order['state'] = 'cancelled'
+        return {}
+
+    def get_option_order_info(self, id):
+        with self.lock:
+            self.settle(self.placed[id])
+            return self.public_order(id)
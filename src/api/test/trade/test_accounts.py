@@ -0,0 +1,46 @@
+import os
+import sys
+sys.path.append('src/api')  # noqa
+from trade import accounts  # noqa
+from trade.accounts import *  # noqa
+from trade.app import Sell  # noqa
+from broker import SimBroker, synthetic_book  # noqa
+
+SYMBOLS = ['AAA', 'BBB']
+
+
+def test_run_accounts(monkeypatch):
+    monkeypatch.setattr(accounts, 'login', lambda variant: {'variant': variant})
+    sim = SimBroker(synthetic_book(SYMBOLS, seed=1))
+    with sim.patch():
+        results = run_accounts(lambda: Sell().execute(SYMBOLS))
+    assert set(results.keys()) == set(ACCOUNTS.keys())
+    for result in results.values():
+        assert set(result.keys()) == set(SYMBOLS)
+        assert all(order['state'] == 'filled' for order in result.values())
+    # orders were placed in the child processes, not here
+    assert not sim.placed
+
+
+def test_run_accounts_login(monkeypatch):
+    # logins run here one at a time, so the session cache is filled here
+    logins = []
+    monkeypatch.setattr(accounts, 'login', lambda variant: logins.append(variant) or True)
+    run_accounts(lambda: None)
+    assert logins == list(ACCOUNTS.values())
+
+
+def test_run_accounts_isolated(monkeypatch):
+    # one account failing doesn't affect the other
+    monkeypatch.setattr(accounts, 'login', lambda variant: not variant)
+    results = run_accounts(lambda: os.getpid())
+    assert results['variant'] == {'error': 'LOGIN'}
+    assert results['primary'] != os.getpid()
+
+    def crash():
+        raise ValueError('bad')
+    results = run_accounts(crash, {'primary': False})
+    assert results == {'primary': {'error': "ValueError('bad')"}}
+
+    results = run_accounts(lambda: os._exit(1), {'primary': False})
+    assert results == {'primary': {'error': 'CRASHED'}}
@@ -0,0 +1,50 @@
+import sys
+sys.path.append('src/api')  # noqa
+from trade.contracts import *  # noqa
+
+
+def create_contract(**kwargs):
+    return {
+        'id': 'abc',
+        'expiration_date': '2022-12-16',
+        'strike_price': '105.0000',
+        'min_ticks': {'below_tick': '0.0500', 'above_tick': '0.1000'},
+        'bid_price': '1.0000',
+        'ask_price': '1.2000',
+        'chance_of_profit_short': '0.880000',
+        'high_fill_rate_sell_price': None,
+    } | kwargs
+
+
+def test_from_dict():
+    contract = Contract.from_dict(create_contract())
+    assert contract.strike == 105
+    assert contract.below_tick == 0.05
+    assert contract.above_tick == 0.1
+    assert contract.chance == 0.88
+    assert contract.fill_rate_price is None
+    assert round(contract.mid, 2) == 1.1
+    # slotted, no per instance dict
+    assert not hasattr(contract, '__dict__')
+
+
+def test_update():
+    contract = Contract.from_dict(create_contract())
+    assert contract.update(create_contract()) == 0
+    assert contract.update(create_contract(bid_price='1.0500', id='xyz')) == 1
+    assert contract.bid == 1.05
+    assert contract.id == 'abc'
+
+
+def test_cursor():
+    cursor = Cursor(0, 1, 3)
+    cursor.next_expiration()
+    assert cursor == Cursor(1, 0, 0)
+
+
+def test_candidates():
+    contract = Contract.from_dict(create_contract())
+    position = SellPosition(2, 100.0, Cursor(0, 0, 0), ['a', 'b'], [[contract], [], [contract]])
+    assert list(position.candidates()) == [contract, contract]
+    position = BuyPosition(2, 'a', 105.0, 'abc', 0, contract)
+    assert list(position.candidates()) == [contract]
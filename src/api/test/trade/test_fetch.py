@@ -0,0 +1,132 @@
+import sys
+from time import sleep, time
+from threading import Lock
+from types import SimpleNamespace
+sys.path.append('src/api')  # noqa
+from trade import fetch  # noqa
+from trade.fetch import *  # noqa
+
+
+def test_fetch_all():
+    # later items finish first but results keep the input order
+    def fx(n):
+        sleep((5 - n) / 100)
+        return n * n
+    assert fetch_all(fx, range(5)) == [0, 1, 4, 9, 16]
+    assert fetch_all(fx, []) == []
+
+
+def test_fetch_all_errors():
+    def fx(n):
+        if n == 1:
+            raise ValueError(n)
+        return n
+    results = fetch_all(fx, range(3))
+    assert results[0] == 0 and results[2] == 2
+    assert is_error(results[1])
+    assert type(results[1]) == ValueError
+
+
+def test_fetch_all_timeout():
+    def fx(n):
+        sleep(1 if n else 0)
+        return n
+    start = time()
+    results = fetch_all(fx, range(3), timeout=0.2)
+    assert time() - start < 0.9
+    assert results[0] == 0
+    assert type(results[1]) == FetchTimeout
+    assert type(results[2]) == FetchTimeout
+
+
+def test_fetch_all_deadline():
+    # items stuck behind a hung worker time out at the overall deadline
+    lock = Lock()
+
+    def fx(n):
+        with lock:
+            sleep(0.3)
+        return n
+    start = time()
+    results = fetch_all(fx, range(4), max_workers=2, timeout=0.2)
+    # 2 waves of 0.2s, not 4 items held up one after another
+    assert time() - start < 0.6
+    assert all(type(result) == FetchTimeout for result in results)
+
+
+def test_fetch_all_concurrency():
+    lock = Lock()
+    state = {'running': 0, 'max': 0}
+
+    def fx(n):
+        with lock:
+            state['running'] += 1
+            state['max'] = max(state['max'], state['running'])
+        sleep(0.05)
+        with lock:
+            state['running'] -= 1
+        return n
+    start = time()
+    assert fetch_all(fx, range(12), max_workers=4) == list(range(12))
+    assert state['max'] == 4
+    # 3 waves of 4 instead of 12 sequential calls
+    assert time() - start < 0.5
+
+
+def create_fake_rh(requests, fail=()):
+    def option_instruments_url(id=None):
+        return f'https://api/options/instruments/{id}/' if id else 'https://api/options/instruments/'
+
+    def request_get(url, data_type, payload):
+        requests.append(payload)
+        if 'ids' in payload:
+            ids = payload['ids'].split(',')
+            return [{'id': id, 'type': 'call'} for id in ids if id not in fail]
+        urls = payload['instruments'].split(',')
+        return [{'instrument': url, 'bid_price': '1.0'}
+                for url in urls if url.split('/')[-2] not in fail]
+
+    def get_option_market_data_by_id(id):
+        requests.append(id)
+        return [{'instrument_id': id, 'bid_price': '2.0'}]
+
+    def get_option_instrument_data_by_id(id):
+        requests.append(id)
+        return {'id': id, 'type': 'put'}
+
+    return SimpleNamespace(
+        urls=SimpleNamespace(
+            option_instruments_url=option_instruments_url,
+            marketdata_options_url=lambda: 'https://api/marketdata/options/'),
+        helper=SimpleNamespace(request_get=request_get),
+        options=SimpleNamespace(
+            get_option_market_data_by_id=get_option_market_data_by_id,
+            get_option_instrument_data_by_id=get_option_instrument_data_by_id))
+
+
+def test_chunk():
+    assert chunk(list(range(5)), 2) == [[0, 1], [2, 3], [4]]
+    assert chunk([], 2) == []
+
+
+def test_get_market_data(monkeypatch):
+    requests = []
+    ids = [f'id{idx}' for idx in range(60)]
+    monkeypatch.setattr(fetch, 'rh', create_fake_rh(requests, fail=['id7']))
+    data = get_market_data(ids + ids[:5])
+    assert set(data.keys()) == set(ids)
+    assert data['id0']['bid_price'] == '1.0'
+    # missed ids are fetched on their own
+    assert data['id7']['bid_price'] == '2.0'
+    assert len(requests) == 3 + 1
+
+
+def test_get_instrument_data(monkeypatch):
+    requests = []
+    ids = [f'id{idx}' for idx in range(30)]
+    monkeypatch.setattr(fetch, 'rh', create_fake_rh(requests, fail=['id3']))
+    data = get_instrument_data(ids)
+    assert set(data.keys()) == set(ids)
+    assert data['id0']['type'] == 'call'
+    assert data['id3']['type'] == 'put'
+    assert len(requests) == 2 + 1
@@ -0,0 +1,91 @@
+import sys
+import pytest
+from time import time
+from types import SimpleNamespace
+sys.path.append('src/api')  # noqa
+from trade import monitor  # noqa
+from trade.monitor import *  # noqa
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    # fills[id] is the number of polls before an order fills, None never fills
+    state = {'fills': {}, 'polls': {}, 'cancelled': []}
+
+    def get_option_order_info(id):
+        state['polls'][id] = state['polls'].get(id, 0) + 1
+        if id in state['cancelled']:
+            return {'id': id, 'state': 'cancelled'}
+        fills = state['fills'][id]
+        filled = fills is not None and state['polls'][id] >= fills
+        return {'id': id, 'state': 'filled' if filled else 'confirmed'}
+
+    monkeypatch.setattr(monitor, 'rh', SimpleNamespace(orders=SimpleNamespace(
+        get_option_order_info=get_option_order_info,
+        cancel_option_order=state['cancelled'].append)))
+    return state
+
+
+def test_is_open():
+    assert is_open({'id': 'a', 'state': 'confirmed'})
+    assert not is_open({'id': 'a', 'state': 'filled'})
+    assert not is_open({'state': 'cancelled'})
+
+
+def test_poll_orders(fake):
+    fake['fills'] = {'a': 1, 'b': 2}
+    orders = {
+        'A': {'id': 'a', 'state': 'queued'},
+        'B': {'id': 'b', 'state': 'queued'},
+        'C': {'state': 'cancelled'},
+    }
+    start = time()
+    orders = poll_orders(orders, timeout=5, interval=0.01)
+    # returns as soon as everything fills instead of sleeping the full timeout
+    assert time() - start < 1
+    assert orders['A']['state'] == 'filled'
+    assert orders['B']['state'] == 'filled'
+    assert orders['C'] == {'state': 'cancelled'}
+    # filled orders stop being polled
+    assert fake['polls'] == {'a': 1, 'b': 2}
+
+
+def test_poll_orders_timeout(fake):
+    fake['fills'] = {'a': None}
+    start = time()
+    orders = poll_orders({'A': {'id': 'a', 'state': 'queued'}},
+                         timeout=0.2, interval=0.01, backoff=2)
+    assert 0.2 <= time() - start < 1
+    assert orders['A']['state'] == 'confirmed'
+    # backoff keeps the number of polls down
+    assert fake['polls']['a'] < 8
+
+
+def test_poll_orders_on_fill(fake):
+    fake['fills'] = {'a': 1, 'b': 3, 'c': 1}
+    seen = []
+
+    def on_fill(filled):
+        seen.append(sorted(filled.keys()))
+        # follow up on A right away, B gets nothing
+        return {'C': {'id': 'c', 'state': 'queued'}} if 'A' in filled else None
+    orders = {
+        'A': {'id': 'a', 'state': 'queued'},
+        'B': {'id': 'b', 'state': 'queued'},
+    }
+    orders = poll_orders(orders, timeout=5, interval=0.01, on_fill=on_fill)
+    assert seen == [['A'], ['C'], ['B']]
+    assert all(order['state'] == 'filled' for order in orders.values())
+
+
+def test_cancel_orders(fake):
+    fake['fills'] = {'a': None}
+    orders = {
+        'A': {'id': 'a', 'state': 'confirmed'},
+        'C': {'id': 'c', 'state': 'filled'},
+    }
+    orders = cancel_orders(orders, timeout=1)
+    assert orders['A']['state'] == 'cancelled'
+    assert orders['C']['state'] == 'filled'
+    # filled orders are never cancelled
+    assert 'c' not in fake['cancelled']
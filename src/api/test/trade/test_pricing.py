@@ -0,0 +1,52 @@
+import sys
+import numpy as np
+from statistics import NormalDist
+sys.path.append('src/api')  # noqa
+from trade.pricing import *  # noqa
+from trade.app import chance_of_profit as scalar_chance_of_profit  # noqa
+
+
+def test_norm_cdf():
+    xs = np.linspace(-6, 6, 101)
+    expected = np.array([NormalDist().cdf(x) for x in xs])
+    assert np.allclose(norm_cdf(xs), expected, atol=1e-6)
+
+
+def test_norm_pdf():
+    xs = np.linspace(-6, 6, 101)
+    expected = np.array([NormalDist().pdf(x) for x in xs])
+    assert np.allclose(norm_pdf(xs), expected)
+
+
+def test_chance_of_profit():
+    kwargs = {
+        'stock_price': 240.80, 'strike_price': np.array([245, 255, 265]),
+        'implied_vol': 0.9992, 'rho': -0.0007,
+        'div_yield': 0, 'time': 0.00205
+    }
+    chances = chance_of_profit(**kwargs)
+    assert chances.shape == (3,)
+    for strike, chance in zip(kwargs['strike_price'], chances):
+        expected = scalar_chance_of_profit(
+            **(kwargs | {'strike_price': float(strike)}))
+        assert abs(chance - expected) < 1e-6
+    assert int(chances[1] * 100) == 90
+    # further otm strikes are more likely to profit for the seller
+    assert np.all(np.diff(chances) > 0)
+
+
+def test_price_chain():
+    strikes = np.array([90, 100, 110])
+    chain = price_chain(100, strikes, 0.3, 0.5, rho=0.05)
+    assert set(chain.keys()) == set([
+        'd1', 'd2', 'chance_of_profit_short', 'chance_of_profit_long',
+        'delta', 'gamma', 'theta', 'vega', 'rho'])
+    assert np.allclose(
+        chain['chance_of_profit_short'] + chain['chance_of_profit_long'], 1)
+    # reference values for an atm call (S=K=100, sigma=0.3, r=0.05, t=0.5)
+    assert abs(chain['delta'][1] - 0.5886) < 1e-3
+    assert abs(chain['gamma'][1] - 0.01834) < 1e-4
+    assert abs(chain['vega'][1] - 0.2751) < 1e-3
+    assert abs(chain['theta'][1] - (-10.7145 / 365)) < 1e-3
+    assert abs(chain['rho'][1] - 0.2460) < 1e-3
+    assert np.all(np.diff(chain['delta']) < 0)
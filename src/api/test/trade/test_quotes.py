@@ -0,0 +1,56 @@
+import sys
+sys.path.append('src/api')  # noqa
+from trade.quotes import *  # noqa
+from trade.contracts import Contract  # noqa
+from broker import SimBroker, synthetic_book  # noqa
+
+
+def get_contracts(sim, num=3):
+    ids = list(sim.book['options'].keys())[:num]
+    return [Contract.from_dict(
+        sim.get_option_instrument_data_by_id(id) | sim.get_option_market_data_by_id(id)[0])
+        for id in ids]
+
+
+def test_touch():
+    sim = SimBroker(synthetic_book(['AAA']))
+    with sim.patch():
+        cache = QuoteCache(ttl=5)
+        contracts = get_contracts(sim)
+        assert cache.is_stale(contracts[0].id)
+        cache.touch(contracts)
+        assert not cache.is_stale(contracts[0].id)
+        sim.sleep(5)
+        assert cache.is_stale(contracts[0].id)
+
+
+def test_refresh():
+    sim = SimBroker(synthetic_book(['AAA']))
+    with sim.patch():
+        cache = QuoteCache(ttl=5)
+        contracts = get_contracts(sim)
+        cache.touch(contracts)
+        id = contracts[0].id
+        sim.book['options'][id]['market']['bid_price'] = '9.9900'
+        # nothing is fetched while quotes are fresh
+        assert cache.refresh(contracts) == 0
+        assert not sim.calls['request_get']
+        sim.sleep(5)
+        # every stale contract comes back in one batch, updated in place
+        assert cache.refresh(contracts) == 1
+        assert sim.calls['request_get'] == 1
+        assert contracts[0].bid == 9.99
+        assert contracts[0].id == id
+        assert cache.refresh(contracts, force=True) == 0
+        assert sim.calls['request_get'] == 2
+
+
+def test_refresh_duplicates():
+    sim = SimBroker(synthetic_book(['AAA']))
+    with sim.patch():
+        contract = get_contracts(sim, 1)[0]
+        copy = Contract.from_dict(sim.get_option_instrument_data_by_id(contract.id) |
+                                  sim.get_option_market_data_by_id(contract.id)[0])
+        sim.book['options'][contract.id]['market']['ask_price'] = '9.9900'
+        assert QuoteCache().refresh([contract, copy]) == 2
+        assert contract.ask == copy.ask == 9.99
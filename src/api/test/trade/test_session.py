@@ -0,0 +1,145 @@
+import os
+import sys
+import pytest
+from io import BytesIO
+from time import time
+from types import SimpleNamespace
+from botocore.exceptions import ClientError
+sys.path.append('src/api')  # noqa
+from trade import session  # noqa
+from trade.session import *  # noqa
+
+
+class FakeBucket:
+    def __init__(self, calls, objects):
+        self.calls = calls
+        self.objects = objects
+
+    def Object(self, key):
+        self.calls.append(('download', key))
+
+        def get():
+            if key not in self.objects:
+                raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': ''}}, 'GetObject')
+            body, metadata = self.objects[key]
+            return {'Body': BytesIO(body), 'Metadata': metadata}
+        return SimpleNamespace(get=get)
+
+    def upload_file(self, path, key, ExtraArgs):
+        self.calls.append(('upload', key))
+        with open(path, 'rb') as file:
+            self.objects[key] = (file.read(), ExtraArgs['Metadata'])
+
+
+@pytest.fixture
+def fake(monkeypatch, tmp_path):
+    calls = []
+    state = {'header': None, 'rewrite': False, 'status': 200}
+    objects = {}
+
+    def login(username, password, expiresIn, mfa_code, pickle_name):
+        calls.append(('login', username))
+        # like rh.login, a missing pickle means a new token
+        auth_path = get_auth_path(pickle_name == '2')
+        if state['rewrite'] or not os.path.exists(auth_path):
+            with open(auth_path, 'wb') as file:
+                file.write(f'token {time()}'.encode('UTF-8'))
+        return {'token_type': 'Bearer', 'access_token': username,
+                'expires_in': expiresIn}
+
+    def update_session(key, value):
+        state['header'] = value
+
+    monkeypatch.setenv('HOME', str(tmp_path))
+    for postfix in ['', '2']:
+        monkeypatch.setenv(f'RH_USERNAME{postfix}', f'user{postfix}')
+        monkeypatch.setenv(f'RH_PASSWORD{postfix}', 'password')
+        monkeypatch.setenv(f'RH_2FA{postfix}', 'JBSWY3DPEHPK3PXP')
+    monkeypatch.setattr(session, 'sessions', {})
+    monkeypatch.setattr(session, 's3', SimpleNamespace(
+        Bucket=lambda _: FakeBucket(calls, objects)))
+    monkeypatch.setattr(session, 'rh', SimpleNamespace(
+        login=login,
+        urls=SimpleNamespace(user_profile_url=lambda: 'user'),
+        helper=SimpleNamespace(
+            update_session=update_session,
+            set_login_state=lambda _: None,
+            request_get=lambda url, jsonify_data: SimpleNamespace(status_code=state['status']))))
+    return SimpleNamespace(calls=calls, state=state, objects=objects)
+
+
+def logins(fake):
+    return [call for call in fake.calls if call[0] == 'login']
+
+
+def test_is_valid():
+    now = time()
+    assert not is_valid(None)
+    assert is_valid({'expires': now + EXPIRY_MARGIN + 60}, now)
+    assert not is_valid({'expires': now + EXPIRY_MARGIN - 60}, now)
+
+
+def test_login(fake):
+    login()
+    assert fake.calls == [
+        ('download', 'data/robinhood.pickle'), ('login', 'user'), ('upload', 'data/robinhood.pickle')]
+    assert fake.state['header'] == 'Bearer user'
+    assert os.path.exists(get_auth_path())
+    # warm invocation skips s3 and rh.login entirely
+    login()
+    assert len(fake.calls) == 3
+
+
+def test_login_variant(fake):
+    login(False)
+    login(True)
+    assert fake.state['header'] == 'Bearer user2'
+    login(False)
+    assert fake.state['header'] == 'Bearer user'
+    assert logins(fake) == [('login', 'user'), ('login', 'user2')]
+    # each account keeps its own token file
+    assert get_auth_path(False) != get_auth_path(True)
+    assert os.path.exists(get_auth_path(False)) and os.path.exists(get_auth_path(True))
+
+
+def test_login_upload(fake):
+    login()
+    session.sessions.clear()
+    fake.state['rewrite'] = True
+    login()
+    assert fake.calls.count(('upload', 'data/robinhood.pickle')) == 2
+
+
+def test_login_reuse(fake):
+    # a stored token expires a day after it was issued, not after this login
+    issued = time() - EXPIRES_IN + 2 * EXPIRY_MARGIN
+    fake.objects['data/robinhood.pickle'] = (b'token', {'issued': str(issued)})
+    assert login()['expires'] == issued + EXPIRES_IN
+    assert ('upload', 'data/robinhood.pickle') not in fake.calls
+
+
+@pytest.mark.parametrize('metadata', [{}, {'issued': str(time() - EXPIRES_IN)}])
+def test_login_stale(fake, metadata):
+    # undated and expiring tokens are replaced before rh.login can reuse them
+    fake.objects['data/robinhood.pickle'] = (b'token', metadata)
+    now = time()
+    assert login()['expires'] >= now + EXPIRES_IN
+    assert fake.objects['data/robinhood.pickle'][0] != b'token'
+    assert float(fake.objects['data/robinhood.pickle'][1]['issued']) >= now
+
+
+def test_login_rejected(fake):
+    login()
+    fake.state['status'] = 401
+    fake.state['rewrite'] = True
+    login()
+    assert len(logins(fake)) == 2
+
+
+def test_login_expired(fake):
+    login()
+    session.sessions[False]['expires'] = time()
+    login()
+    assert logins(fake) == [('login', 'user'), ('login', 'user')]
+    logout()
+    assert False not in session.sessions
@@ -1,6 +1,11 @@
 import sys
+from datetime import datetime
+from types import SimpleNamespace
 sys.path.append('src/api')  # noqa
-from trade.app import chance_of_profit  # noqa
+from trade.app import *  # noqa
+from broker import SimBroker, synthetic_book, short_book  # noqa
+
+SYMBOLS = ['AAA', 'BBB', 'CCC']
 
 
 def test_chance_of_profit():
@@ -10,3 +15,184 @@ def test_chance_of_profit():
         div_yield=0, time=0.00205
     )
     assert int(chance * 100) == 90
+
+
+def test_time_until():
+    now = datetime(2023, 1, 1)
+    assert time_until('2023-01-01', now) == 1 / 365
+    assert time_until('2022-12-01', now) == 1 / 365 / 24
+
+
+def create_contract(strike, iv, chance=None, bid=1.0, ask=1.2):
+    return {
+        'strike_price': str(strike), 'implied_volatility': iv and str(iv),
+        'chance_of_profit_short': chance and str(chance),
+        'bid_price': str(bid), 'ask_price': str(ask)
+    }
+
+
+def test_rank_contracts():
+    expiration = datetime.now().strftime('%Y-%m-%d')
+    contracts = [
+        create_contract(95, 0.5),
+        create_contract(101, 0.5),
+        create_contract(104, 0.5),
+        create_contract(108, None, 0.88),
+        create_contract(120, 0.5, bid=0, ask=0.02),
+    ]
+    ranked = rank_contracts(contracts, expiration, 100, num=5)
+    strikes = [float(contract['strike_price']) for contract in ranked]
+    # itm and too cheap contracts are dropped, missing iv uses rh chance
+    assert strikes[0] == 108
+    assert set(strikes) == set([101, 104, 108])
+    assert rank_contracts(contracts[:1], expiration, 100) == []
+
+
+def test_sell_execute():
+    sim = SimBroker(synthetic_book(SYMBOLS, seed=1))
+    with sim.patch():
+        results = Sell().execute(SYMBOLS)
+    assert set(results.keys()) == set(SYMBOLS)
+    for symbol, result in results.items():
+        assert result['state'] == 'filled'
+        assert result['quantity'] == '2.0000'
+    assert len(sim.book['positions']) == len(SYMBOLS)
+    # quotes are refreshed in batches, never one contract at a time
+    assert not sim.calls['get_option_market_data_by_id']
+    # later rounds only reprice the symbols that are still open
+    placed = [order['chain_symbol'] for order in sim.placed.values()]
+    assert len(placed) < len(SYMBOLS) * max(placed.count(symbol) for symbol in SYMBOLS)
+    with sim.patch():
+        assert suggest_contracts()[0] == {symbol: 0 for symbol in SYMBOLS}
+
+
+def test_sell_execute_exhausted():
+    book = synthetic_book(SYMBOLS[:1], seed=1)
+    for option in book['options'].values():
+        option['fill_price'] = 0
+    sim = SimBroker(book)
+    with sim.patch():
+        results = Sell().execute(SYMBOLS[:1])
+    assert results == {'AAA': {'error': 'EXHAUSTED'}}
+    assert not sim.book['positions']
+
+
+def test_sell_execute_empty_expiration():
+    book = synthetic_book(SYMBOLS[:1], seed=1)
+    sim = SimBroker(book)
+    with sim.patch():
+        expiration = Sell().init_chain(SYMBOLS[:1])['AAA'].expirations[0]
+    # no candidates on the first expiration
+    for option in book['options'].values():
+        if option['instrument']['expiration_date'] == expiration:
+            option['market']['chance_of_profit_short'] = '0.5'
+    sim = SimBroker(book)
+    with sim.patch():
+        results = Sell().execute(SYMBOLS[:1])
+    assert results['AAA']['state'] == 'filled'
+    filled = sim.book['options'][sim.book['positions'][0]['option_id']]
+    assert filled['instrument']['expiration_date'] != expiration
+
+
+def test_buy_execute():
+    sim = SimBroker(short_book(synthetic_book(SYMBOLS, seed=1)))
+    with sim.patch():
+        results = Buy().execute(SYMBOLS)
+    assert set(results.keys()) == set(SYMBOLS)
+    assert all(result['state'] == 'filled' for result in results.values())
+    assert not sim.book['positions']
+    # positions are looked up in batches
+    assert not sim.calls['get_option_instrument_data_by_id']
+    assert not sim.calls['get_option_market_data_by_id']
+
+
+def test_get_trade():
+    sim = SimBroker(short_book(synthetic_book(SYMBOLS, seed=1)))
+    with sim.patch():
+        res = get_trade()
+    body = json.loads(res['body'])
+    assert [holding['symbol'] for holding in body] == SYMBOLS
+    for holding in body:
+        assert holding['open_contracts'] == -2
+        assert holding['option_type'] == 'C'
+        assert 0 <= holding['chance'] <= 1
+    # two batched requests, no per position lookups
+    assert sim.calls['request_get'] == 2
+    assert not sim.calls['get_option_market_data_by_id']
+
+
+def get_expirations(sim, side):
+    return [sim.book['options'][order['option_id']]['instrument']['expiration_date']
+            for order in sim.placed.values() if order['side'] == side and order['state'] == 'filled']
+
+
+def test_roll_out():
+    sim = SimBroker(short_book(synthetic_book(SYMBOLS, seed=1)))
+    with sim.patch():
+        results = roll_out(SYMBOLS)
+    assert set(results.keys()) == set(SYMBOLS)
+    for result in results.values():
+        assert result['buy']['state'] == result['sell']['state'] == 'filled'
+        buy = float(result['buy']['price']) * 200
+        sell = float(result['sell']['price']) * 200
+        assert abs(result['net_credit'] - (sell - buy)) < 1e-6
+    # rolled out past the expiration that was bought back
+    assert min(get_expirations(sim, 'sell')) > max(get_expirations(sim, 'buy'))
+    assert len(sim.book['positions']) == len(SYMBOLS)
+    # sell legs start before the whole buy batch is done
+    orders = sim.placed.values()
+    first_sell = min(order['created'] for order in orders if order['side'] == 'sell')
+    last_buy = max(order['filled'] for order in orders if order['side'] == 'buy' and 'filled' in order)
+    assert first_sell < last_buy
+
+
+def test_roll_in():
+    sim = SimBroker(short_book(synthetic_book(SYMBOLS, seed=1), expiration_idx=1))
+    with sim.patch():
+        results = roll_in(SYMBOLS)
+    assert all(result['buy']['state'] == 'filled' for result in results.values())
+    # only nearer expirations are sold, never the one bought back
+    assert max(get_expirations(sim, 'sell')) < min(get_expirations(sim, 'buy'))
+
+
+def test_sell_in_expirations():
+    sim = SimBroker(synthetic_book(SYMBOLS, seed=1))
+    with sim.patch():
+        expirations = get_chain_expirations('AAA')
+        closed = {'AAA': SimpleNamespace(expiration=expirations[-1], quantity=1)}
+        # the expiration that was just bought back isn't sold again
+        assert SellIn(closed, {}).get_expirations('AAA') == expirations[:-1]
+
+
+class FillOnCancel(SimBroker):
+    # buys only fill in the middle of being cancelled
+    def cancel_option_order(self, id):
+        order = self.placed[id]
+        if order['side'] == 'buy':
+            order['created'] -= self.fill_delay
+            self.book['options'][order['option_id']]['buy_fill_price'] = 0
+        return super().cancel_option_order(id)
+
+
+def test_roll_fill_on_cancel():
+    book = short_book(synthetic_book(SYMBOLS, seed=1))
+    for position in book['positions']:
+        book['options'][position['option_id']]['buy_fill_price'] = 1e9
+    sim = FillOnCancel(book)
+    with sim.patch():
+        results = roll_out(SYMBOLS)
+    assert all(result['buy']['state'] == 'filled' for result in results.values())
+    sells = [order for order in sim.placed.values() if order['side'] == 'sell']
+    # every sell was followed to the end, none left resting on the book
+    assert not [order for order in sells if order['state'] not in ['filled', 'cancelled']]
+    for symbol in SYMBOLS:
+        assert len([order for order in sells
+                    if order['chain_symbol'] == symbol and order['state'] == 'filled']) == 1
+
+
+def test_roll_no_position():
+    sim = SimBroker(short_book(synthetic_book(SYMBOLS, seed=1)))
+    with sim.patch():
+        results = roll_out(SYMBOLS + ['ZZZ'])
+    assert results['ZZZ'] == {'buy': {'error': 'NO_POSITION'}, 'sell': None}
+    assert not any(order['chain_symbol'] == 'ZZZ' for order in sim.placed.values())
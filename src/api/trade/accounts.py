@@ -0,0 +1,45 @@
+from multiprocessing import Process, Pipe
+from session import login
+
+# account name: variant flag passed to login
+ACCOUNTS = {'primary': False, 'variant': True}
+
+
+def run_account(conn, variant, fx):
+    # runs in a child process, so the rh session is private to this account,
+    # login reuses the session the parent cached before forking
+    try:
+        result = fx() if login(variant) else {'error': 'LOGIN'}
+    except Exception as e:
+        result = {'error': repr(e)}
+    conn.send(result)
+    conn.close()
+
+
+def run_accounts(fx, accounts=ACCOUNTS):
+    # Runs the same plan for every account at once and returns
+    # {account name: result}. rh keeps its session in module globals,
+    # so each account gets its own process instead of a thread.
+    # Pipes instead of Queues because lambda has no /dev/shm.
+    # Logins happen here one at a time, so they don't race on the token
+    # files and the sessions stay cached for the next warm invocation.
+    results = {}
+    processes = {}
+    for name, variant in accounts.items():
+        if not login(variant):
+            results[name] = {'error': 'LOGIN'}
+            continue
+        parent_conn, child_conn = Pipe(duplex=False)
+        process = Process(target=run_account, args=(child_conn, variant, fx))
+        process.start()
+        # close the parent's copy, so recv fails instead of hanging if the child dies
+        child_conn.close()
+        processes[name] = (process, parent_conn)
+
+    for name, (process, conn) in processes.items():
+        try:
+            results[name] = conn.recv()
+        except EOFError:
+            results[name] = {'error': 'CRASHED'}
+        process.join()
+    return results
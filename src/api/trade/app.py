@@ -2,26 +2,39 @@ import os
 import re
 import json
 import boto3
-import pyotp
-from time import sleep
-from pathlib import Path
-from random import random
+import numpy as np
 from math import log, sqrt, ceil, floor
 from statistics import NormalDist
 from collections import defaultdict
 import robin_stocks.robinhood as rh
+from decimal import Decimal
 from datetime import datetime, timedelta
-from botocore.exceptions import ClientError
 if str(os.environ.get("LOCAL")).lower() == "true":
     from src.api.shared.python.utils import (
         verify_user, options, error, str_to_bool)
     from src.api.shared.python.auth import verify_token
+    from src.api.trade.pricing import price_chain
+    from src.api.trade.fetch import (
+        fetch_all, is_error, get_market_data, get_instrument_data)
+    from src.api.trade.session import login
+    from src.api.trade.monitor import (
+        poll_orders, cancel_orders, FINAL_STATES)
+    from src.api.trade.quotes import QuoteCache
+    from src.api.trade.contracts import (
+        Contract, Cursor, SellPosition, BuyPosition)
+    from src.api.trade.accounts import run_accounts
 else:
     from utils import \
         verify_user, options, error, str_to_bool
     from auth import verify_token
-
-s3 = boto3.resource('s3')
+    from pricing import price_chain
+    from fetch import \
+        fetch_all, is_error, get_market_data, get_instrument_data
+    from session import login
+    from monitor import poll_orders, cancel_orders, FINAL_STATES
+    from quotes import QuoteCache
+    from contracts import Contract, Cursor, SellPosition, BuyPosition
+    from accounts import run_accounts
 
 
 def calc_d1(stock_price, strike_price, implied_vol, rho, div_yield, time):
@@ -73,9 +86,13 @@ def handle_ws(event, _):
 
     client = boto3.client('apigatewaymanagementapi', endpoint_url=callback)
     req_body = json.loads(event['body'])
-    variant = bool(req_body.get('variant'))
-    login(variant)
-    response = post_trade(event)
+    variant = req_body.get('variant')
+    if str(variant).lower() == 'all':
+        # trade every account at once, each in its own session
+        response = run_accounts(lambda: post_trade(event))
+    else:
+        login(bool(variant))
+        response = post_trade(event)
     # convert response to bytes
     data = json.dumps(response).encode('utf-8')
     client.post_to_connection(Data=data, ConnectionId=connection)
@@ -90,31 +107,6 @@ def handle_ws(event, _):
     }
 
 
-def login(variant=False):
-    postfix = '2' if variant else ''
-    ext = '.pickle'
-    filename = 'robinhood'
-    auth_path = os.path.join(os.path.expanduser(
-        "~"), '.tokens', f'{filename}{ext}')
-    key = f'data/{filename}{postfix}{ext}'
-    try:
-        Path(auth_path).parent.mkdir(parents=True, exist_ok=True)
-        with open(auth_path, 'wb') as file:
-            bucket = s3.Bucket(os.environ['S3_BUCKET'])
-            bucket.download_fileobj(key, file)
-            print('Loaded auth file from S3.')
-    except ClientError:
-        print('Could not load auth file from S3.')
-        os.remove(auth_path)
-    username = os.environ[f'RH_USERNAME{postfix}']
-    password = os.environ[f'RH_PASSWORD{postfix}']
-    mfa_code = pyotp.TOTP(os.environ[f'RH_2FA{postfix}']).now()
-    rh.login(username, password, mfa_code=mfa_code)
-    if os.path.exists(auth_path):
-        bucket.upload_file(auth_path, key)
-        print('Saved auth file to S3.')
-
-
 def get_trade():
     holdings = rh.build_holdings()
     for symbol, holding in holdings.items():
@@ -127,22 +119,27 @@ def get_trade():
         holdings[symbol]['loose'] = amt
 
     opts = rh.options.get_open_option_positions()
+    # resolve every position in a couple of batched requests, not 2 per position
+    ids = [opt['option_id'] for opt in opts]
+    instruments, market_data = fetch_all(
+        lambda fx: fx(ids), [get_instrument_data, get_market_data])
+    instruments = {} if is_error(instruments) else instruments
+    market_data = {} if is_error(market_data) else market_data
     for opt in opts:
         sold = -1 if opt['type'] == 'short' else 1
         symbol = opt['chain_symbol']
-        if symbol not in holdings:
-            holdings[symbol] = {}
-        holdings[symbol]['open_contracts'] += int(
-            float(opt['quantity'])) * sold
-        opt = rh.options.get_option_instrument_data_by_id(opt['option_id'])
-        holdings[symbol]['option_type'] = opt['type'][0].upper()
-        holdings[symbol]['expiration'] = opt['expiration_date']
-        holdings[symbol]['strike'] = float(
-            opt['strike_price'])
-        opt = rh.options.get_option_market_data_by_id(opt['id'])[0]
-        postfix = 'short' if holdings[symbol]['open_contracts'] < 0 else 'long'
-        chance = opt[f'chance_of_profit_{postfix}']
-        holdings[symbol]['chance'] = float(chance) if chance else chance
+        holding = holdings.setdefault(
+            symbol, {'symbol': symbol, 'open_contracts': 0})
+        holding['open_contracts'] += int(float(opt['quantity'])) * sold
+        instrument = instruments.get(opt['option_id'])
+        if instrument:
+            holding['option_type'] = instrument['type'][0].upper()
+            holding['expiration'] = instrument['expiration_date']
+            holding['strike'] = float(instrument['strike_price'])
+        data = market_data.get(opt['option_id'], {})
+        postfix = 'short' if holding['open_contracts'] < 0 else 'long'
+        chance = data.get(f'chance_of_profit_{postfix}')
+        holding['chance'] = float(chance) if chance else chance
     holdings = sorted([holding for _, holding in holdings.items()],
                       key=lambda holding: holding['symbol'])
     body = [holding | {'key': idx} for idx, holding in enumerate(holdings)]
@@ -159,6 +156,10 @@ def post_trade(event):
     req_body = json.loads(event['body'])
     trade_type = req_body['type']
     symbols = req_body['symbols']
+    if trade_type.upper() == 'ROLL_OUT':
+        return roll_out(symbols)
+    if trade_type.upper() == 'ROLL_IN':
+        return roll_in(symbols)
     trade = Buy() if trade_type.upper() == 'BUY' else Sell()
     results = trade.execute(symbols)
     return results
@@ -215,25 +216,74 @@ def get_expirations(expirations, num=2):
     return exp_candidates
 
 
-def get_contracts(symbol, expiration, curr_price, num=2):
+def time_until(expiration, now=None):
+    # years until the end of the expiration date, floored at one hour
+    now = now or datetime.now()
+    end = datetime.strptime(expiration, '%Y-%m-%d') + timedelta(days=1)
+    seconds = max((end - now).total_seconds(), 60 * 60)
+    return seconds / timedelta(days=365).total_seconds()
+
+
+def parse_floats(opts, key):
+    # missing / empty fields become nan so they can be masked out
+    return np.array([
+        float(opt[key]) if opt.get(key) else np.nan for opt in opts
+    ])
+
+
+def rank_contracts(opt_candidates, expiration, curr_price, num=2, target=0.88):
     min_price = 0.05
     key = 'high_fill_rate_sell_price'
-    opt_candidates = rh.options.find_options_by_specific_profitability(
-        symbol, expiration, None, 'call', 'chance_of_profit_short', 0.85, 0.95)
     # only use options that with a strike price above current stock price
     opt_candidates = [
         opt for opt in opt_candidates
         if float(opt['strike_price']) > curr_price
     ]
-
-    opt_candidates.sort(key=lambda opt: abs(
-        float(opt['chance_of_profit_short']) - 0.88))
-    contracts = [opt for opt in opt_candidates if (
-        float(opt[key]) if key in opt and opt[key] else get_mid_price(opt)
-    ) >= min_price]
+    if not opt_candidates:
+        return []
+    # price the whole chain in one call instead of one contract at a time
+    chances = price_chain(
+        stock_price=curr_price,
+        strike_price=parse_floats(opt_candidates, 'strike_price'),
+        implied_vol=parse_floats(opt_candidates, 'implied_volatility'),
+        time=time_until(expiration)
+    )['chance_of_profit_short']
+    # fall back to rh chance of profit if iv is missing
+    rh_chances = parse_floats(opt_candidates, 'chance_of_profit_short')
+    chances = np.where(np.isnan(chances), rh_chances, chances)
+    prices = parse_floats(opt_candidates, key)
+    mid_prices = (parse_floats(opt_candidates, 'ask_price') +
+                  parse_floats(opt_candidates, 'bid_price')) / 2
+    prices = np.where(np.isnan(prices), mid_prices, prices)
+    # contracts with no chance of profit at all go last
+    distances = np.nan_to_num(np.abs(chances - target), nan=np.inf)
+    order = np.argsort(distances, kind='stable')
+    contracts = [opt_candidates[idx]
+                 for idx in order if prices[idx] >= min_price]
     return contracts[0: num]
 
 
+def get_contracts(symbol, expiration, curr_price, num=2):
+    # one paginated instrument request and a few batched market data requests
+    # instead of two requests per strike in find_options_by_specific_profitability
+    instruments = [
+        opt for opt in rh.options.find_tradable_options(
+            symbol, expiration, None, 'call')
+        if opt and opt.get('expiration_date') == expiration
+    ]
+    market_data = get_market_data([opt['id'] for opt in instruments])
+    opt_candidates = [
+        opt | market_data[opt['id']] for opt in instruments
+        if opt['id'] in market_data
+    ]
+    chances = parse_floats(opt_candidates, 'chance_of_profit_short')
+    opt_candidates = [
+        opt for opt, chance in zip(opt_candidates, chances)
+        if 0.85 <= chance <= 0.95
+    ]
+    return rank_contracts(opt_candidates, expiration, curr_price, num)
+
+
 def spread_is_high(mid_price, price):
     print('mid_price', mid_price)
     print('price', price)
@@ -244,84 +294,111 @@ def spread_is_high(mid_price, price):
     return is_high
 
 
-def update_contract(symbol, lookup):
-    option = lookup[symbol]
-    curr = option['curr']
-    contracts = option['contracts']
-    old = contracts[curr[0]][curr[1]]
-    new = rh.options.get_option_market_data_by_id(old['id'])[0]
-    lookup[symbol]['contracts'][curr[0]][curr[1]] = old | new
-    return lookup
+def get_chain_expirations(symbol):
+    chain = rh.options.get_chains(symbol)
+    return get_expirations(chain['expiration_dates'])
 
 
-def delay():
-    sleep(random() * 5 + 5)
+def init_sell_chain(symbols):
+    desired_contracts, prices = suggest_contracts()
+    # only use symbols that have positions available
+    quantities = {
+        symbol: desired_contracts[symbol]
+        for symbol in symbols if desired_contracts[symbol]
+    }
+    return build_sell_chain(quantities, prices)
+
+
+def build_sell_chain(quantities, prices, get_exps=get_chain_expirations):
+    # quantities: {symbol: contracts to sell}
+    # get_exps(symbol) picks the candidate expirations, nearest first
+    symbols = list(quantities.keys())
+    lookup = {
+        symbol: SellPosition(
+            quantity=quantities[symbol],
+            price=prices[symbol],
+            cursor=Cursor(0, 0, 0),
+            expirations=[],
+            contracts=[]
+        ) for symbol in symbols
+    }
+
+    # fetch the chains for every symbol at once
+    expirations = fetch_all(get_exps, symbols)
+    for symbol, exps in zip(symbols, expirations):
+        if is_error(exps) or not exps:
+            print(f'could not fetch chain for {symbol}: {exps!r}')
+            del lookup[symbol]
+        else:
+            lookup[symbol].expirations = exps
+
+    # then the contract candidates for every symbol and expiration at once
+    pairs = [(symbol, exp)
+             for symbol in lookup for exp in lookup[symbol].expirations]
+    candidates = fetch_all(
+        lambda pair: get_contracts(*pair, lookup[pair[0]].price), pairs)
+    # pairs are in expiration order, so contracts line up with expirations
+    for (symbol, exp), contracts in zip(pairs, candidates):
+        if is_error(contracts):
+            # an empty expiration gets skipped by adjust_option
+            print(f'could not fetch contracts for {symbol} {exp}: {contracts!r}')
+            contracts = []
+        # parse every candidate once instead of on every reprice
+        lookup[symbol].contracts.append(
+            [Contract.from_dict(contract) for contract in contracts])
+    return lookup
 
 
 class Trade:
-    # curr[x, y, z]
-    # x is expiration index
-    # y is contract index
-    # z is price index
+    # lookup maps each symbol to a SellPosition or BuyPosition
+    # a sell position's cursor tracks the expiration, contract, and price index
     def execute(self, symbols):
         results = {}
         lookup = self.init_chain(symbols)
+        self.quotes = QuoteCache()
+        self.quotes.touch(self.live_contracts(lookup, results))
 
         while set(lookup.keys()) != set(results.keys()):
             orders = self.execute_orders(lookup, results)
 
-            # wait 5-10 sec
-            delay()
+            # wait until every order fills or the round times out
+            orders = poll_orders(orders)
 
             lookup, results = self.adjust_orders(orders, lookup, results)
         return results
 
+    def live_contracts(self, lookup, results):
+        # every candidate contract of every symbol that still needs a fill
+        for symbol, position in lookup.items():
+            if symbol not in results:
+                yield from position.candidates()
+
     def adjust_orders(self, orders, lookup, results):
-        for symbol in orders:
-            id = orders[symbol].get('id')
-            if id:
-                rh.orders.cancel_option_order(id)
-                order = rh.orders.get_option_order_info(id)
-            if id and order['state'] == 'filled':
+        # only cancel and reprice the symbols that are still open
+        orders = cancel_orders(orders)
+        for symbol, order in orders.items():
+            if order.get('state') == 'filled':
                 results[symbol] = order
-            elif not id or order['state'] == 'cancelled':
+        # refresh quotes for all remaining symbols in one batch before repricing
+        self.quotes.refresh(self.live_contracts(lookup, results))
+        for symbol, order in orders.items():
+            if symbol in results:
+                continue
+            if not order.get('id') or order.get('state') in FINAL_STATES:
                 lookup, results = self.adjust_option(symbol, lookup, results)
         return lookup, results
 
 
 class Sell(Trade):
     def init_chain(self, symbols):
-        desired_contracts, prices = suggest_contracts()
-        # only use symbols that have positions available
-        symbols = [symbol for symbol in symbols if desired_contracts[symbol]]
-        lookup = {
-            symbol: {
-                'quantity': desired_contracts[symbol],
-                # expiration index, contract index, price index
-                'curr': [0, 0, 0],
-                'price': prices[symbol]
-            } for symbol in symbols
-        }
-
-        for symbol in lookup:
-            print('symbol in init_chain lookup', symbol)
-            chain = rh.options.get_chains(symbol)
-            price = lookup[symbol]['price']
-            expirations = chain['expiration_dates']
-            expirations = get_expirations(expirations)
-            lookup[symbol]['expirations'] = expirations
-            # maybe turn these two lines into a fx called update_contracts and run before every trade attempt
-            contracts = [get_contracts(symbol, exp, price)
-                         for exp in expirations]
-            lookup[symbol]['contracts'] = contracts
-        return lookup
+        return init_sell_chain(symbols)
 
     def get_price(self, contract, offset):
-        mid_price = get_mid_price(contract)
+        mid_price = contract.mid
         # get mid price to two decimal places
         price = round(mid_price, 2, 'UP')
         # option price increment/step (e.g. 0.01 per contract or 0.05)
-        min_tick = float(contract['min_ticks']['below_tick'])
+        min_tick = contract.below_tick
         # round price up to tick
         price = ceil(price / min_tick) * min_tick
         # lower price based on attempt
@@ -329,77 +406,73 @@ class Sell(Trade):
         return round(price, 2, 'UP')
 
     def adjust_option(self, symbol, lookup, results):
-        option = lookup[symbol]
-        curr = option['curr']
+        position = lookup[symbol]
+        cursor = position.cursor
+        last_exp = len(position.expirations) - 1
         print(f"adjusting option... {symbol}")
-        print(f"before curr: {curr}")
-        contracts = option['contracts']
-        if not contracts[curr[0]]:
+        print(f"before cursor: {cursor}")
+        contracts = position.contracts
+        if not contracts[cursor.exp]:
             print("not on first expiration date")
-            if curr[0] == len(option['expirations']) - 1:
+            if cursor.exp == last_exp:
                 print("already on last expiration date - error: options exhausted")
                 results[symbol] = {'error': 'EXHAUSTED'}
             else:
                 print(
                     "iterating to next expiration, resetting contract and price indices")
-                lookup[symbol]['curr'] = [curr[0] + 1, 0, 0]
+                cursor.next_expiration()
         else:
             print("iterating price index")
-            curr[2] += 1
-            contract = contracts[curr[0]][curr[1]]
-            mid_price = get_mid_price(contract)
-            price = self.get_price(contract, curr[2])
+            cursor.price += 1
+            contract = contracts[cursor.exp][cursor.contract]
+            mid_price = contract.mid
+            price = self.get_price(contract, cursor.price)
 
             if spread_is_high(mid_price, price):
                 print(
                     symbol,
                     f"""
                     Price spread is high.
-                    Bid: {float(contract["bid_price"])}
-                    Ask: {float(contract["ask_price"])}
+                    Bid: {contract.bid}
+                    Ask: {contract.ask}
                     Mid: {mid_price} Price: {price}
                     """
                 )
                 print("spread is too high")
                 print("resetting price index")
-                curr[2] = 0
-                if curr[1] == len(contracts[curr[0]]) - 1:
+                cursor.price = 0
+                if cursor.contract == len(contracts[cursor.exp]) - 1:
                     print("on last contract - resetting contract idx")
-                    curr[1] = 0
-                    if curr[0] == len(option['expirations']) - 1:
+                    cursor.contract = 0
+                    if cursor.exp == last_exp:
                         print("on last expiration - error: options exhausted")
                         results[symbol] = {'error': 'EXHAUSTED'}
                     else:
                         print("iterating expiration date")
                         print('Seeking further expiration date...')
-                        curr[0] += 1
+                        cursor.exp += 1
                 else:
                     print("iterating contract idx")
-                    curr[1] += 1
-        print(f"after curr: {curr}")
-        print(f"lookup curr: {lookup[symbol]['curr']}")
-        print(f"currs match: {curr == lookup[symbol]['curr']}")
-        # if currs don't match, then following line is needed
-        lookup[symbol]['curr'] = curr
-        lookup = update_contract(symbol, lookup)
+                    cursor.contract += 1
+        print(f"after cursor: {cursor}")
         return lookup, results
 
     def execute_orders(self, lookup, results):
         remaining = [symbol for symbol in lookup if symbol not in results]
         orders = {}
-        for idx, symbol in enumerate(remaining):
-            option = lookup[symbol]
-            curr = option['curr']
+        for symbol in remaining:
+            position = lookup[symbol]
+            cursor = position.cursor
             print(f"executing order... {symbol}")
-            print(f"curr: {curr}")
-            expiration = option['expirations'][curr[0]]
-            contract_candidates = option['contracts'][curr[0]]
+            print(f"cursor: {cursor}")
+            expiration = position.expirations[cursor.exp]
+            contract_candidates = position.contracts[cursor.exp]
             if contract_candidates:
-                contract = contract_candidates[curr[1]]
+                contract = contract_candidates[cursor.contract]
 
-                strike = float(contract['strike_price'])
-                price = self.get_price(contract, curr[2])
-                quantity = option['quantity']
+                strike = contract.strike
+                price = self.get_price(contract, cursor.price)
+                quantity = position.quantity
 
                 order = rh.orders.order_sell_option_limit(
                     'open', 'credit', price, symbol, quantity, expiration, strike, 'call')
@@ -407,40 +480,31 @@ class Sell(Trade):
                 orders[symbol] = order
             else:
                 orders[symbol] = {'state': 'cancelled'}
-            if idx == len(remaining) - 1:
-                delay()
         return orders
 
 
-class SellOut(Trade):
+class SellOut(Sell):
+    # sells the same quantity at the nearest expirations after the one bought back
+    def __init__(self, closed, prices):
+        # closed: {symbol: BuyPosition}, prices: {symbol: stock price}
+        self.closed = closed
+        self.prices = prices
+
     def init_chain(self, symbols):
-        desired_contracts, prices = suggest_contracts()
-        # only use symbols that have positions available
-        symbols = [symbol for symbol in symbols if desired_contracts[symbol]]
-        lookup = {
-            symbol: {
-                'quantity': desired_contracts[symbol],
-                'curr': [0, 0, 0],
-                'price': prices[symbol]
-            } for symbol in symbols
-        }
+        quantities = {symbol: self.closed[symbol].quantity for symbol in symbols}
+        return build_sell_chain(quantities, self.prices, self.get_expirations)
 
-        for symbol in lookup:
-            print('symbol in init_chain lookup', symbol)
-            chain = rh.options.get_chains(symbol)
-            price = lookup[symbol]['price']
-            expirations = chain['expiration_dates']
-            expirations = get_expirations(expirations)
-            lookup[symbol]['expirations'] = expirations
-            # maybe turn these two lines into a fx called update_contracts and run before every trade attempt
-            contracts = [get_contracts(symbol, exp, price)
-                         for exp in expirations]
-            lookup[symbol]['contracts'] = contracts
-        return lookup
+    def get_expirations(self, symbol, num=2):
+        chain = rh.options.get_chains(symbol)
+        closed = self.closed[symbol].expiration
+        return [exp for exp in chain['expiration_dates'] if exp > closed][:num]
 
 
-class SellIn(Trade):
-    pass
+class SellIn(SellOut):
+    # sells at the nearest expirations before the one bought back
+    def get_expirations(self, symbol):
+        closed = self.closed[symbol].expiration
+        return [exp for exp in get_chain_expirations(symbol) if exp < closed]
 
 
 class Buy(Trade):
@@ -453,7 +517,6 @@ class Buy(Trade):
                 'quantity': int(float(opt['quantity'])),
                 'expiration': opt['legs'][0]['expiration_date'],
                 'strike': float(opt['legs'][0]['strike_price']),
-                'curr': 0,
                 'id': (
                     re.search(pattern, opt['legs'][0]['option'], re.IGNORECASE)
                     or re.search(pattern, opt['strategy_code'], re.IGNORECASE)
@@ -463,26 +526,33 @@ class Buy(Trade):
                 opt['strategy'] == 'short_call'
             )
         }
-        lookup = {
-            symbol:
-            info | {
-                'contract':
-                rh.options.get_option_market_data_by_id(info['id'])[0] | {
-                    'min_ticks':
-                    rh.options.get_option_instrument_data_by_id(info['id'])[
-                        'min_ticks']
-                }} for symbol, info in tradeable.items()}
+        # instruments and quotes for every position in two batched requests
+        ids = [info['id'] for info in tradeable.values()]
+        instruments, market_data = fetch_all(
+            lambda fx: fx(ids), [get_instrument_data, get_market_data])
+        lookup = {}
+        for symbol, info in tradeable.items():
+            id = info['id']
+            if is_error(instruments) or is_error(market_data) or \
+                    id not in instruments or id not in market_data:
+                print(f'could not fetch contract for {symbol}')
+                continue
+            lookup[symbol] = BuyPosition(
+                offset=0,
+                contract=Contract.from_dict(instruments[id] | market_data[id]),
+                **info
+            )
         return lookup
 
     def get_price(self, contract, offset):
         # THIS FX STILL NEEDS TO BE CONVERTED
         # need to make sure contract has bid prices and ticks - DONE
-        mid_price = get_mid_price(contract)
+        mid_price = contract.mid
         # get mid price to two decimal places
         price = round(mid_price, 2, 'DOWN')  # CONVERTED
         # option price increment/step (e.g. 0.01 per contract or 0.05)
         # use instrument_data_by_id fx in init_chain to get this? - DONE
-        min_tick = float(contract['min_ticks']['above_tick'])
+        min_tick = contract.above_tick
         # round price down to tick
         # this should be floor? - DONE
         price = floor(price / min_tick) * min_tick
@@ -491,65 +561,151 @@ class Buy(Trade):
         return round(price, 2, 'DOWN')
 
     def adjust_option(self, symbol, lookup, _):
-        option = lookup[symbol]
-        option['curr'] += 1
-        curr = option['curr']
-        contract = option['contract']
-        mid_price = get_mid_price(contract)
-        price = self.get_price(contract, curr)
+        position = lookup[symbol]
+        position.offset += 1
+        contract = position.contract
+        mid_price = contract.mid
+        price = self.get_price(contract, position.offset)
 
         if spread_is_high(mid_price, price):
             print(
                 symbol,
                 f"""
                 Price spread is high.
-                Bid: {float(contract["bid_price"])}
-                Ask: {float(contract["ask_price"])}
+                Bid: {contract.bid}
+                Ask: {contract.ask}
                 Mid: {mid_price} Price: {price}
                 """
             )
-
-        lookup[symbol] = option
         return lookup, _
 
     def execute_orders(self, lookup, results):
         remaining = [symbol for symbol in lookup if symbol not in results]
         orders = {}
-        for idx, symbol in enumerate(remaining):
-            option = lookup[symbol]
-            quantity = option['quantity']
-            expiration = option['expiration']
-            strike = option['strike']
-            price = self.get_price(option['contract'], option['curr'])
+        for symbol in remaining:
+            position = lookup[symbol]
+            quantity = position.quantity
+            expiration = position.expiration
+            strike = position.strike
+            price = self.get_price(position.contract, position.offset)
             order = rh.orders.order_buy_option_limit(
                 'close', 'debit', price, symbol,
                 quantity, expiration, strike, 'call'
             )
             print('Order:', json.dumps(order))
             orders[symbol] = order
-            if idx == len(remaining) - 1:
-                delay()
         return orders
 
 
+def get_premium(order):
+    # dollars paid or received for a filled order
+    if order.get('processed_premium'):
+        return Decimal(order['processed_premium'])
+    return Decimal(order['price']) * Decimal(order['quantity']) * 100
+
+
+def is_filled(order):
+    return bool(order) and order.get('state') == 'filled'
+
+
+class Roll:
+    # Buys back short calls and sells new ones. Each symbol's sell leg
+    # starts as soon as its buy fills, instead of after the whole buy batch,
+    # so positions sit uncovered for as short as possible.
+    def __init__(self, sell_cls):
+        self.buy = Buy()
+        self.sell_cls = sell_cls
+
+    def execute(self, symbols):
+        self.buy_lookup = self.buy.init_chain(symbols)
+        self.buy_results = {}
+        self.sell_lookup = {}
+        self.sell_results = {}
+        _, prices = suggest_contracts()
+        self.sell = self.sell_cls(self.buy_lookup, prices)
+        self.quotes = self.buy.quotes = self.sell.quotes = QuoteCache()
+        self.quotes.touch(self.buy.live_contracts(self.buy_lookup, self.buy_results))
+
+        while not self.is_done():
+            orders = self.execute_orders()
+
+            # sell legs go out during the round as soon as their buys fill
+            orders = poll_orders(orders, on_fill=self.on_fill)
+
+            self.adjust_orders(orders)
+            # buys that filled while being cancelled get their sells next round
+            self.start_sells(list(self.buy_results.keys()))
+        return self.get_results(symbols)
+
+    def is_done(self):
+        return (
+            set(self.buy_lookup.keys()) == set(self.buy_results.keys()) and
+            set(self.sell_lookup.keys()) <= set(self.sell_results.keys()) and
+            all(symbol in self.sell_results for symbol, order in self.buy_results.items()
+                if is_filled(order))
+        )
+
+    def execute_orders(self):
+        orders = self.buy.execute_orders(self.buy_lookup, self.buy_results)
+        sell_orders = self.sell.execute_orders(self.sell_lookup, self.sell_results)
+        return {('buy', symbol): order for symbol, order in orders.items()} | \
+            {('sell', symbol): order for symbol, order in sell_orders.items()}
+
+    def on_fill(self, orders):
+        symbols = []
+        for (leg, symbol), order in orders.items():
+            if leg == 'buy':
+                self.buy_results[symbol] = order
+                symbols.append(symbol)
+        orders = self.sell.execute_orders(self.start_sells(symbols), self.sell_results)
+        return {('sell', symbol): order for symbol, order in orders.items()}
+
+    def start_sells(self, symbols):
+        # adds the sell legs for filled buys to sell_lookup and returns them,
+        # orders only go out from on_fill or execute_orders so each is polled
+        symbols = [
+            symbol for symbol in symbols if is_filled(self.buy_results[symbol]) and
+            symbol not in self.sell_lookup and symbol not in self.sell_results
+        ]
+        if not symbols:
+            return {}
+        lookup = self.sell.init_chain(symbols)
+        for symbol in symbols:
+            if symbol not in lookup:
+                self.sell_results[symbol] = {'error': 'NO_CHAIN'}
+        self.sell_lookup |= lookup
+        self.quotes.touch(self.sell.live_contracts(lookup, self.sell_results))
+        return lookup
+
+    def adjust_orders(self, orders):
+        for leg, trade, lookup, results in [
+            ('buy', self.buy, self.buy_lookup, self.buy_results),
+            ('sell', self.sell, self.sell_lookup, self.sell_results)
+        ]:
+            leg_orders = {symbol: order for (order_leg, symbol), order in orders.items()
+                          if order_leg == leg}
+            trade.adjust_orders(leg_orders, lookup, results)
+
+    def get_results(self, symbols):
+        results = {}
+        for symbol in symbols:
+            buy = self.buy_results.get(symbol, {'error': 'NO_POSITION'})
+            sell = self.sell_results.get(symbol)
+            result = {'buy': buy, 'sell': sell}
+            if is_filled(buy) and is_filled(sell):
+                result['net_credit'] = float(get_premium(sell) - get_premium(buy))
+            results[symbol] = result
+        return results
+
+
 def roll_out(symbols):
-    # need to buy and have wait and retry
-    trade = Buy()
-    buy_results = trade.execute(symbols)
-    trade = SellOut()
-    sell_results = trade.execute(symbols, buy_results)
-    # TODO: return sell minus buy results
-    return sell_results
+    # roll short calls expiring soon out to later expirations
+    return Roll(SellOut).execute(symbols)
 
 
 def roll_in(symbols):
-    # also implement rolling in as well as out
-    trade = Buy()
-    buy_results = trade.execute(symbols)
-    trade = SellIn()
-    sell_results = trade.execute(symbols, buy_results)
-    # TODO: return sell minus buy results
-    return sell_results
+    # roll short calls in to nearer expirations
+    return Roll(SellIn).execute(symbols)
 
 
 # also need to add tests backend and frontend
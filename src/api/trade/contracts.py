@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+
+
+def to_float(val):
+    # rh sends numbers as strings, and None / '' when a field is missing
+    return float(val) if val not in (None, '') else None
+
+
+# rh field: (attribute, parser), these can change between quotes
+QUOTE_FIELDS = {
+    'bid_price': ('bid', to_float),
+    'ask_price': ('ask', to_float),
+    'chance_of_profit_short': ('chance', to_float),
+    'high_fill_rate_sell_price': ('fill_rate_price', to_float),
+}
+
+
+@dataclass
+class Cursor:
+    # expiration index, contract index, price index
+    __slots__ = ('exp', 'contract', 'price')
+    exp: int
+    contract: int
+    price: int
+
+    def next_expiration(self):
+        self.exp += 1
+        self.contract = 0
+        self.price = 0
+
+
+@dataclass
+class Contract:
+    # option instrument + market data, parsed once at ingest
+    __slots__ = ('id', 'expiration', 'strike', 'below_tick', 'above_tick',
+                 'bid', 'ask', 'chance', 'fill_rate_price')
+    id: str
+    expiration: str
+    strike: float
+    below_tick: float
+    above_tick: float
+    bid: float
+    ask: float
+    chance: float
+    fill_rate_price: float
+
+    @classmethod
+    def from_dict(cls, data):
+        min_ticks = data['min_ticks']
+        quote = {attr: parse(data.get(key)) for key, (attr, parse) in QUOTE_FIELDS.items()}
+        return cls(
+            id=data['id'],
+            expiration=data['expiration_date'],
+            strike=float(data['strike_price']),
+            below_tick=float(min_ticks['below_tick']),
+            above_tick=float(min_ticks['above_tick']),
+            **quote
+        )
+
+    @property
+    def mid(self):
+        return (self.ask + self.bid) / 2
+
+    def update(self, data):
+        # applies a fresh quote, returns the number of fields that changed
+        changed = 0
+        for key, (attr, parse) in QUOTE_FIELDS.items():
+            if key not in data:
+                continue
+            val = parse(data[key])
+            if getattr(self, attr) != val:
+                setattr(self, attr, val)
+                changed += 1
+        return changed
+
+
+@dataclass
+class SellPosition:
+    __slots__ = ('quantity', 'price', 'cursor', 'expirations', 'contracts')
+    quantity: int
+    # current stock price
+    price: float
+    cursor: Cursor
+    expirations: list
+    # contract candidates for each expiration
+    contracts: list
+
+    def candidates(self):
+        for contracts in self.contracts:
+            yield from contracts
+
+
+@dataclass
+class BuyPosition:
+    __slots__ = ('quantity', 'expiration', 'strike', 'id', 'offset', 'contract')
+    quantity: int
+    expiration: str
+    strike: float
+    id: str
+    # price index
+    offset: int
+    contract: Contract
+
+    def candidates(self):
+        yield self.contract
@@ -0,0 +1,125 @@
+from math import ceil
+from time import time
+import robin_stocks.robinhood as rh
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# rh calls are blocking http, so threads (not processes) are enough
+MAX_WORKERS = 8
+# seconds a single item may run before it is given up on
+TIMEOUT = 60
+# ids per multi-id request, keeps the query string well under url limits
+CHUNK_SIZE = 25
+
+
+class FetchTimeout(Exception):
+    pass
+
+
+def is_error(result):
+    return isinstance(result, Exception)
+
+
+def fetch_all(fx, items, max_workers=MAX_WORKERS, timeout=TIMEOUT):
+    # Runs fx(item) for every item on a bounded thread pool.
+    # Results come back in the same order as items, no matter which finishes first.
+    # An item that raises or runs longer than timeout returns the exception instead.
+    # Items still queued or running once every wave could have timed out
+    # (the overall deadline) time out too, so hung workers can't stall the rest.
+    items = list(items)
+    results = [None] * len(items)
+    if not items:
+        return results
+    started = {}
+    max_workers = min(max_workers, len(items))
+    deadline = time() + timeout * ceil(len(items) / max_workers)
+
+    def run(idx):
+        started[idx] = time()
+        return fx(items[idx])
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(run, idx): idx for idx in range(len(items))}
+    pending = set(futures)
+    while pending:
+        # wake up for the next finished item or the next deadline
+        deadlines = [started[futures[future]] + timeout
+                     for future in pending if futures[future] in started]
+        wait_for = max(min(deadlines + [deadline]) - time(), 0)
+        done, pending = wait(pending, timeout=wait_for,
+                             return_when=FIRST_COMPLETED)
+        for future in done:
+            idx = futures[future]
+            try:
+                results[idx] = future.result()
+            except Exception as e:
+                results[idx] = e
+        now = time()
+        expired = {future for future in pending if now >= deadline
+                   or futures[future] in started and now - started[futures[future]] >= timeout}
+        for future in expired:
+            idx = futures[future]
+            print(f'fetch timed out after {timeout}s: {items[idx]}')
+            results[idx] = FetchTimeout(items[idx])
+        pending -= expired
+    # don't block on threads that timed out
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def chunk(items, size=CHUNK_SIZE):
+    return [items[idx: idx + size] for idx in range(0, len(items), size)]
+
+
+def get_instrument_id(data):
+    # market data only links to its instrument by url
+    if data.get('instrument_id'):
+        return data['instrument_id']
+    return data['instrument'].rstrip('/').split('/')[-1]
+
+
+def fold_pages(pages, get_id):
+    data = {}
+    for page in pages:
+        if is_error(page):
+            print(f'batch request failed: {page!r}')
+            continue
+        for item in page or []:
+            # rh returns [None] when a request fails
+            if item:
+                data[get_id(item)] = item
+    return data
+
+
+def fetch_by_ids(fetch_chunk, fetch_one, ids, get_id):
+    # one request per chunk of ids instead of one per id,
+    # then a parallel retry of single ids that the batch missed
+    ids = list(dict.fromkeys(ids))
+    data = fold_pages(fetch_all(fetch_chunk, chunk(ids)), get_id)
+    missing = [id for id in ids if id not in data]
+    for id, item in zip(missing, fetch_all(fetch_one, missing)):
+        if item and not is_error(item):
+            data[id] = item
+    return data
+
+
+def get_market_data(ids):
+    # returns {option id: market data}
+    def fetch_chunk(ids):
+        instruments = ','.join(rh.urls.option_instruments_url(id) for id in ids)
+        return rh.helper.request_get(
+            rh.urls.marketdata_options_url(), 'results', {'instruments': instruments})
+
+    def fetch_one(id):
+        data = rh.options.get_option_market_data_by_id(id)
+        return data[0] if data else None
+    return fetch_by_ids(fetch_chunk, fetch_one, ids, get_instrument_id)
+
+
+def get_instrument_data(ids):
+    # returns {option id: instrument data}
+    def fetch_chunk(ids):
+        return rh.helper.request_get(
+            rh.urls.option_instruments_url(), 'pagination', {'ids': ','.join(ids)})
+    return fetch_by_ids(
+        fetch_chunk, rh.options.get_option_instrument_data_by_id, ids,
+        lambda item: item['id'])
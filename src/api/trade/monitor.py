@@ -0,0 +1,59 @@
+from time import time, sleep
+import robin_stocks.robinhood as rh
+from fetch import fetch_all, is_error
+
+# order states that won't change anymore
+FINAL_STATES = set(['filled', 'cancelled', 'rejected', 'failed'])
+# first poll after half a second, then back off up to every 3 sec
+POLL_INTERVAL = 0.5
+BACKOFF = 1.5
+MAX_POLL_INTERVAL = 3
+# max seconds to wait for fills before repricing (was a fixed 5-10s sleep)
+FILL_TIMEOUT = 10
+# max seconds to wait for cancellations to go through
+CANCEL_TIMEOUT = 5
+
+
+def is_open(order):
+    return bool(order.get('id')) and order.get('state') not in FINAL_STATES
+
+
+def poll_orders(orders, timeout=FILL_TIMEOUT, interval=POLL_INTERVAL,
+                backoff=BACKOFF, max_interval=MAX_POLL_INTERVAL, on_fill=None):
+    # Polls every open order at once until they all reach a final state
+    # or the timeout runs out. Returns orders with their latest state.
+    # on_fill gets {key: order} for new fills as soon as they are seen,
+    # and can return new orders to watch for the rest of the round.
+    orders = dict(orders)
+    deadline = time() + timeout
+    pending = [symbol for symbol, order in orders.items() if is_open(order)]
+    while pending:
+        sleep(max(min(interval, deadline - time()), 0))
+        infos = fetch_all(
+            lambda symbol: rh.orders.get_option_order_info(orders[symbol]['id']),
+            pending)
+        for symbol, info in zip(pending, infos):
+            if is_error(info) or not info:
+                print(f'could not get order info for {symbol}: {info!r}')
+            else:
+                orders[symbol] = info
+        filled = {symbol: orders[symbol] for symbol in pending
+                  if orders[symbol].get('state') == 'filled'}
+        pending = [symbol for symbol in pending if is_open(orders[symbol])]
+        if on_fill and filled:
+            placed = on_fill(filled) or {}
+            orders |= placed
+            pending += [symbol for symbol, order in placed.items() if is_open(order)]
+        if time() >= deadline:
+            break
+        interval = min(interval * backoff, max_interval)
+    return orders
+
+
+def cancel_orders(orders, timeout=CANCEL_TIMEOUT):
+    # cancels every open order at once and waits for the cancellations to land
+    # an order can still fill before the cancellation goes through
+    open_orders = {symbol: order for symbol, order in orders.items() if is_open(order)}
+    fetch_all(lambda order: rh.orders.cancel_option_order(order['id']),
+              open_orders.values())
+    return orders | poll_orders(open_orders, timeout=timeout)
@@ -0,0 +1,87 @@
+import numpy as np
+
+# Abramowitz & Stegun 7.1.26 coefficients (max abs error 1.5e-7)
+ERF_P = 0.3275911
+ERF_A = (0.254829592, -0.284496736, 1.421413741, -1.453152027, 1.061405429)
+SQRT_2 = np.sqrt(2)
+SQRT_2PI = np.sqrt(2 * np.pi)
+DAYS_IN_A_YEAR = 365
+
+
+def erf(x):
+    x = np.asarray(x, dtype=float)
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1 / (1 + ERF_P * x)
+    poly = 0
+    for coef in reversed(ERF_A):
+        poly = (poly + coef) * t
+    return sign * (1 - poly * np.exp(-x * x))
+
+
+def norm_cdf(x):
+    return (1 + erf(np.asarray(x, dtype=float) / SQRT_2)) / 2
+
+
+def norm_pdf(x):
+    x = np.asarray(x, dtype=float)
+    return np.exp(-x * x / 2) / SQRT_2PI
+
+
+def calc_d1(stock_price, strike_price, implied_vol, rho, div_yield, time):
+    # every arg can be a scalar or an array, arrays are broadcast together
+    stock_price, strike_price, implied_vol, rho, div_yield, time = \
+        np.broadcast_arrays(
+            *[np.asarray(arg, dtype=float) for arg in (
+                stock_price, strike_price, implied_vol, rho, div_yield, time)])
+    numerator = np.log(stock_price / strike_price) + \
+        (rho - div_yield + (implied_vol ** 2) / 2) * time
+    denominator = implied_vol * np.sqrt(time)
+    return numerator / denominator
+
+
+def calc_d2(d1, implied_vol, time):
+    return d1 - np.asarray(implied_vol, dtype=float) * np.sqrt(time)
+
+
+def chance_of_profit(**kwargs):
+    # same inputs as trade.app.chance_of_profit, but for a whole chain at once
+    d1 = calc_d1(**kwargs)
+    d2 = calc_d2(d1, kwargs['implied_vol'], kwargs['time'])
+    return 1 - norm_cdf(d2)
+
+
+def price_chain(stock_price, strike_price, implied_vol, time, rho=0, div_yield=0):
+    # Prices a chain of calls in one pass.
+    # IV, rho (risk free rate), div yield, and time are decimals. Time is in years.
+    # Keys match the fields returned by rh.options.get_option_market_data_by_id
+    # so results can be merged straight into the contract dicts.
+    stock_price, strike_price, implied_vol, time, rho, div_yield = \
+        np.broadcast_arrays(
+            *[np.asarray(arg, dtype=float) for arg in (
+                stock_price, strike_price, implied_vol, time, rho, div_yield)])
+    d1 = calc_d1(stock_price, strike_price, implied_vol, rho, div_yield, time)
+    d2 = calc_d2(d1, implied_vol, time)
+    cdf_d1 = norm_cdf(d1)
+    cdf_d2 = norm_cdf(d2)
+    pdf_d1 = norm_pdf(d1)
+    sqrt_time = np.sqrt(time)
+    div_discount = np.exp(-div_yield * time)
+    rate_discount = np.exp(-rho * time)
+    theta = (
+        -stock_price * pdf_d1 * implied_vol * div_discount / (2 * sqrt_time)
+        - rho * strike_price * rate_discount * cdf_d2
+        + div_yield * stock_price * div_discount * cdf_d1
+    )
+    return {
+        'd1': d1,
+        'd2': d2,
+        'chance_of_profit_short': 1 - cdf_d2,
+        'chance_of_profit_long': cdf_d2,
+        'delta': div_discount * cdf_d1,
+        'gamma': div_discount * pdf_d1 / (stock_price * implied_vol * sqrt_time),
+        # theta per calendar day, vega and rho per 1% move (like rh)
+        'theta': theta / DAYS_IN_A_YEAR,
+        'vega': stock_price * div_discount * pdf_d1 * sqrt_time / 100,
+        'rho': strike_price * time * rate_discount * cdf_d2 / 100,
+    }
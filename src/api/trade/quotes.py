@@ -0,0 +1,42 @@
+from time import time
+from fetch import get_market_data
+
+# seconds before a quote is considered stale
+QUOTE_TTL = 5
+
+
+class QuoteCache:
+    # Keeps the market data of every live candidate fresh, keyed by option id.
+    # Contracts are updated in place, so the lookup always sees fresh quotes
+    # without rebuilding the chain on every reprice.
+    def __init__(self, ttl=QUOTE_TTL):
+        self.ttl = ttl
+        self.fetched = {}
+
+    def touch(self, contracts):
+        # mark contracts as fresh, e.g. right after they were fetched
+        now = time()
+        for contract in contracts:
+            self.fetched[contract.id] = now
+
+    def is_stale(self, id, now=None):
+        now = now or time()
+        return id not in self.fetched or now - self.fetched[id] >= self.ttl
+
+    def refresh(self, contracts, force=False):
+        # one batch for every stale contract across all symbols
+        # returns the number of fields that changed
+        now = time()
+        by_id = {}
+        for contract in contracts:
+            if force or self.is_stale(contract.id, now):
+                by_id.setdefault(contract.id, []).append(contract)
+        if not by_id:
+            return 0
+        market_data = get_market_data(list(by_id.keys()))
+        changed = 0
+        for id, data in market_data.items():
+            for contract in by_id[id]:
+                changed += contract.update(data)
+            self.fetched[id] = now
+        return changed
@@ -0,0 +1,128 @@
+import os
+import boto3
+import pyotp
+import hashlib
+from time import time
+from pathlib import Path
+import robin_stocks.robinhood as rh
+from botocore.exceptions import ClientError
+
+s3 = boto3.resource('s3')
+
+# rh.login default, tokens are valid for a day
+EXPIRES_IN = 86400
+# refresh this many seconds before the token actually expires
+EXPIRY_MARGIN = 60 * 60
+
+# Authenticated sessions live in module scope so warm lambda invocations skip
+# the s3 download, the login request, and the s3 upload.
+# One slot per account: False is the primary account, True is the variant.
+sessions = {}
+
+
+def get_postfix(variant):
+    return '2' if variant else ''
+
+
+def get_auth_path(variant=False):
+    # one pickle per account, rh.login reads and writes robinhood{pickle_name}.pickle
+    return os.path.join(os.path.expanduser("~"), '.tokens', f'robinhood{get_postfix(variant)}.pickle')
+
+
+def get_digest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def is_valid(session, now=None):
+    now = now or time()
+    return bool(session) and session['expires'] - EXPIRY_MARGIN > now
+
+
+def activate(session):
+    # point the global rh session at this account
+    rh.helper.update_session('Authorization', session['authorization'])
+    rh.helper.set_login_state(True)
+
+
+def is_authorized():
+    # a cheap authenticated request, a cached token can be revoked before it expires
+    res = rh.helper.request_get(rh.urls.user_profile_url(), jsonify_data=False)
+    return res.status_code != 401
+
+
+def download_auth(key, auth_path):
+    # returns (bucket, when the stored token was issued or None)
+    bucket = s3.Bucket(os.environ['S3_BUCKET'])
+    Path(auth_path).parent.mkdir(parents=True, exist_ok=True)
+    try:
+        obj = bucket.Object(key).get()
+    except ClientError:
+        print('Could not load auth file from S3.')
+        if os.path.exists(auth_path):
+            os.remove(auth_path)
+        return bucket, None
+    with open(auth_path, 'wb') as file:
+        file.write(obj['Body'].read())
+    print('Loaded auth file from S3.')
+    issued = obj['Metadata'].get('issued')
+    return bucket, float(issued) if issued else None
+
+
+def load_auth(key, auth_path):
+    # rh.login reuses a pickled token as is, so a token we can't date or
+    # that expires soon is dropped and rh.login issues a new one
+    bucket, issued = download_auth(key, auth_path)
+    if not is_valid({'expires': (issued or 0) + EXPIRES_IN}) and os.path.exists(auth_path):
+        print('Stored token is expiring, logging in again.')
+        os.remove(auth_path)
+    return bucket, issued
+
+
+def login(variant=False):
+    variant = bool(variant)
+    session = sessions.get(variant)
+    if is_valid(session):
+        activate(session)
+        if is_authorized():
+            print('Reusing cached session.')
+            return session
+        print('Cached session was rejected.')
+        logout(variant)
+
+    postfix = get_postfix(variant)
+    auth_path = get_auth_path(variant)
+    key = f'data/robinhood{postfix}.pickle'
+    bucket, issued = load_auth(key, auth_path)
+    digest = get_digest(auth_path)
+    username = os.environ[f'RH_USERNAME{postfix}']
+    password = os.environ[f'RH_PASSWORD{postfix}']
+    mfa_code = pyotp.TOTP(os.environ[f'RH_2FA{postfix}']).now()
+    data = rh.login(
+        username, password, expiresIn=EXPIRES_IN, mfa_code=mfa_code, pickle_name=postfix)
+    if not data:
+        sessions.pop(variant, None)
+        print('Could not log in.')
+        return
+    # rh.login only rewrites the pickle when it had to issue a new token,
+    # a reused token reports the requested expiresIn rather than its remaining life
+    new_digest = get_digest(auth_path)
+    if new_digest != digest or not issued:
+        issued = time()
+        if new_digest:
+            bucket.upload_file(auth_path, key, ExtraArgs={'Metadata': {'issued': str(issued)}})
+            print('Saved auth file to S3.')
+    session = {
+        'authorization': f"{data['token_type']} {data['access_token']}",
+        'expires': issued + EXPIRES_IN,
+    }
+    sessions[variant] = session
+    activate(session)
+    return session
+
+
+def logout(variant=False):
+    # drop a slot, e.g. after the api rejects its token
+    sessions.pop(bool(variant), None)
@@ -15,11 +15,17 @@ aws dynamodb create-table \
         AttributeName=customer_id,AttributeType=S \
         AttributeName=in_beta,AttributeType=N \
         AttributeName=subscribed,AttributeType=N \
+        AttributeName=notify_email,AttributeType=N \
+        AttributeName=notify_webhook,AttributeType=N \
     --global-secondary-indexes \
         IndexName=api_key_index,KeySchema=["{AttributeName=api_key,KeyType=HASH}"],Projection={ProjectionType=ALL} \
         IndexName=customer_id_index,KeySchema=["{AttributeName=customer_id,KeyType=HASH}"],Projection={ProjectionType=ALL} \
         IndexName=in_beta_index,KeySchema=["{AttributeName=in_beta,KeyType=HASH}"],Projection={ProjectionType=ALL} \
         IndexName=subscribed_index,KeySchema=["{AttributeName=subscribed,KeyType=HASH}"],Projection={ProjectionType=ALL} \
+        IndexName=in_beta_email_index,KeySchema=["{AttributeName=in_beta,KeyType=HASH}","{AttributeName=notify_email,KeyType=RANGE}"],Projection={ProjectionType=ALL} \
+        IndexName=in_beta_webhook_index,KeySchema=["{AttributeName=in_beta,KeyType=HASH}","{AttributeName=notify_webhook,KeyType=RANGE}"],Projection={ProjectionType=ALL} \
+        IndexName=subscribed_email_index,KeySchema=["{AttributeName=subscribed,KeyType=HASH}","{AttributeName=notify_email,KeyType=RANGE}"],Projection={ProjectionType=ALL} \
+        IndexName=subscribed_webhook_index,KeySchema=["{AttributeName=subscribed,KeyType=HASH}","{AttributeName=notify_webhook,KeyType=RANGE}"],Projection={ProjectionType=ALL} \
     --billing-mode PAY_PER_REQUEST \
     --endpoint-url http://localhost:8000 \
     --no-cli-pager